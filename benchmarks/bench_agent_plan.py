@@ -0,0 +1,229 @@
+"""Memory and time benchmark of the plan of the ombt agents.
+
+For an increasing number of agents, plan a test case (generate_shard_conf on
+fake machines), serialize it as it is passed to Ansible and pickle it. The
+memory is the one held by the plan once built (tracemalloc).
+
+Each size is run with the agents of orchestrator.ombt (compact) and with the
+former agents (baseline): a full __dict__ per agent, the log paths and the
+command computed upfront and to_dict embedding the bus confs.
+
+    python benchmarks/bench_agent_plan.py
+    python benchmarks/bench_agent_plan.py --sizes 1000 10000
+"""
+import argparse
+import json
+import pickle
+import time
+import tracemalloc
+from contextlib import contextmanager
+from os import path
+
+from enoslib.host import Host
+
+import orchestrator.tasks as t
+from orchestrator.constants import DRIVER
+
+
+class BaselineAgent(object):
+    """An ombt agent as planned before the compact records."""
+
+    def __init__(self, **kwargs):
+        self.agent_id = kwargs["agent_id"]
+        self.machine = kwargs["machine"]
+        # one list per agent
+        self.control_agents = list(kwargs["control_agents"])
+        self.bus_agents = list(kwargs["bus_agents"])
+        self.timeout = kwargs["timeout"]
+        self.agent_type = self.get_type()
+        self.detach = True
+        self.topic = kwargs["topic"]
+        self.name = self.agent_id
+        self.docker_log = "/home/ombt/ombt-data/agent.log"
+        self.log = path.join("/tmp/ombt-data", "%s.log" % self.agent_id)
+        self.command = self.get_command()
+
+    def to_dict(self):
+        d = self.__dict__
+        d.update({
+            "control_agents": [a.to_dict() for a in self.control_agents],
+            "bus_agents": [a.to_dict() for a in self.bus_agents],
+        })
+        return d
+
+    def generate_connections(self):
+        connections = {}
+        for agents, agent_type in zip([self.control_agents, self.bus_agents],
+                                      ["control", "url"]):
+            connection = []
+            for agent in agents:
+                listener = agent.get_listener()
+                connection.append(
+                    "{{ hostvars['%s']['ansible_' + control_network]"
+                    "['ipv4']['address'] }}:%s" % (listener["machine"],
+                                                  listener["port"]))
+            connections[agent_type] = "%s://%s" % (agent.transport,
+                                                   ",".join(connection))
+        return "--control %s --url %s" % (connections["control"],
+                                          connections["url"])
+
+    def get_command(self):
+        return ["--debug", "--unique", "--timeout %s " % self.timeout,
+                "--topic %s " % self.topic, self.generate_connections(),
+                self.get_type()]
+
+
+class BaselineClient(BaselineAgent):
+
+    def get_type(self):
+        return "rpc-client"
+
+
+class BaselineServer(BaselineAgent):
+
+    def __init__(self, **kwargs):
+        self.executor = kwargs["executor"]
+        super(BaselineServer, self).__init__(**kwargs)
+
+    def get_command(self):
+        command = super(BaselineServer, self).get_command()
+        command.append("--executor %s" % self.executor)
+        return command
+
+    def get_type(self):
+        return "rpc-server"
+
+
+class BaselineController(BaselineAgent):
+
+    def __init__(self, **kwargs):
+        self.call_type = kwargs["call_type"]
+        self.nbr_calls = kwargs["nbr_calls"]
+        self.pause = kwargs["pause"]
+        self.length = kwargs["length"]
+        super(BaselineController, self).__init__(**kwargs)
+
+    def get_command(self):
+        command = super(BaselineController, self).get_command()
+        command.extend(["--output %s" % self.docker_log, self.call_type,
+                        "--calls %s" % self.nbr_calls,
+                        "--pause %s" % self.pause,
+                        "--length %s" % self.length])
+        return " ".join(command)
+
+    def get_type(self):
+        return "controller"
+
+
+REPRESENTATIONS = {
+    "compact": (t.OmbtClient, t.OmbtServer, t.OmbtController),
+    "baseline": (BaselineClient, BaselineServer, BaselineController),
+}
+
+
+@contextmanager
+def agents(representation):
+    """Plan with the agent classes of a representation."""
+    former = t.OmbtClient, t.OmbtServer, t.OmbtController
+    t.OmbtClient, t.OmbtServer, t.OmbtController = \
+        REPRESENTATIONS[representation]
+    try:
+        yield
+    finally:
+        t.OmbtClient, t.OmbtServer, t.OmbtController = former
+
+
+def fake_env(nbr_bus, nbr_machines, nbr_controllers):
+    def hosts(role, number):
+        return [Host("%s-%s" % (role, i)) for i in range(number)]
+
+    roles = {
+        "bus": hosts("bus", nbr_bus),
+        "control-bus": hosts("control", nbr_controllers),
+        "ombt-control": hosts("control", 1),
+        "ombt-client": hosts("agent", nbr_machines),
+        "ombt-server": hosts("agent", nbr_machines),
+    }
+    env = {"roles": roles}
+    env["bus_conf"] = t.generate_bus_conf({"type": "rabbitmq",
+                                           "number": nbr_bus},
+                                          roles["bus"], context="bus")
+    control_config = dict(DRIVER, number=nbr_controllers)
+    env["control_bus_conf"] = t.generate_bus_conf(control_config,
+                                                  roles["control-bus"],
+                                                  context="control-bus")
+    return env
+
+
+def plan(env, nbr_agents):
+    shards = len(env["control_bus_conf"])
+    ombt_confs = {}
+    s_clients = t.shard_value(nbr_agents // 2, shards, include_zero=True)
+    s_servers = t.shard_value(nbr_agents // 2, shards, include_zero=True)
+    for shard_index in range(shards):
+        ombt_conf = t.generate_shard_conf(
+            shard_index,
+            sum(s_servers[0:shard_index]),
+            sum(s_clients[0:shard_index]),
+            nbr_clients=s_clients[shard_index],
+            nbr_servers=s_servers[shard_index],
+            call_type="rpc-call", nbr_calls=100, pause=0, timeout=60,
+            length=1024, executor="threading", env=env,
+            topics=t.get_topics(1), iteration_id="bench")
+        t.merge_ombt_confs(ombt_confs, ombt_conf)
+    return ombt_confs
+
+
+def serialize(ombt_confs):
+    return {agent_type: {machine: [c.to_dict() for c in confs]
+                         for machine, confs in machines.items()}
+            for agent_type, machines in ombt_confs.items()}
+
+
+def bench(nbr_agents, nbr_machines, representation="compact"):
+    env = fake_env(nbr_bus=4, nbr_machines=nbr_machines, nbr_controllers=4)
+    tracemalloc.start()
+    start = time.time()
+    with agents(representation):
+        ombt_confs = plan(env, nbr_agents)
+    plan_time = time.time() - start
+    plan_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.time()
+    payload = json.dumps(serialize(ombt_confs))
+    serialize_time = time.time() - start
+    pickled = pickle.dumps(ombt_confs, protocol=2)
+    return {
+        "repr": representation,
+        "agents": nbr_agents,
+        "plan_s": plan_time,
+        "plan_mb": plan_memory / 1e6,
+        "serialize_s": serialize_time,
+        "extra_vars_mb": len(payload) / 1e6,
+        "pickle_mb": len(pickled) / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--machines", type=int, default=100)
+    parser.add_argument("--representations", nargs="+",
+                        choices=sorted(REPRESENTATIONS),
+                        default=["baseline", "compact"])
+    args = parser.parse_args()
+    columns = ["repr", "agents", "plan_s", "plan_mb", "serialize_s",
+               "extra_vars_mb", "pickle_mb"]
+    print(" ".join("%13s" % c for c in columns))
+    for size in args.sizes:
+        for representation in args.representations:
+            result = bench(size, args.machines, representation)
+            print(" ".join("%13.3f" % result[c]
+                           if isinstance(result[c], float)
+                           else "%13s" % result[c] for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Micro-benchmarks of the planning code of the orchestrator.
+
+Each benchmark times one planning function for several sizes (agents, topics,
+routers, sweep points...). Nothing is deployed, this runs offline.
+
+    python benchmarks/bench_planning.py --output results.json
+    python benchmarks/bench_planning.py --baseline results.json
+    python benchmarks/bench_planning.py --only get_conf get_topics --quick
+
+The results (best time of several runs per size) are written as JSON. Given a
+baseline (a previous output), the ratio to the baseline is printed and the
+exit code is non-zero if a benchmark got slower than --threshold times its
+baseline. Sizes exceeding the --budget (seconds) are flagged too.
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+
+import networkx as nx
+from enoslib.host import Host
+
+import orchestrator.campaign as c
+import orchestrator.tasks as t
+from orchestrator.qpid_dispatchgen import get_conf, round_robin
+
+from bench_agent_plan import fake_env, plan
+
+MACHINES = ["machine%02d" % i for i in range(10)]
+
+
+def fake_hosts(number):
+    return [Host("bus-%s" % i) for i in range(number)]
+
+
+def bench_shard_value(size):
+    return lambda: t.shard_value(size * 10, size, include_zero=True)
+
+
+def bench_shard_list(size):
+    topics = t.get_topics(size)
+    return lambda: t.shard_list(topics, 16, include_empty=True)
+
+
+def bench_get_topics(size):
+    return lambda: t.get_topics(size)
+
+
+def bench_merge_ombt_confs(size):
+    # size agents spread on 100 machines and 10 shards
+    shards = []
+    for shard in range(10):
+        machines = {}
+        for agent in range(shard, size, 10):
+            machines.setdefault("machine%s" % (agent % 100), []).append(agent)
+        shards.append({"rpc-client": machines})
+
+    def run():
+        ombt_confs = {}
+        for shard in shards:
+            t.merge_ombt_confs(ombt_confs, {
+                agent_type: {m: list(confs) for m, confs in machines.items()}
+                for agent_type, machines in shard.items()})
+        return ombt_confs
+    return run
+
+
+def bench_generate_shard_conf(size):
+    env = fake_env(nbr_bus=4, nbr_machines=100, nbr_controllers=4)
+    return lambda: plan(env, size)
+
+
+def bench_generate_bus_conf_rabbitmq(size):
+    hosts = fake_hosts(10)
+    config = {"type": "rabbitmq", "mode": "cluster", "number": size}
+    return lambda: t.generate_bus_conf(config, hosts, context="bus")
+
+
+def bench_generate_bus_conf_qdr(size):
+    hosts = fake_hosts(10)
+    config = {"type": "qdr", "topology": "random_regular_graph",
+              "args": [4, size]}
+    return lambda: t.generate_bus_conf(config, hosts, context="bus")
+
+
+def bench_get_conf(size):
+    graph = nx.random_regular_graph(4, size, seed=0)
+    return lambda: get_conf(graph, MACHINES, round_robin)
+
+
+def bench_get_conf_complete(size):
+    graph = nx.complete_graph(size)
+    return lambda: get_conf(graph, MACHINES, round_robin)
+
+
+def bench_sweep_with_lists(size):
+    # size sweep points (the zipped parameters count for one)
+    parameters = {
+        "nbr_clients": [1, 2, 3],
+        "nbr_servers": [1, 1, 1],
+        "nbr_calls": [100, 100, 100],
+        "pause": [0, 0, 0],
+        "driver": ["broker", "router"],
+        "length": list(range(max(size // 2, 1))),
+    }
+    arguments = c.TEST_CASES["test_case_1"]["zip"]
+    return lambda: c.sweep_with_lists(parameters, arguments)
+
+
+def bench_sort_parameters(size):
+    parameters = [{"driver": ["broker", "router"][i % 2],
+                   "call_type": ["rpc-call", "rpc-cast"][i // 2 % 2],
+                   "nbr_clients": (i * 7919) % size}
+                  for i in range(size)]
+    return lambda: c.sort_parameters(parameters, "nbr_clients")
+
+
+# name -> (benchmark, sizes, quick sizes)
+BENCHMARKS = {
+    "shard_value": (bench_shard_value,
+                    [1, 100, 10000, 100000], [1, 100]),
+    "shard_list": (bench_shard_list,
+                   [1, 1000, 100000, 1000000], [1, 1000]),
+    "get_topics": (bench_get_topics,
+                   [1, 1000, 100000, 1000000], [1, 1000]),
+    "merge_ombt_confs": (bench_merge_ombt_confs,
+                         [1, 1000, 100000], [1, 1000]),
+    "generate_shard_conf": (bench_generate_shard_conf,
+                            [1, 1000, 10000, 100000], [1, 1000]),
+    "generate_bus_conf_rabbitmq": (bench_generate_bus_conf_rabbitmq,
+                                   [1, 100, 1000], [1, 100]),
+    "generate_bus_conf_qdr": (bench_generate_bus_conf_qdr,
+                              [10, 100, 1000, 5000], [10, 100]),
+    "get_conf": (bench_get_conf,
+                 [10, 100, 1000, 5000], [10, 100]),
+    "get_conf_complete": (bench_get_conf_complete,
+                          [10, 100, 500, 1000], [10, 100]),
+    "sweep_with_lists": (bench_sweep_with_lists,
+                         [1, 100, 10000], [1, 100]),
+    "sort_parameters": (bench_sort_parameters,
+                        [1, 1000, 100000, 1000000], [1, 1000]),
+}
+
+
+def measure(fn, min_time=0.2, max_runs=10):
+    """Best and mean time of fn over a few runs (at least one)."""
+    durations = []
+    while not durations or (sum(durations) < min_time and
+                            len(durations) < max_runs):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return {
+        "best_s": min(durations),
+        "mean_s": sum(durations) / len(durations),
+        "runs": len(durations)
+    }
+
+
+def key(name, size):
+    return "%s[%s]" % (name, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        help="benchmarks to run (default to all)")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes only")
+    parser.add_argument("--output", help="where to write the results")
+    parser.add_argument("--baseline", help="results to compare with")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="max slowdown allowed w.r.t the baseline")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="time budget of a single run (seconds)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    print("%-40s %10s %10s %6s %9s" % ("benchmark", "best (s)", "mean (s)",
+                                       "runs", "baseline"))
+    for name in args.only or sorted(BENCHMARKS):
+        bench, sizes, quick_sizes = BENCHMARKS[name]
+        for size in quick_sizes if args.quick else sizes:
+            result = measure(bench(size))
+            results[key(name, size)] = result
+            flags = []
+            ratio = ""
+            if key(name, size) in baseline:
+                reference = baseline[key(name, size)]["best_s"]
+                ratio = "x%.2f" % (result["best_s"] / reference)
+                # tiny durations are only noise
+                if result["best_s"] > args.threshold * reference and \
+                        result["best_s"] > 1e-3:
+                    flags.append("REGRESSION")
+                    regressions.append(key(name, size))
+            if result["best_s"] > args.budget:
+                flags.append("OVER BUDGET")
+            print("%-40s %10.4f %10.4f %6d %9s %s" % (
+                key(name, size), result["best_s"], result["mean_s"],
+                result["runs"], ratio, " ".join(flags)))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "date": datetime.datetime.now().isoformat(),
+                    "python": sys.version.split()[0],
+                    "platform": platform.platform(),
+                },
+                "results": results
+            }, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print("Regressions: %s" % ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
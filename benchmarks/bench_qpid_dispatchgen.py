@@ -0,0 +1,52 @@
+"""Scaling benchmark of the qdr configuration generator.
+
+Generates the configuration of complete graphs (the most demanding topology
+in term of edges) and sparser graphs for an increasing number of routers.
+
+    python benchmarks/bench_qpid_dispatchgen.py
+    python benchmarks/bench_qpid_dispatchgen.py --sizes 100 1000 --machines 50
+"""
+import argparse
+import time
+
+import networkx as nx
+
+from orchestrator.qpid_dispatchgen import get_conf, iter_conf, round_robin
+
+
+def bench(graph, machines, streaming):
+    start = time.time()
+    if streaming:
+        edges = 0
+        for _, conf in iter_conf(graph, machines, round_robin):
+            edges += len(conf["connectors"])
+    else:
+        confs = get_conf(graph, machines, round_robin)
+        edges = sum(len(c["connectors"]) for c in confs.values())
+    return time.time() - start, edges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 100, 500, 1000, 1500])
+    parser.add_argument("--sparse-sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--machines", type=int, default=10)
+    args = parser.parse_args()
+
+    machines = ["machine%02d" % i for i in range(args.machines)]
+    graphs = [("complete_graph", n, nx.complete_graph(n)) for n in args.sizes]
+    graphs.extend(("random_regular_graph", n, nx.random_regular_graph(4, n))
+                  for n in args.sparse_sizes)
+    print("%-22s %8s %10s %10s %10s" % ("topology", "routers", "edges",
+                                        "dict (s)", "stream (s)"))
+    for name, n, graph in graphs:
+        duration, edges = bench(graph, machines, streaming=False)
+        s_duration, _ = bench(graph, machines, streaming=True)
+        print("%-22s %8d %10d %10.3f %10.3f" % (name, n, edges,
+                                                duration, s_duration))
+
+
+if __name__ == "__main__":
+    main()
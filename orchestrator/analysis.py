@@ -0,0 +1,342 @@
+"""Results of a campaign as a columnar dataset.
+
+The controllers dump the results of their agents in their output (fetched in
+the backup directory of each iteration as <host>_<controller>.log). Each line
+is a JSON object mapping an agent name to its results: the first line gives
+the results of the clients, the second one those of the servers::
+
+    {"rpc-client-0-topic-0-...": {"start_time": 1530000000.0,
+                                  "stop_time": 1530000010.0,
+                                  "msgs_ok": 100, "msgs_fail": 0,
+                                  "latency": {"min": 0.5, "max": 12.0,
+                                              "total": 150.0, "count": 100,
+                                              "sum_of_squares": 400.0,
+                                              "distribution": {...}},
+                                  "errors": {}}}
+
+The dataset has one row per iteration and agent, with the stats of the agent
+and the parameters of the iteration (see orchestrator.journal). It is kept as
+columns (name -> list of values) and saved as .npz (numpy), .parquet
+(pyarrow) or .json.
+
+The percentiles of the latency can't be derived from the stats of each agent
+(or controller). They are computed from the distribution of the latency
+reported by ombt: a log-bucketed histogram (10 linear buckets per power of
+10, in ms) which is summed across agents and controllers, so its size only
+depends on the range of the latencies (see :py:func:`latencies`).
+"""
+import glob
+import json
+import math
+import multiprocessing
+from os import path
+
+import orchestrator.journal as journal
+
+# order of the results in the output of a controller
+SIDES = ["client", "server"]
+# the stats columns (the parameters of the iterations follow)
+STATS = ["iteration", "controller", "side", "agent", "msgs_ok", "msgs_fail",
+         "errors", "start_time", "stop_time", "duration", "throughput",
+         "latency_count", "latency_min", "latency_max", "latency_mean",
+         "latency_std"]
+
+
+def agent_row(agent, results):
+    """Flatten the results of an agent.
+
+    >>> row = agent_row("rpc-client-0", {
+    ...     "start_time": 10.0, "stop_time": 12.0, "msgs_ok": 4,
+    ...     "msgs_fail": 0, "errors": {},
+    ...     "latency": {"min": 1.0, "max": 3.0, "total": 8.0, "count": 4,
+    ...                 "sum_of_squares": 20.0}})
+    >>> row["throughput"], row["latency_mean"], row["latency_std"]
+    (2.0, 2.0, 1.0)
+
+    :param agent: the name of the agent
+    :param results: the results of the agent (as dumped by ombt)
+    """
+    start, stop = results.get("start_time"), results.get("stop_time")
+    duration = stop - start if start is not None and stop is not None \
+        else None
+    msgs_ok = results.get("msgs_ok", 0)
+    latency = results.get("latency", {})
+    count = latency.get("count", 0)
+    mean, std = None, None
+    if count:
+        mean = latency["total"] / float(count)
+        # rounding may give a slightly negative variance
+        std = math.sqrt(max(latency["sum_of_squares"] / float(count) -
+                            mean ** 2, 0))
+    return {
+        "agent": agent,
+        "msgs_ok": msgs_ok,
+        "msgs_fail": results.get("msgs_fail", 0),
+        "errors": sum(results.get("errors", {}).values()),
+        "start_time": start,
+        "stop_time": stop,
+        "duration": duration,
+        "throughput": msgs_ok / duration if duration else None,
+        "latency_count": count,
+        "latency_min": latency.get("min"),
+        "latency_max": latency.get("max"),
+        "latency_mean": mean,
+        "latency_std": std,
+    }
+
+
+def read_controller(controller_log):
+    """Iterate over the (side, agent, results) of a controller output."""
+    with open(controller_log) as f:
+        lines = [line for line in f if line.strip()]
+    for side, line in zip(SIDES, lines):
+        for agent, results in sorted(json.loads(line).items()):
+            yield side, agent, results
+
+
+def parse_controller(controller_log):
+    """Rows of the agents reported in the output of a controller."""
+    rows = []
+    for side, agent, results in read_controller(controller_log):
+        row = agent_row(agent, results)
+        row["side"] = side
+        rows.append(row)
+    return rows
+
+
+def get_controller_logs(backup_dir):
+    """Outputs of the controllers fetched in a backup directory."""
+    logs = glob.glob(path.join(backup_dir, "*_controller-*.log"))
+    return sorted(f for f in logs if not f.endswith("_docker.log"))
+
+
+def analyze_iteration(args):
+    """Rows of an iteration (run in the worker processes).
+
+    :param args: (the environment directory, the parameters of the iteration)
+    """
+    env_dir, params = args
+    iteration = params["backup_dir"]
+    parameters = dict((k, v) for k, v in params.items() if k != "backup_dir")
+    rows = []
+    for controller_log in get_controller_logs(path.join(env_dir, iteration)):
+        controller = path.basename(controller_log)[:-len(".log")]
+        for row in parse_controller(controller_log):
+            row.update(iteration=iteration, controller=controller)
+            row.update(parameters)
+            rows.append(row)
+    return rows
+
+
+def merge_distribution(histogram, distribution):
+    """Add a latency distribution of ombt to a histogram (in place).
+
+    The keys of the distribution are the powers of 10 (they may be strings
+    once serialized) and the values the counts of the 10 buckets.
+
+    >>> histogram = merge_distribution({}, {"0": [1, 2] + [0] * 8})
+    >>> merge_distribution(histogram, {0: [1] + [0] * 9, 1: [0, 3] + [0] * 8})
+    {0: [2, 2, 0, 0, 0, 0, 0, 0, 0, 0], 1: [0, 3, 0, 0, 0, 0, 0, 0, 0, 0]}
+
+    :param histogram: the histogram (power -> counts)
+    :param distribution: the distribution to add
+    :return: the histogram
+    """
+    for power, counts in distribution.items():
+        buckets = histogram.setdefault(int(power), [0] * len(counts))
+        for index, count in enumerate(counts):
+            buckets[index] += count
+    return histogram
+
+
+def percentile(histogram, q):
+    """Percentile of a histogram, interpolated within its bucket.
+
+    >>> histogram = {0: [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+    ...              1: [0, 90, 0, 0, 0, 0, 0, 0, 0, 0],
+    ...              2: [0, 0, 0, 0, 0, 0, 0, 0, 0, 10]}
+    >>> percentile(histogram, 50)
+    15.555555555555555
+    >>> percentile(histogram, 99)
+    990.0
+    >>> percentile({}, 99) is None
+    True
+
+    :param histogram: the histogram (power -> counts)
+    :param q: the percentile (between 0 and 100)
+    """
+    total = sum(sum(counts) for counts in histogram.values())
+    if not total:
+        return None
+    rank = q / 100.0 * total
+    seen = 0
+    for power in sorted(histogram):
+        base = 10 ** power
+        for index, count in enumerate(histogram[power]):
+            if count and seen + count >= rank:
+                return base * (index + (rank - seen) / float(count))
+            seen += count
+    # q is 100
+    return float(base * len(histogram[power]))
+
+
+def iteration_histograms(args):
+    """Latency histograms of an iteration per side (run in the workers).
+
+    :param args: (the environment directory, the parameters of the iteration)
+    """
+    env_dir, params = args
+    return params, get_histograms(path.join(env_dir, params["backup_dir"]))
+
+
+def get_histograms(backup_dir):
+    """Latency histograms per side of all the agents of a backup directory."""
+    histograms = dict((side, {}) for side in SIDES)
+    for controller_log in get_controller_logs(backup_dir):
+        for side, _, results in read_controller(controller_log):
+            merge_distribution(histograms[side], results.get(
+                "latency", {}).get("distribution", {}))
+    return histograms
+
+
+def get_metrics(backup_dir, percentiles=(50, 99, 99.9)):
+    """Headline metrics of an iteration, seen from the clients.
+
+    :param backup_dir: the backup directory of the iteration
+    :param percentiles: the percentiles of the latency to compute
+    :return: the number of clients, messages (ok and failed), the aggregated
+        throughput (calls/s) and the latency percentiles (ms)
+    """
+    histogram = {}
+    metrics = {"clients": 0, "msgs_ok": 0, "msgs_fail": 0}
+    starts, stops = [], []
+    for controller_log in get_controller_logs(backup_dir):
+        for side, _, results in read_controller(controller_log):
+            if side != "client":
+                continue
+            metrics["clients"] += 1
+            metrics["msgs_ok"] += results.get("msgs_ok", 0)
+            metrics["msgs_fail"] += results.get("msgs_fail", 0)
+            if results.get("start_time") is not None:
+                starts.append(results["start_time"])
+            if results.get("stop_time") is not None:
+                stops.append(results["stop_time"])
+            merge_distribution(histogram, results.get(
+                "latency", {}).get("distribution", {}))
+    duration = max(stops) - min(starts) if starts and stops else None
+    metrics["throughput"] = metrics["msgs_ok"] / duration if duration \
+        else None
+    for q in percentiles:
+        metrics["p%s" % q] = percentile(histogram, q)
+    return metrics
+
+
+def latencies(env_dir, percentiles=(50, 99, 99.9), processes=None):
+    """Global percentiles of the latency of each iteration.
+
+    The histograms of all the agents of an iteration (whatever their
+    controller) are merged before computing the percentiles.
+
+    :param env_dir: the environment directory
+    :param percentiles: the percentiles to compute
+    :param processes: number of worker processes
+    :return: the rows (iteration, side, count, p50... and the parameters) as
+        columns
+    """
+    rows = []
+    for params, histograms in _map_iterations(iteration_histograms, env_dir,
+                                              processes):
+        parameters = dict((k, v) for k, v in params.items()
+                          if k != "backup_dir")
+        for side in SIDES:
+            histogram = histograms[side]
+            row = {
+                "iteration": params["backup_dir"],
+                "side": side,
+                "latency_count": sum(sum(c) for c in histogram.values())
+            }
+            for q in percentiles:
+                row["p%s" % q] = percentile(histogram, q)
+            row.update(parameters)
+            rows.append(row)
+    return to_columns(rows)
+
+
+def _map_iterations(fn, env_dir, processes=None):
+    tasks = [(env_dir, params)
+             for params in journal.load_parameters(env_dir)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(fn, tasks, chunksize=16):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def to_columns(rows):
+    """Turn rows into columns, missing values are None.
+
+    >>> columns = to_columns([{"a": 1}, {"a": 2, "b": "x"}])
+    >>> columns["a"], columns["b"]
+    ([1, 2], [None, 'x'])
+    """
+    names = list(STATS)
+    for row in rows:
+        for name in row:
+            if name not in names:
+                names.append(name)
+    names = [n for n in names if any(n in row for row in rows)]
+    return dict((n, [row.get(n) for row in rows]) for n in names)
+
+
+def analyze(env_dir, processes=None):
+    """Build the dataset of the iterations of an environment.
+
+    The iterations are parsed concurrently, one process per CPU by default.
+
+    :param env_dir: the environment directory
+    :param processes: number of worker processes
+    :return: the dataset as columns (name -> list of values)
+    """
+    rows = [row for iteration_rows in _map_iterations(analyze_iteration,
+                                                      env_dir, processes)
+            for row in iteration_rows]
+    return to_columns(rows)
+
+
+def _to_array(np, values):
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool)
+           for v in present):
+        if len(present) == len(values) and \
+                all(isinstance(v, int) for v in values):
+            return np.array(values, dtype=np.int64)
+        return np.array([float("nan") if v is None else v for v in values],
+                        dtype=np.float64)
+    return np.array(["" if v is None else str(v) for v in values])
+
+
+def save(columns, output):
+    """Save the dataset, the format is given by the extension of output.
+
+    .npz needs numpy and .parquet needs pyarrow (pip install
+    ombt-orchestrator[analysis]).
+
+    :param columns: the dataset (see :py:func:`analyze`)
+    :param output: where to save the dataset (.npz, .parquet or .json)
+    """
+    if output.endswith(".npz"):
+        import numpy as np
+        np.savez_compressed(output, **dict(
+            (name, _to_array(np, values)) for name, values in columns.items()))
+    elif output.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pydict(columns), output)
+    elif output.endswith(".json"):
+        with open(output, "w") as f:
+            json.dump(columns, f)
+    else:
+        raise ValueError("Unknown format of %s (.npz, .parquet or .json)"
+                         % output)
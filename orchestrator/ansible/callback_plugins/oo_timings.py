@@ -0,0 +1,86 @@
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: oo_timings
+    type: aggregate
+    short_description: records the duration of the plays and tasks
+    description:
+      - Appends a JSON record per play and per task to the timings file of
+        the current orchestrator task (see orchestrator/timings.py).
+      - Does nothing when OO_TIMINGS_FILE isn't set (e.g plain
+        ansible-playbook runs).
+    requirements:
+      - OO_TIMINGS_FILE and OO_TIMINGS_PARENT in the environment
+'''
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+# same as orchestrator.timings (not imported, ansible may load this file
+# outside of the orchestrator)
+FILE_VARIABLE = "OO_TIMINGS_FILE"
+PARENT_VARIABLE = "OO_TIMINGS_PARENT"
+
+
+class CallbackModule(CallbackBase):
+    """Record the plays and tasks timings of the orchestrator tasks."""
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'oo_timings'
+    CALLBACK_NEEDS_WHITELIST = False
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        # (name, start) of the current play and task
+        self.play = None
+        self.task = None
+
+    def _record(self, kind, current):
+        timings_file = os.environ.get(FILE_VARIABLE)
+        if current is None or not timings_file:
+            return
+        name, start = current
+        end = time.time()
+        entry = {
+            "kind": kind,
+            "phase": name,
+            "start": start,
+            "end": end,
+            "duration": end - start,
+            "status": "ok",
+            "parent": os.environ.get(PARENT_VARIABLE)
+        }
+        directory = os.path.dirname(timings_file)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(timings_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _end_task(self):
+        self._record("ansible_task", self.task)
+        self.task = None
+
+    def _end_play(self):
+        self._end_task()
+        self._record("play", self.play)
+        self.play = None
+
+    def v2_playbook_on_play_start(self, play):
+        self._end_play()
+        self.play = (play.get_name(), time.time())
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._end_task()
+        self.task = (task.get_name(), time.time())
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._end_task()
+        self.task = (task.get_name(), time.time())
+
+    def v2_playbook_on_stats(self, stats):
+        self._end_play()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""Start, stop or backup all the ombt agents of a host at once.
+
+This runs on the hosts (shipped by the ombt role) and talks directly to the
+Docker API, so that a single Ansible call per host starts all its agents
+concurrently.
+
+    ombt_launcher.py start --plan plan.json --image msimonin/ombt:singleton
+        --concurrency 32 --report report.json
+    ombt_launcher.py wait --plan plan.json --timeout 3600 --report report.json
+    ombt_launcher.py stop --concurrency 32
+    ombt_launcher.py backup --plan plan.json --prefix host-1 --sample 10
+        --archive logs.tar.gz
+
+The plan is the list of agents of the host (as serialized by the
+orchestrator). The report gives for each agent its start timestamp and the
+time it took to start its container (latency).
+
+wait returns as soon as all the agents of the plan have exited (it blocks on
+the Docker API, there's no polling) and fails as soon as one of them exits
+with a non-zero status. Its report gives the exit code and finish timestamp
+of each agent.
+
+backup collects concurrently the logs of the agents in a single archive:
+<prefix>_<name>_docker.log (output of docker logs) for every agent and
+<prefix>_<name>.log for the agents writing their own log file. Only the logs of
+the controllers are kept by default, with --sample N the logs of N clients and
+N servers too (-1 for all of them).
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import docker
+
+# agents writing their output through a mounted log file
+MOUNTED_LOG = ["controller"]
+
+
+def get_command(agent):
+    command = agent["command"]
+    if isinstance(command, list):
+        command = " ".join(str(c) for c in command)
+    return shlex.split(command)
+
+
+def prepare_log(agent):
+    log_dir = os.path.dirname(agent["log"])
+    if not os.path.isdir(log_dir):
+        try:
+            os.makedirs(log_dir)
+        except OSError:
+            # created concurrently
+            pass
+    os.chmod(log_dir, 0o777)
+    if agent["agent_type"] in MOUNTED_LOG:
+        with open(agent["log"], "a"):
+            pass
+        os.chmod(agent["log"], 0o777)
+
+
+def start_agent(client, image, agent):
+    start = time.time()
+    report = {"name": agent["name"], "agent_type": agent["agent_type"],
+              "start": start}
+    try:
+        prepare_log(agent)
+        volumes = {}
+        if agent["agent_type"] in MOUNTED_LOG:
+            volumes = {agent["log"]: {"bind": agent["docker_log"],
+                                      "mode": "rw"}}
+        client.containers.run(image,
+                              command=get_command(agent),
+                              name=agent["name"],
+                              detach=agent.get("detach", True),
+                              network_mode="host",
+                              volumes=volumes)
+        report["status"] = "started"
+    except Exception as error:
+        report["status"] = "failed"
+        report["error"] = str(error)
+    report["latency"] = time.time() - report["start"]
+    return report
+
+
+def stop_container(container):
+    start = time.time()
+    report = {"name": container.name, "start": start}
+    try:
+        container.remove(force=True)
+        report["status"] = "removed"
+    except Exception as error:
+        report["status"] = "failed"
+        report["error"] = str(error)
+    report["latency"] = time.time() - report["start"]
+    return report
+
+
+def wait_container(client, agent, deadline, results):
+    report = {"name": agent["name"], "agent_type": agent["agent_type"]}
+    try:
+        container = client.containers.get(agent["name"])
+        status = container.wait(timeout=max(deadline - time.time(), 1))
+        # docker-py < 3 returns the exit code, then a dict
+        if isinstance(status, dict):
+            status = status["StatusCode"]
+        report["finished"] = time.time()
+        report["exit_code"] = status
+        container.reload()
+        report["finished_at"] = container.attrs["State"]["FinishedAt"]
+        report["status"] = "exited" if status == 0 else "failed"
+        if status != 0:
+            report["error"] = "exited with status %s" % status
+    except Exception as error:
+        report["finished"] = time.time()
+        report["status"] = "failed"
+        report["error"] = str(error)
+    results.put(report)
+
+
+def backup_agent(client, agent, staging, prefix):
+    report = {"name": agent["name"], "agent_type": agent["agent_type"],
+              "start": time.time()}
+    try:
+        container = client.containers.get(agent["name"])
+        # same as `docker logs <name> > <file>`
+        logs = container.logs(stdout=True, stderr=False)
+        docker_log = os.path.join(staging, "%s_%s_docker.log" % (
+            prefix, agent["name"]))
+        with open(docker_log, "wb") as f:
+            f.write(logs)
+        if agent["agent_type"] in MOUNTED_LOG:
+            shutil.copy(agent["log"], os.path.join(staging, "%s_%s.log" % (
+                prefix, agent["name"])))
+        report["status"] = "saved"
+    except Exception as error:
+        report["status"] = "failed"
+        report["error"] = str(error)
+    report["latency"] = time.time() - report["start"]
+    return report
+
+
+def sample(agents, number):
+    """Keep all the controllers and number agents of the other types."""
+    if number < 0:
+        return agents
+    kept = []
+    counts = {}
+    for agent in agents:
+        agent_type = agent["agent_type"]
+        counts[agent_type] = counts.get(agent_type, 0) + 1
+        if agent_type in MOUNTED_LOG or counts[agent_type] <= number:
+            kept.append(agent)
+    return kept
+
+
+def ensure_image(client, image):
+    try:
+        client.images.get(image)
+    except docker.errors.ImageNotFound:
+        client.images.pull(image)
+
+
+def start(args):
+    with open(args.plan) as f:
+        agents = json.load(f)
+    client = docker.from_env()
+    # pull once before starting the agents concurrently
+    if agents:
+        ensure_image(client, args.image)
+    pool = ThreadPool(args.concurrency)
+    try:
+        return pool.map(lambda a: start_agent(client, args.image, a), agents)
+    finally:
+        pool.close()
+
+
+def stop(args):
+    client = docker.from_env()
+    # same selection as `docker ps -a | grep ombt` on the image column
+    containers = [c for c in client.containers.list(all=True)
+                  if "ombt" in c.attrs["Config"]["Image"]]
+    pool = ThreadPool(args.concurrency)
+    try:
+        return pool.map(stop_container, containers)
+    finally:
+        pool.close()
+
+
+def wait(args):
+    with open(args.plan) as f:
+        agents = json.load(f)
+    client = docker.from_env()
+    deadline = time.time() + args.timeout
+    results = queue.Queue()
+    for agent in agents:
+        thread = threading.Thread(target=wait_container,
+                                  args=(client, agent, deadline, results))
+        thread.daemon = True
+        thread.start()
+
+    reports = []
+    while len(reports) < len(agents):
+        report = results.get()
+        reports.append(report)
+        if report["status"] == "failed":
+            # fail fast, don't wait for the other agents
+            break
+    return reports
+
+
+def backup(args):
+    with open(args.plan) as f:
+        plan = json.load(f)
+    # the plan of the host: agent type -> agents
+    agents = sample([a for agents in plan.values() for a in agents],
+                    args.sample)
+    client = docker.from_env()
+    staging = tempfile.mkdtemp()
+    pool = ThreadPool(args.concurrency)
+    try:
+        reports = pool.map(
+            lambda a: backup_agent(client, a, staging, args.prefix), agents)
+        with tarfile.open(args.archive, "w:gz") as archive:
+            for name in sorted(os.listdir(staging)):
+                archive.add(os.path.join(staging, name), arcname=name)
+        return reports
+    finally:
+        pool.close()
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("action", choices=["start", "wait", "stop", "backup"])
+    parser.add_argument("--plan", help="plan of the agents to start")
+    parser.add_argument("--image", help="ombt image to use")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="max number of concurrent docker calls")
+    parser.add_argument("--timeout", type=int, default=3600,
+                        help="max time to wait for the agents (seconds)")
+    parser.add_argument("--report", help="where to write the report")
+    parser.add_argument("--archive", help="archive of the logs (backup)")
+    parser.add_argument("--prefix", default="",
+                        help="prefix of the log files (backup)")
+    parser.add_argument("--sample", type=int, default=0,
+                        help="number of logs kept per agent type other than "
+                             "controller, -1 for all (backup)")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    reports = {"start": start, "wait": wait, "stop": stop,
+               "backup": backup}[args.action](args)
+    duration = time.time() - start_time
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(reports, f)
+
+    failed = [r for r in reports if r["status"] == "failed"]
+    latencies = sorted(r["latency"] for r in reports if "latency" in r)
+    print(json.dumps({
+        "action": args.action,
+        "agents": len(reports),
+        "failed": len(failed),
+        "duration": duration,
+        "max_latency": latencies[-1] if latencies else None,
+    }))
+    for report in failed:
+        print("%s: %s" % (report["name"], report["error"]), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
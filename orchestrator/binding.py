@@ -0,0 +1,107 @@
+"""Binding of the ombt agents to the bus agents.
+
+A binding is built once per test case for a list of bus agents and then
+called for each ombt agent with its index and its machine. It returns the bus
+agent the ombt agent will connect to.
+"""
+import heapq
+import re
+
+
+def locality(machine):
+    """Locality group of a machine.
+
+    Machines are grouped by cluster, inferred from their name.
+
+    >>> locality("parasilo-3.rennes.grid5000.fr")
+    'parasilo'
+    >>> locality("enos-0")
+    'enos'
+    >>> locality("machine01")
+    'machine'
+    >>> locality("localhost")
+    'localhost'
+
+    :param machine: alias of the machine
+    """
+    name = machine.split(".")[0]
+    return re.split(r"-?[0-9]", name, maxsplit=1)[0] or name
+
+
+class RoundRobin(object):
+    """Binds the agents to the bus agents in turn.
+
+    >>> bind = RoundRobin(["bus-0", "bus-1"])
+    >>> [bind(idx, "machine01") for idx in range(3)]
+    ['bus-0', 'bus-1', 'bus-0']
+    """
+
+    def __init__(self, bus_agents):
+        self.bus_agents = bus_agents
+
+    def __call__(self, idx, machine):
+        return self.bus_agents[idx % len(self.bus_agents)]
+
+
+class Locality(object):
+    """Binds the agents to the closest and least loaded bus agents.
+
+    A bus agent on the same machine is preferred, then one on the same
+    cluster (see :py:func:`locality`) and finally any bus agent. Inside each of
+    these groups the least loaded bus agent (in number of bound agents) is
+    chosen. Binding an agent is O(log n).
+
+    >>> from orchestrator.ombt import RabbitMQConf
+    >>> bus_agents = [RabbitMQConf({"machine": m, "port": 5672})
+    ...               for m in ["paravance-1", "parasilo-1", "parasilo-2"]]
+    >>> bind = Locality(bus_agents)
+    >>> [bind(idx, "paravance-1").conf["machine"] for idx in range(2)]
+    ['paravance-1', 'paravance-1']
+    >>> [bind(idx, "parasilo-7").conf["machine"] for idx in range(3)]
+    ['parasilo-1', 'parasilo-2', 'parasilo-1']
+    >>> [bind(idx, "paranoia-1").conf["machine"] for idx in range(3)]
+    ['parasilo-2', 'paravance-1', 'parasilo-1']
+    """
+
+    def __init__(self, bus_agents):
+        self.bus_agents = bus_agents
+        self.loads = [0] * len(bus_agents)
+        by_machine = {}
+        by_locality = {}
+        for position, bus_agent in enumerate(bus_agents):
+            machine = bus_agent.get_listener()["machine"]
+            by_machine.setdefault(machine, []).append((0, position))
+            by_locality.setdefault(locality(machine), []).append((0, position))
+        # heaps of (load, position), loads are lazily updated
+        self.by_machine = by_machine
+        self.by_locality = by_locality
+        self.everywhere = [(0, position) for position in range(len(bus_agents))]
+
+    def _least_loaded(self, heap):
+        # loads only increase: an entry with an up to date load on top of the
+        # heap is the least loaded bus agent
+        while True:
+            load, position = heap[0]
+            if load == self.loads[position]:
+                return position
+            heapq.heapreplace(heap, (self.loads[position], position))
+
+    def __call__(self, idx, machine):
+        heap = self.by_machine.get(machine) or \
+            self.by_locality.get(locality(machine)) or \
+            self.everywhere
+        position = self._least_loaded(heap)
+        self.loads[position] += 1
+        return self.bus_agents[position]
+
+
+BINDINGS = {
+    "round_robin": RoundRobin,
+    "locality": Locality
+}
+
+
+def get_binding(name, bus_agents):
+    if name not in BINDINGS:
+        raise TypeError("Unknown binding chosen")
+    return BINDINGS[name](bus_agents)
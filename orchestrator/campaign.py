@@ -3,7 +3,9 @@ from __future__ import generators
 import functools
 import itertools
 import json
+import multiprocessing
 import operator
+import sqlite3
 import string
 import time
 import traceback
@@ -14,12 +16,24 @@ import execo_engine
 from enoslib.errors import EnosError
 from execo_engine import ParamSweeper, HashableDict
 
+import orchestrator.analysis as analysis
+import orchestrator.catalog as catalog
+import orchestrator.journal as journal
+import orchestrator.partition as partition
+import orchestrator.sweep as sweep
 import orchestrator.tasks as t
+import orchestrator.timings as timings
+from orchestrator.constants import CATALOG
+from orchestrator.watchdog import Saturated
+
+
+def condition_1(parameters):
+    return parameters["nbr_servers"] <= parameters["nbr_clients"]
 
 
 def filter_1(condition, parameters):
     if not condition:
-        condition = (lambda x: x["nbr_servers"] <= x["nbr_clients"])
+        condition = condition_1
     return filter_params(parameters, condition=condition)
 
 
@@ -204,6 +218,7 @@ def fix_3(parameters, current_parameters):
 TEST_CASES = {
     "test_case_1": {"defn": t.test_case_1,
                     "filtr": filter_1,
+                    "condition": condition_1,
                     "fixp": fix_1,
                     "key": "nbr_clients",
                     "zip": ["nbr_servers", "nbr_clients",
@@ -225,27 +240,68 @@ TEST_CASES = {
 }
 
 
-def dump_parameters(directory, params):
-    """Dump each parameter set in the backup directory.
-
-    All parameters are dumped in the file <test>/params.json.
-    If previous are found new ones are appended.
-
-    :param directory: working directory
-    :param params: JSON parameters to dump
+def backup_saturated(backup_directory, env_dir):
+    """Backup what's left of an iteration aborted by the watchdog."""
+    try:
+        t.backup(backup_dir=backup_directory, env=env_dir)
+    except EnosError:
+        # e.g the outputs of the removed controllers are missing
+        traceback.print_exc()
+
+
+def record_point(env_dir, test, point, point_status):
+    """Update the status of a sweep point in the catalog."""
+    try:
+        catalog.record(CATALOG, env_dir, test, point=point,
+                       point_status=point_status)
+    except sqlite3.Error:
+        traceback.print_exc()
+
+
+def record_iteration(env_dir, iteration_id, parameters, start, status="ok",
+                     test=None, point=None, point_status=None, reason=None,
+                     timings_dir=None, index=None):
+    """Record an iteration in the journal of the campaign and the catalog.
+
+    The timings of the tasks of the iteration and, when it succeeded, the
+    headline metrics read in its backup directory (partial for a saturated
+    one, none if they can't be read) are recorded with the parameters.
+
+    :param env_dir: working directory
+    :param iteration_id: the id of the iteration (see :py:func:`generate_id`)
+    :param parameters: the parameters of the iteration
+    :param start: when the iteration started
+    :param status: ok, failed or saturated
+    :param test: the test case of the campaign
+    :param point: the sweep point of the iteration
+    :param point_status: the status of the point in the sweeper
+    :param reason: why the iteration didn't succeed
+    :param timings_dir: where the timings of the iteration were recorded
+        (default to env_dir, see parallel_campaign)
+    :param index: the index of the journal kept in memory (see
+        journal.load_index), updated with the record
+    :return: the record of the iteration
     """
-    json_params = path.join(directory, "params.json")
-    if not path.exists(json_params):
-        with open(json_params, "w") as f:
-            json.dump([], f)
-    # Add current parameters
-
-    with open(json_params, "r") as f:
-        all_params = json.load(f)
-
-    all_params.append(params)
-    with open(json_params, "w") as f:
-        json.dump(all_params, f)
+    durations = timings.durations(timings_dir or env_dir, iteration_id)
+    durations["iteration"] = time.time() - start
+    metrics = None
+    if status != "failed":
+        try:
+            metrics = analysis.get_metrics(path.join(env_dir, iteration_id))
+        except (ValueError, IOError):
+            # e.g the output of a controller removed by the watchdog is
+            # truncated, the iteration is recorded anyway
+            traceback.print_exc()
+    entry = journal.append(env_dir, iteration_id, parameters, status=status,
+                           timings=durations, metrics=metrics, reason=reason,
+                           index=index)
+    try:
+        catalog.record(CATALOG, env_dir, test, entry, point=point,
+                       point_status=point_status)
+    except sqlite3.Error:
+        # the journal is enough to rebuild the catalog (oo catalog)
+        traceback.print_exc()
+    return entry
 
 
 def generate_id(params):
@@ -268,11 +324,55 @@ def get_filter_function(name, flag):
     return functools.partial(filter_function, predicate)
 
 
+def get_condition(name, flag):
+    """The predicate of the sweep points of a test case (None for all)."""
+    return None if flag else TEST_CASES[name].get("condition")
+
+
+def get_sweeper(test, unfiltered, config, env_dir):
+    """The lazy sweeper of the points of a campaign (see orchestrator.sweep).
+
+    :param test: name of the test to execute
+    :param unfiltered: flag to set or avoid filter for sweeps
+    :param config: orchestration configuration
+    :param env_dir: the environment directory of the campaign
+    """
+    return sweep.LazySweeper(path.join(env_dir, "sweeps"),
+                             config["campaign"][test],
+                             key=TEST_CASES[test]["key"],
+                             condition=get_condition(test, unfiltered),
+                             name=test)
+
+
+def prefer_driver(filter_function, driver):
+    """Pick the parameters of the deployed driver first.
+
+    The order given by the filter function is kept otherwise. The bus of the
+    driver is then reused as long as possible (see tasks.prepare).
+
+    >>> filtr = prefer_driver(lambda p: p, "router")
+    >>> [p["driver"] for p in filtr([{"driver": "broker"},
+    ...                              {"driver": "router"},
+    ...                              {"driver": "broker"}])]
+    ['router', 'broker', 'broker']
+
+    :param filter_function: filter function of a test case
+    :param driver: the driver currently deployed
+    """
+    def filtr(parameters):
+        return sorted(filter_function(parameters),
+                      key=lambda p: p["driver"] != driver)
+    return filtr
+
+
 def override_network_constraints(parameters, env):
-    traffic_configuration_name = parameters.get("traffic")
-    if traffic_configuration_name is None:
-        return
+    """Apply the traffic of the parameters (if any).
 
+    The constraints are kept from one iteration to the next: only the changes
+    are applied (see tasks.emulate) and a parameters without traffic removes
+    the constraints of the previous iteration.
+    """
+    traffic_configuration_name = parameters.get("traffic")
     kwargs = {}
     for parameter in ["delay", "rate", "loss"]:
         with suppress(KeyError):
@@ -284,36 +384,186 @@ def override_network_constraints(parameters, env):
 
 
 def campaign(test, provider, unfiltered, force, config, env):
-    parameters = config["campaign"][test]
-    sweeps = execo_engine.sweep(parameters)
     env_dir = env if env else test
-    sweeper = ParamSweeper(persistence_dir=path.join(env_dir, "sweeps"),
-                           sweeps=sweeps, save_sweeps=True, name=test)
+    # the points come grouped by driver: its bus is reused as long as possible
+    sweeper = get_sweeper(test, unfiltered, config, env_dir)
     t.PROVIDERS[provider](force=force, config=config, env=env_dir)
     t.inventory(env=env_dir)
-    filter_function = get_filter_function(test, unfiltered)
-    current_parameters = sweeper.get_next(filter_function)
+    current_parameters = sweeper.get_next()
+    driver = None
     while current_parameters:
+        driver = current_parameters["driver"]
+        backup_directory = generate_id(current_parameters)
+        start = time.time()
+        with timings.iteration(env_dir, backup_directory):
+            try:
+                override_network_constraints(current_parameters, env_dir)
+                # the sweep point itself is kept as is for the sweeper
+                iteration_parameters = dict(current_parameters,
+                                            backup_dir=backup_directory)
+                t.validate(env=env_dir, directory=backup_directory)
+                # the bus is redeployed only if its configuration changed
+                t.prepare(driver=driver, env=env_dir)
+                TEST_CASES[test]["defn"](**iteration_parameters)
+                t.backup(backup_dir=backup_directory, env=env_dir)
+                sweeper.done(current_parameters)
+                record_iteration(env_dir, backup_directory,
+                                 iteration_parameters, start, test=test,
+                                 point=current_parameters, point_status="done")
+
+            except Saturated as error:
+                # a result: the load is beyond the capacity of the bus
+                backup_saturated(backup_directory, env_dir)
+                sweeper.done(current_parameters)
+                record_iteration(env_dir, backup_directory,
+                                 iteration_parameters, start,
+                                 status="saturated", test=test,
+                                 point=current_parameters, point_status="done",
+                                 reason=error.reason)
+
+            except (AttributeError, EnosError, RuntimeError,
+                    ValueError, KeyError, OSError) as error:
+                sweeper.skip(current_parameters)
+                traceback.print_exc()
+                record_iteration(env_dir, backup_directory,
+                                 dict(current_parameters,
+                                      backup_dir=backup_directory),
+                                 start, status="failed", test=test,
+                                 point=current_parameters,
+                                 point_status="skipped")
+                # don't reuse a deployment in an unknown state
+                t.destroy(env=env_dir)
+                t.reset(env=env_dir)
+        current_parameters = sweeper.get_next()
+
+    if driver:
+        t.reset(env=env_dir)
+        t.destroy(env=env_dir)
+
+
+def run_partition_iteration(args):
+    """Run a sweep point on a partition (in the worker processes).
+
+    :param args: (the test, the environment directory of the partition, the
+        parameters of the iteration)
+    :return: the status of the iteration and why it didn't succeed
+    """
+    test, partition_dir, iteration_parameters = args
+    backup_directory = iteration_parameters["backup_dir"]
+    status, reason = "ok", None
+    with timings.iteration(partition_dir, backup_directory):
         try:
-            override_network_constraints(current_parameters, env)
-            backup_directory = generate_id(current_parameters)
-            current_parameters.update({"backup_dir": backup_directory})
-            t.validate(env=env_dir, directory=backup_directory)
-            t.prepare(driver=current_parameters["driver"], env=env_dir)
-            TEST_CASES[test]["defn"](**current_parameters)
-            t.backup(backup_dir=backup_directory, env=env_dir)
-            sweeper.done(current_parameters)
-            dump_parameters(env_dir, current_parameters)
+            override_network_constraints(iteration_parameters, partition_dir)
+            t.validate(env=partition_dir, directory=backup_directory)
+            # the bus is redeployed only if its configuration changed
+            t.prepare(driver=iteration_parameters["driver"], env=partition_dir)
+            TEST_CASES[test]["defn"](env=partition_dir, **iteration_parameters)
+            t.backup(backup_dir=backup_directory, env=partition_dir)
+
+        except Saturated as error:
+            status, reason = "saturated", error.reason
+            backup_saturated(backup_directory, partition_dir)
 
         except (AttributeError, EnosError, RuntimeError,
                 ValueError, KeyError, OSError) as error:
-            sweeper.skip(current_parameters)
+            status, reason = "failed", str(error)
             traceback.print_exc()
+            # don't reuse a deployment in an unknown state
+            t.destroy(env=partition_dir)
+            t.reset(env=partition_dir)
+    return status, reason
+
+
+def parallel_campaign(test, provider, partitions, unfiltered, force, config,
+                      env):
+    """Run independent sweep points concurrently on partitions of the machines.
 
-        finally:
-            t.reset(env=env_dir)
-            t.destroy(env=env_dir)
-            current_parameters = sweeper.get_next(filter_function)
+    The machines are split into partitions (see orchestrator.partition) large
+    enough for any of the sweep points, up to the given number. Each
+    partition runs a sweep point at a time in a worker process, the
+    campaign keeps the sweeper, the journal and the catalog. The shared
+    services are deployed once for all the partitions.
+
+    :param test: name of the test to execute
+    :param provider: target infrastructure
+    :param partitions: max number of partitions (None for as many as fit)
+    :param unfiltered: flag to set or avoid filter for sweeps
+    :param force: override deployment configuration
+    :param config: orchestration configuration
+    :param env: directory containing the environment configuration
+    """
+    env_dir = env if env else test
+    sweeper = get_sweeper(test, unfiltered, config, env_dir)
+    t.PROVIDERS[provider](force=force, config=config, env=env_dir)
+    t.inventory(env=env_dir)
+    partition_config = config.get("partitions", {})
+    size = partition.max_size(
+        partition.get_size(p, config.get("drivers", {}), partition_config)
+        for p in sweeper.get_remaining())
+    if not size:
+        return
+    partition_dirs = t.partition(
+        size=size, number=partitions or partition_config.get("number"),
+        env=env_dir)
+    if not partition_dirs:
+        raise RuntimeError("The machines can't hold a partition of %s" % size)
+    print("Running the sweep points on %s partitions of %s" % (
+        len(partition_dirs), size))
+    t.services(env=env_dir)
+
+    free = list(reversed(partition_dirs))
+    used = set()
+    # partition -> (result, sweep point, iteration parameters, start)
+    running = {}
+    pool = multiprocessing.Pool(len(partition_dirs))
+    try:
+        while True:
+            while free:
+                current_parameters = sweeper.get_next()
+                if not current_parameters:
+                    break
+                partition_dir = free.pop()
+                used.add(partition_dir)
+                # the sweep point itself is kept as is for the sweeper
+                iteration_parameters = dict(
+                    current_parameters,
+                    backup_dir=generate_id(current_parameters))
+                result = pool.apply_async(
+                    run_partition_iteration,
+                    ((test, partition_dir, iteration_parameters),))
+                running[partition_dir] = (result, current_parameters,
+                                          iteration_parameters, time.time())
+            if not running:
+                break
+            done = [p for p, (result, _, _, _) in running.items()
+                    if result.ready()]
+            if not done:
+                time.sleep(1)
+                continue
+            for partition_dir in done:
+                result, current_parameters, iteration_parameters, start = \
+                    running.pop(partition_dir)
+                status, reason = result.get()
+                if status == "failed":
+                    sweeper.skip(current_parameters)
+                    point_status = "skipped"
+                else:
+                    sweeper.done(current_parameters)
+                    point_status = "done"
+                record_iteration(env_dir, iteration_parameters["backup_dir"],
+                                 iteration_parameters, start, status=status,
+                                 test=test, point=current_parameters,
+                                 point_status=point_status, reason=reason,
+                                 timings_dir=partition_dir)
+                free.append(partition_dir)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    for partition_dir in sorted(used):
+        t.reset(env=partition_dir)
+        t.destroy(env=partition_dir)
+    t.services(action="destroy", env=env_dir)
 
 
 def zip_parameters(parameters, arguments):
@@ -406,37 +656,254 @@ def incremental_campaign(test, provider, pause, unfiltered, force, config, env):
     current_group = sweeper.get_next(filter_function)
     # use uppercase letters to identify groups
     groups = itertools.cycle(string.ascii_uppercase)
+    current_driver = None
+    # the iteration in progress (id, parameters, start)
+    current_iteration = None
     while current_group:
         group_id = next(groups)
         # use numbers (incremental) to identify iterations by group
         iterations = itertools.count()
-        try:
-            current_driver = current_group["driver"]
-            t.prepare(driver=current_driver, env=env_dir)
-            for fixed_parameters in zip_parameters(current_group, arguments):
-                current_parameters = current_group.copy()
-                current_parameters.update(fixed_parameters)
-                iteration = next(iterations)
-                iteration_id = "{}-{}".format(group_id, iteration)
-                current_parameters.update({"iteration_id": iteration_id})
-                override_network_constraints(current_parameters, env)
-                backup_directory = generate_id(current_parameters)
+        current_driver = current_group["driver"]
+        # the deployment (prepare/destroy) is timed with the group
+        with timings.iteration(env_dir, "group-{}".format(group_id)):
+            try:
+                # the bus is redeployed only if its configuration changed
+                t.prepare(driver=current_driver, env=env_dir)
+                for fixed_parameters in zip_parameters(current_group, arguments):
+                    current_parameters = current_group.copy()
+                    current_parameters.update(fixed_parameters)
+                    iteration = next(iterations)
+                    iteration_id = "{}-{}".format(group_id, iteration)
+                    current_parameters.update({"iteration_id": iteration_id})
+                    backup_directory = generate_id(current_parameters)
+                    current_iteration = (backup_directory, current_parameters,
+                                         time.time())
+                    with timings.iteration(env_dir, backup_directory):
+                        override_network_constraints(current_parameters,
+                                                     env_dir)
+                        t.validate(env=env_dir, directory=backup_directory)
+                        current_parameters.update({"backup_dir": backup_directory})
+                        # fix number of clients and servers (or topics) to deploy
+                        TEST_CASES[test]["fixp"](parameters, current_parameters)
+                        TEST_CASES[test]["defn"](**current_parameters)
+                        t.backup(backup_dir=backup_directory, env=env_dir)
+                    record_iteration(env_dir, *current_iteration, test=test,
+                                     point=current_group,
+                                     point_status="inprogress")
+                    current_iteration = None
+                    time.sleep(pause)
+                sweeper.done(current_group)
+                record_point(env_dir, test, current_group, "done")
+
+            except Saturated as error:
+                # a result: the next loads of the group are beyond the
+                # capacity of the bus as well, the bus is kept
+                backup_saturated(current_iteration[0], env_dir)
+                sweeper.done(current_group)
+                record_iteration(env_dir, *current_iteration,
+                                 status="saturated", test=test,
+                                 point=current_group, point_status="done",
+                                 reason=error.reason)
+                current_iteration = None
+
+            except (AttributeError, EnosError, RuntimeError,
+                    ValueError, KeyError, OSError) as error:
+                sweeper.skip(current_group)
+                traceback.print_exc()
+                if current_iteration:
+                    record_iteration(env_dir, *current_iteration,
+                                     status="failed", test=test,
+                                     point=current_group,
+                                     point_status="skipped")
+                    current_iteration = None
+                else:
+                    record_point(env_dir, test, current_group, "skipped")
+                # don't reuse a deployment in an unknown state
+                t.destroy(env=env_dir)
+                t.reset(env=env_dir)
+        current_group = sweeper.get_next(
+            prefer_driver(filter_function, current_driver))
+
+    if current_driver:
+        t.reset(env=env_dir)
+        t.destroy(env=env_dir)
+
+
+def meets_slo(metrics, slo):
+    """Whether the metrics of an iteration meet the SLO.
+
+    The SLO gives the max value of some metrics (see analysis.get_metrics), a
+    missing metric doesn't meet it.
+
+    >>> slo = {"p99": 100, "msgs_fail": 0}
+    >>> meets_slo({"p99": 42.0, "msgs_fail": 0}, slo)
+    True
+    >>> meets_slo({"p99": 42.0, "msgs_fail": 3}, slo)
+    False
+    >>> meets_slo({"p99": None, "msgs_fail": 0}, slo)
+    False
+
+    :param metrics: the metrics of the iteration
+    :param slo: the max value of the metrics
+    """
+    return all(metrics.get(metric) is not None and metrics[metric] <= bound
+               for metric, bound in slo.items())
+
+
+def search_saturation(size, probe):
+    """Find the last of increasing loads meeting the SLO.
+
+    The loads are probed with an exponential ramp-up (0, 1, 3, 7...) until
+    one doesn't meet the SLO, the saturation point is then bisected. This
+    takes O(log(size)) probes, assuming that no load beyond the saturation
+    point meets the SLO.
+
+    >>> probed = []
+    >>> def probe(index):
+    ...     probed.append(index)
+    ...     return index <= 41
+    >>> search_saturation(100, probe)
+    41
+    >>> probed
+    [0, 1, 3, 7, 15, 31, 63, 47, 39, 43, 41, 42]
+    >>> search_saturation(100, lambda index: False)
+    -1
+    >>> search_saturation(100, lambda index: True)
+    99
+
+    :param size: number of loads
+    :param probe: tells whether the load of an index meets the SLO
+    :return: the index of the saturation point (-1 if no load meets the SLO)
+    """
+    good, bad = -1, size
+    while good < size - 1:
+        index = min(2 * good + 1, size - 1) if good >= 0 else 0
+        if not probe(index):
+            bad = index
+            break
+        good = index
+    while bad - good > 1:
+        index = (good + bad) // 2
+        if probe(index):
+            good = index
+        else:
+            bad = index
+    return good
+
+
+def probe_saturation(test, parameters, slo, env_dir, group, index):
+    """Run an iteration (unless already done) and check it against the SLO.
+
+    A failed (or saturated) iteration doesn't meet the SLO. The iterations
+    recorded ok or saturated by a former run of the campaign are reused, the
+    failed ones are run again.
+
+    :param group: the sweep point of the iteration (in progress)
+    :param index: the index of the journal (see journal.load_index), kept
+        up to date with the iterations run
+    :return: the record of the iteration and whether it meets the SLO
+    """
+    backup_directory = generate_id(parameters)
+    entry = journal.lookup(env_dir, backup_directory, index=index)
+    if entry is None or entry["status"] not in ["ok", "saturated"]:
+        iteration_parameters = dict(parameters, backup_dir=backup_directory)
+        start = time.time()
+        status = "ok"
+        reason = None
+        with timings.iteration(env_dir, backup_directory):
+            try:
+                override_network_constraints(parameters, env_dir)
                 t.validate(env=env_dir, directory=backup_directory)
-                current_parameters.update({"backup_dir": backup_directory})
-                # fix number of clients and servers (or topics) to deploy
-                TEST_CASES[test]["fixp"](parameters, current_parameters)
-                TEST_CASES[test]["defn"](**current_parameters)
+                # the bus is redeployed only if its configuration changed
+                t.prepare(driver=parameters["driver"], env=env_dir)
+                TEST_CASES[test]["defn"](**iteration_parameters)
                 t.backup(backup_dir=backup_directory, env=env_dir)
-                dump_parameters(env_dir, current_parameters)
+
+            except Saturated as error:
+                status, reason = "saturated", error.reason
+                backup_saturated(backup_directory, env_dir)
+
+            except (AttributeError, EnosError, RuntimeError,
+                    ValueError, KeyError, OSError) as error:
+                status = "failed"
+                traceback.print_exc()
+                # don't reuse a deployment in an unknown state
+                t.destroy(env=env_dir)
                 t.reset(env=env_dir)
-                time.sleep(pause)
-            sweeper.done(current_group)
+        entry = record_iteration(env_dir, backup_directory,
+                                 iteration_parameters, start, status=status,
+                                 test=test, point=group,
+                                 point_status="inprogress", reason=reason,
+                                 index=index)
+    return entry, entry["status"] == "ok" and meets_slo(entry["metrics"], slo)
 
-        except (AttributeError, EnosError, RuntimeError,
-                ValueError, KeyError, OSError) as error:
-            sweeper.skip(current_group)
-            traceback.print_exc()
 
-        finally:
-            t.destroy(env=env_dir)
-            current_group = sweeper.get_next(filter_function)
+def saturation_campaign(test, provider, slo, force, config, env):
+    """Search the saturation point of a test instead of sweeping all the loads.
+
+    The parameters are grouped as in the incremental campaign: for each
+    combination of the parameters which aren't zipped (driver, call_type...)
+    the zipped values are sorted on the key of the test (e.g nbr_clients) and
+    the largest one meeting the SLO is searched (see
+    :py:func:`search_saturation`). The bus of a group is reused between its
+    iterations. The saturation points are appended to
+    <env_dir>/saturation.jsonl.
+
+    :param test: name of the test to execute
+    :param provider: target infrastructure
+    :param slo: max value of the metrics of an iteration (see
+        :py:func:`meets_slo`)
+    :param force: override deployment configuration
+    :param config: orchestration configuration
+    :param env: directory containing the environment configuration
+    """
+    parameters = config["campaign"][test]
+    key = TEST_CASES[test]["key"]
+    arguments = TEST_CASES[test].get("zip", [key])
+    sweeps = sweep_with_lists(parameters, arguments)
+    env_dir = env if env else "{}-saturation".format(test)
+    sweeper = ParamSweeper(persistence_dir=path.join(env_dir, "sweeps"),
+                           sweeps=sweeps, save_sweeps=True, name=test)
+    t.PROVIDERS[provider](force=force, config=config, env=env_dir)
+    t.inventory(env=env_dir)
+    # the iterations of the former runs of the campaign are reused
+    index = journal.load_index(env_dir)
+    current_group = sweeper.get_next(prefer_driver(lambda p: p, None))
+    current_driver = None
+    while current_group:
+        current_driver = current_group["driver"]
+        loads = sorted(zip_parameters(current_group, arguments),
+                       key=operator.itemgetter(key))
+        entries = {}
+
+        def probe(position):
+            current_parameters = dict(current_group)
+            current_parameters.update(loads[position])
+            entries[position], ok = probe_saturation(
+                test, current_parameters, slo, env_dir, current_group, index)
+            return ok
+
+        saturation = search_saturation(len(loads), probe)
+        result = {
+            "group": dict((k, v) for k, v in current_group.items()
+                          if k not in arguments),
+            "key": key,
+            "slo": slo,
+            "probes": len(entries),
+            "loads": len(loads),
+            "saturation": loads[saturation] if saturation >= 0 else None,
+            "iteration": entries[saturation]["id"] if saturation >= 0
+            else None
+        }
+        with open(path.join(env_dir, "saturation.jsonl"), "a") as f:
+            f.write(json.dumps(result, sort_keys=True) + "\n")
+        print("Saturation of %s: %s (%s probes)" % (
+            result["group"], result["saturation"], result["probes"]))
+        sweeper.done(current_group)
+        record_point(env_dir, test, current_group, "done")
+        current_group = sweeper.get_next(
+            prefer_driver(lambda p: p, current_driver))
+
+    if current_driver:
+        t.reset(env=env_dir)
+        t.destroy(env=env_dir)
@@ -0,0 +1,230 @@
+"""Catalog of the campaigns: a local SQLite database.
+
+The campaigns record their iterations (see orchestrator.journal) and the
+status of their sweep points in the catalog (catalog.db in the working
+directory by default), former campaigns can be added with `oo catalog`. The
+iterations of all the campaigns can then be queried at once (`oo query`),
+e.g the best p99 of the rpc-calls across the routers at 1000 clients::
+
+    SELECT campaign, driver, p99 FROM results
+    WHERE call_type = 'rpc-call' AND driver GLOB 'router*'
+    AND nbr_clients = 1000 ORDER BY p99 LIMIT 1
+"""
+import json
+import sqlite3
+import time
+from os import path
+
+import orchestrator.journal as journal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    test TEXT,
+    env_dir TEXT NOT NULL UNIQUE,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS iterations (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+    iteration_id TEXT NOT NULL,
+    status TEXT,
+    time REAL,
+    backup_dir TEXT,
+    driver TEXT,
+    call_type TEXT,
+    nbr_clients INTEGER,
+    nbr_servers INTEGER,
+    nbr_topics INTEGER,
+    duration REAL,
+    msgs_ok INTEGER,
+    msgs_fail INTEGER,
+    throughput REAL,
+    p50 REAL,
+    p99 REAL,
+    p999 REAL,
+    parameters TEXT,
+    timings TEXT,
+    PRIMARY KEY (campaign_id, iteration_id)
+);
+CREATE INDEX IF NOT EXISTS iterations_driver ON iterations(driver);
+CREATE INDEX IF NOT EXISTS iterations_call_type ON iterations(call_type);
+CREATE INDEX IF NOT EXISTS iterations_nbr_clients ON iterations(nbr_clients);
+CREATE INDEX IF NOT EXISTS iterations_nbr_topics ON iterations(nbr_topics);
+CREATE TABLE IF NOT EXISTS sweeps (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+    point TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (campaign_id, point)
+);
+CREATE VIEW IF NOT EXISTS results AS
+    SELECT campaigns.name AS campaign, campaigns.test AS test, iterations.*
+    FROM iterations JOIN campaigns ON campaigns.id = iterations.campaign_id;
+"""
+
+# parameters promoted to (indexed) columns
+COLUMNS = ["driver", "call_type", "nbr_clients", "nbr_servers", "nbr_topics"]
+# status of the sweep points, as given by the ParamSweeper
+SWEEP_STATUS = ["done", "skipped", "inprogress", "remaining"]
+
+
+def connect(catalog):
+    """Open the catalog (created if needed).
+
+    :param catalog: path of the database
+    """
+    connection = sqlite3.connect(catalog, timeout=60)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _get_campaign(connection, env_dir, test=None):
+    env_dir = path.realpath(env_dir)
+    connection.execute(
+        "INSERT OR IGNORE INTO campaigns (name, test, env_dir) "
+        "VALUES (?, ?, ?)", (path.basename(env_dir), test, env_dir))
+    if test:
+        connection.execute("UPDATE campaigns SET test = ? WHERE env_dir = ?",
+                           (test, env_dir))
+    connection.execute("UPDATE campaigns SET updated = ? WHERE env_dir = ?",
+                       (time.time(), env_dir))
+    return connection.execute("SELECT id FROM campaigns WHERE env_dir = ?",
+                              (env_dir,)).fetchone()["id"]
+
+
+def _add_iteration(connection, campaign_id, entry):
+    parameters = entry["parameters"]
+    metrics = entry.get("metrics") or {}
+    row = [campaign_id, entry["id"], entry["status"], entry["time"],
+           entry["backup_dir"]]
+    row.extend(parameters.get(c) for c in COLUMNS)
+    row.append(entry.get("timings", {}).get("iteration"))
+    row.extend(metrics.get(m) for m in ["msgs_ok", "msgs_fail", "throughput",
+                                        "p50", "p99", "p99.9"])
+    row.extend([json.dumps(parameters, sort_keys=True),
+                json.dumps(entry.get("timings", {}), sort_keys=True)])
+    connection.execute("INSERT OR REPLACE INTO iterations VALUES (%s)"
+                       % ", ".join(["?"] * len(row)), row)
+
+
+def _set_sweeps(connection, campaign_id, sweeper):
+    connection.execute("DELETE FROM sweeps WHERE campaign_id = ?",
+                       (campaign_id,))
+    # the lazy sweepers don't give their remaining points (see sweep.py)
+    for status in getattr(sweeper, "statuses", SWEEP_STATUS):
+        points = getattr(sweeper, "get_%s" % status)()
+        connection.executemany(
+            "INSERT OR REPLACE INTO sweeps VALUES (?, ?, ?)",
+            [(campaign_id, json.dumps(dict(p), sort_keys=True), status)
+             for p in points])
+
+
+def _set_point(connection, campaign_id, point, status):
+    connection.execute("INSERT OR REPLACE INTO sweeps VALUES (?, ?, ?)",
+                       (campaign_id, json.dumps(dict(point), sort_keys=True),
+                        status))
+
+
+def record(catalog, env_dir, test, entry=None, point=None, point_status=None):
+    """Add an iteration of a campaign and the status of its point.
+
+    Only the sweep point of the iteration is updated (see :py:func:`index`
+    for all of them).
+
+    >>> import tempfile
+    >>> env_dir = tempfile.mkdtemp()
+    >>> catalog = path.join(env_dir, "catalog.db")
+    >>> point = {"driver": "broker", "nbr_clients": 10}
+    >>> entry = journal.append(env_dir, "A", dict(point, backup_dir="A"))
+    >>> record(catalog, env_dir, "test_case_1", entry, point=point,
+    ...        point_status="inprogress")
+    >>> record(catalog, env_dir, "test_case_1", point=point,
+    ...        point_status="done")
+    >>> query(catalog, "SELECT status FROM sweeps")
+    [{'status': 'done'}]
+
+    :param catalog: path of the database
+    :param env_dir: the environment directory of the campaign
+    :param test: the test case of the campaign
+    :param entry: the record of the iteration (see journal.append), None to
+        update the point only
+    :param point: the sweep point of the iteration
+    :param point_status: the status of the point in the sweeper (done,
+        skipped or inprogress)
+    """
+    connection = connect(catalog)
+    try:
+        with connection:
+            campaign_id = _get_campaign(connection, env_dir, test)
+            if entry is not None:
+                _add_iteration(connection, campaign_id, entry)
+            if point is not None:
+                _set_point(connection, campaign_id, point, point_status)
+    finally:
+        connection.close()
+
+
+def _read_entries(env_dir):
+    if path.exists(path.join(env_dir, journal.JOURNAL)):
+        return journal.read(env_dir)
+    # former campaign: only the parameters of the iterations done are known
+    return [{"id": p["backup_dir"], "status": "ok", "time": None,
+             "backup_dir": p["backup_dir"], "parameters": p}
+            for p in journal.load_parameters(env_dir)]
+
+
+def index(catalog, env_dir, test=None, sweeper=None):
+    """Add (or refresh) all the iterations of a campaign.
+
+    >>> import tempfile
+    >>> env_dir = tempfile.mkdtemp()
+    >>> _ = journal.append(env_dir, "A", {"driver": "router-4",
+    ...                                   "call_type": "rpc-call",
+    ...                                   "nbr_clients": 1000},
+    ...                    metrics={"p99": 12.5})
+    >>> _ = journal.append(env_dir, "B", {"driver": "broker",
+    ...                                   "call_type": "rpc-call",
+    ...                                   "nbr_clients": 1000},
+    ...                    metrics={"p99": 8.0})
+    >>> catalog = path.join(env_dir, "catalog.db")
+    >>> index(catalog, env_dir, test="test_case_1")
+    2
+    >>> query(catalog, "SELECT iteration_id, p99 FROM results "
+    ...                "WHERE driver GLOB 'router*' ORDER BY p99")
+    [{'iteration_id': 'A', 'p99': 12.5}]
+
+    :param catalog: path of the database
+    :param env_dir: the environment directory of the campaign
+    :param test: the test case of the campaign
+    :param sweeper: the ParamSweeper of the campaign
+    :return: the number of iterations added
+    """
+    connection = connect(catalog)
+    count = 0
+    try:
+        with connection:
+            campaign_id = _get_campaign(connection, env_dir, test)
+            for entry in _read_entries(env_dir):
+                _add_iteration(connection, campaign_id, entry)
+                count += 1
+            if sweeper is not None:
+                _set_sweeps(connection, campaign_id, sweeper)
+    finally:
+        connection.close()
+    return count
+
+
+def query(catalog, sql, parameters=()):
+    """Run a query on the catalog.
+
+    :param catalog: path of the database
+    :param sql: the query
+    :param parameters: the values of the placeholders of the query
+    :return: the rows as dicts
+    """
+    connection = connect(catalog)
+    try:
+        return [dict(row) for row in connection.execute(sql, parameters)]
+    finally:
+        connection.close()
@@ -1,13 +1,23 @@
+import json
 import logging
+from os import path
 
 import click
 import yaml
+from execo_engine import ParamSweeper
 
+import orchestrator.analysis as analysis
 import orchestrator.campaign as c
+import orchestrator.catalog as catalog
+import orchestrator.simulator as s
+import orchestrator.sweep as sweep
 import orchestrator.tasks as t
+import orchestrator.timings as timings
+import orchestrator.watchdog as watchdog
 from orchestrator.constants import TIMEOUT, PAUSE, NBR_CALLS, EXECUTOR, \
     LENGTH, ITERATION_PAUSE, CONF, BACKUP_DIR, NBR_CLIENTS, NBR_SERVERS, \
-    CALL_TYPE, VERSION, NBR_TOPICS, DRIVER_NAME
+    CALL_TYPE, VERSION, NBR_TOPICS, DRIVER_NAME, BACKUP_SAMPLE, CATALOG, \
+    SLO
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -23,6 +33,22 @@ def load_config(file_path):
     return configuration
 
 
+def check_watchdog(config, drivers):
+    """Reject a watchdog configuration which can't apply to some drivers.
+
+    :param config: the configuration
+    :param drivers: the names of the drivers of the campaign
+    """
+    if config.get("watchdog") is None:
+        return
+    for driver in drivers:
+        try:
+            watchdog.get_config(config["watchdog"],
+                                config["drivers"][driver]["type"])
+        except ValueError as error:
+            raise click.UsageError("%s (driver %s)" % (error, driver))
+
+
 @click.group()
 def cli():
     pass
@@ -151,7 +177,7 @@ def traffic(constraints, validate, reset, env):
         t.emulate(constraints=constraints, env=env)
 
     elif validate:
-        t.validate(env=env)
+        t.validate(full=True, env=env)
 
     elif reset:
         t.reset(env=env)
@@ -197,11 +223,14 @@ def perform_backup(backup, env):
 @click.option("--version",
               default=VERSION,
               help="ombt version as a docker tag")
+@click.option("--backup_sample",
+              default=BACKUP_SAMPLE,
+              help="number of client (and server) logs backed up per host (the controllers only by default), -1 for all")
 @click.option("--env",
               default=None,
               help="alternative environment directory")
 def test_case_1(nbr_clients, nbr_servers, call_type, nbr_calls,
-                pause, timeout, length, executor, version, env):
+                pause, timeout, length, executor, version, backup_sample, env):
     t.test_case_1(nbr_clients=nbr_clients,
                   nbr_servers=nbr_servers,
                   call_type=call_type,
@@ -211,6 +240,7 @@ def test_case_1(nbr_clients, nbr_servers, call_type, nbr_calls,
                   length=length,
                   executor=executor,
                   version=version,
+                  backup_sample=backup_sample,
                   env=env)
 
 
@@ -241,11 +271,14 @@ def test_case_1(nbr_clients, nbr_servers, call_type, nbr_calls,
 @click.option("--version",
               default=VERSION,
               help="ombt version as a docker tag")
+@click.option("--backup_sample",
+              default=BACKUP_SAMPLE,
+              help="number of client (and server) logs backed up per host (the controllers only by default), -1 for all")
 @click.option("--env",
               default=None,
               help="alternative environment directory")
 def test_case_2(nbr_topics, call_type, nbr_calls, pause,
-                timeout, length, executor, version, env):
+                timeout, length, executor, version, backup_sample, env):
     t.test_case_2(nbr_topics=nbr_topics,
                   call_type=call_type,
                   nbr_calls=nbr_calls,
@@ -254,6 +287,7 @@ def test_case_2(nbr_topics, call_type, nbr_calls, pause,
                   length=length,
                   executor=executor,
                   version=version,
+                  backup_sample=backup_sample,
                   env=env)
 
 
@@ -283,11 +317,14 @@ def test_case_2(nbr_topics, call_type, nbr_calls, pause,
 @click.option("--version",
               default=VERSION,
               help="ombt version as a docker tag")
+@click.option("--backup_sample",
+              default=BACKUP_SAMPLE,
+              help="number of client (and server) logs backed up per host (the controllers only by default), -1 for all")
 @click.option("--env",
               default=None,
               help="alternative environment directory")
 def test_case_3(nbr_clients, nbr_servers, nbr_calls, pause,
-                timeout, length, executor, version, env):
+                timeout, length, executor, version, backup_sample, env):
     t.test_case_3(nbr_clients=nbr_clients,
                   nbr_servers=nbr_servers,
                   nbr_calls=nbr_calls,
@@ -296,6 +333,7 @@ def test_case_3(nbr_clients, nbr_servers, nbr_calls, pause,
                   length=length,
                   executor=executor,
                   version=version,
+                  backup_sample=backup_sample,
                   env=env)
 
 
@@ -328,11 +366,14 @@ def test_case_3(nbr_clients, nbr_servers, nbr_calls, pause,
 @click.option("--version",
               default=VERSION,
               help="ombt version as a docker tag")
+@click.option("--backup_sample",
+              default=BACKUP_SAMPLE,
+              help="number of client (and server) logs backed up per host (the controllers only by default), -1 for all")
 @click.option("--env",
               default=None,
               help="alternative environment directory")
 def test_case_4(nbr_clients, nbr_servers, nbr_topics, nbr_calls,
-                pause, timeout, length, executor, version, env):
+                pause, timeout, length, executor, version, backup_sample, env):
     t.test_case_4(nbr_clients=nbr_clients,
                   nbr_servers=nbr_servers,
                   nbr_topics=nbr_topics,
@@ -342,6 +383,7 @@ def test_case_4(nbr_clients, nbr_servers, nbr_topics, nbr_calls,
                   length=length,
                   executor=executor,
                   version=version,
+                  backup_sample=backup_sample,
                   env=env)
 
 
@@ -353,6 +395,16 @@ def test_case_4(nbr_clients, nbr_servers, nbr_topics, nbr_calls,
 @click.option("--incremental",
               is_flag=True,
               help="reuse of resources in next iteration")
+@click.option("--saturation",
+              is_flag=True,
+              help="search the largest load meeting the SLO of the configuration")
+@click.option("--parallel",
+              is_flag=True,
+              help="run the sweep points concurrently on partitions of the machines")
+@click.option("--partitions",
+              default=None,
+              type=int,
+              help="max number of partitions (only parallel)")
 @click.option("--pause",
               default=ITERATION_PAUSE,
               help="break between iterations in seconds (only incremental)")
@@ -368,9 +420,31 @@ def test_case_4(nbr_clients, nbr_servers, nbr_topics, nbr_calls,
 @click.option("--env",
               default=None,
               help="alternative environment directory")
-def campaign(test, provider, incremental, pause, unfiltered, force, conf, env):
+def campaign(test, provider, incremental, saturation, parallel, partitions,
+             pause, unfiltered, force, conf, env):
+    if [incremental, saturation, parallel].count(True) > 1:
+        raise click.UsageError("--incremental, --saturation and --parallel "
+                               "are mutually exclusive")
     config = load_config(conf)
-    if incremental:
+    check_watchdog(config, config["campaign"][test].get("driver", []))
+    if parallel:
+        c.parallel_campaign(test=test,
+                            provider=provider,
+                            partitions=partitions,
+                            unfiltered=unfiltered,
+                            force=force,
+                            config=config,
+                            env=env)
+
+    elif saturation:
+        c.saturation_campaign(test=test,
+                              provider=provider,
+                              slo=config.get("slo", SLO),
+                              force=force,
+                              config=config,
+                              env=env)
+
+    elif incremental:
         c.incremental_campaign(test=test,
                                provider=provider,
                                pause=pause,
@@ -388,6 +462,201 @@ def campaign(test, provider, incremental, pause, unfiltered, force, conf, env):
                    env=env)
 
 
+@cli.command(help="Simulate a test case on qdr DRIVERS (nothing is deployed).")
+@click.argument("drivers", nargs=-1, required=True)
+@click.option("--nbr_clients",
+              default=NBR_CLIENTS,
+              help="number of clients")
+@click.option("--nbr_servers",
+              default=NBR_SERVERS,
+              help="number of servers")
+@click.option("--nbr_topics",
+              default=NBR_TOPICS,
+              help="number of topics")
+@click.option("--call_type",
+              default=CALL_TYPE,
+              type=click.Choice(["rpc-call", "rpc-cast", "rpc-fanout"]),
+              help="call type (client): rpc_call (blocking), rpc_cast (non-blocking), or rpc-fanout (broadcast)")
+@click.option("--nbr_calls",
+              default=NBR_CALLS,
+              help="number of execution calls (client)")
+@click.option("--pause",
+              default=PAUSE,
+              help="pause between calls in seconds (client)")
+@click.option("--delay",
+              default=None,
+              help="delay between two machines (e.g 10ms)")
+@click.option("--traffic",
+              help="traffic configuration of the links between the machines")
+@click.option("--bus_machines",
+              default=1,
+              help="number of machines hosting the bus")
+@click.option("--agent_machines",
+              default=1,
+              help="number of machines hosting the ombt agents")
+@click.option("--conf",
+              default=CONF,
+              help="alternative configuration file")
+def simulate(drivers, nbr_clients, nbr_servers, nbr_topics, call_type,
+             nbr_calls, pause, delay, traffic, bus_machines, agent_machines,
+             conf):
+    config = load_config(conf)
+    reports = s.sweep([(d, config["drivers"][d]) for d in drivers],
+                      traffic=config["traffic"][traffic] if traffic else None,
+                      nbr_bus_machines=bus_machines,
+                      nbr_agent_machines=agent_machines,
+                      nbr_clients=nbr_clients,
+                      nbr_servers=nbr_servers,
+                      topics=t.get_topics(nbr_topics),
+                      call_type=call_type,
+                      nbr_calls=nbr_calls,
+                      pause=pause,
+                      delay=delay)
+    if len(reports) == 1:
+        print(json.dumps(reports[0][1], indent=2, sort_keys=True))
+    else:
+        print(json.dumps(dict(reports), indent=2, sort_keys=True))
+
+
+@cli.command("timings", help="Summarize where the time goes [after campaign].")
+@click.option("--kind",
+              multiple=True,
+              type=click.Choice(["iteration", "task", "play", "ansible_task"]),
+              help="kind of phases to summarize (default to task and play)")
+@click.option("--top",
+              default=20,
+              help="number of phases to list")
+@click.option("--env",
+              default="current",
+              help="alternative environment directory")
+def summarize_timings(kind, top, env):
+    rows = timings.summarize(timings.load(env),
+                             kinds=list(kind) or ["task", "play"])
+    print("%-12s %-50s %6s %10s %10s %10s" % ("kind", "phase", "count",
+                                            "total(s)", "mean(s)", "max(s)"))
+    for row in rows[:top]:
+        print("%-12s %-50s %6d %10.1f %10.1f %10.1f" % row)
+
+
+@cli.command(help="Gather the results of a campaign in a dataset [after campaign].")
+@click.option("--output",
+              default="results.npz",
+              help="where to save the dataset (.npz, .parquet or .json)")
+@click.option("--processes",
+              type=int,
+              help="number of worker processes (default to the number of CPUs)")
+@click.option("--env",
+              default="current",
+              help="alternative environment directory")
+def analyze(output, processes, env):
+    columns = analysis.analyze(env, processes=processes)
+    analysis.save(columns, output)
+    rows = len(columns["iteration"]) if columns else 0
+    print("%s rows saved in %s" % (rows, output))
+
+
+@cli.command(help="Global latency percentiles of each iteration [after campaign].")
+@click.option("--output",
+              help="where to save them (.npz, .parquet or .json)")
+@click.option("--processes",
+              type=int,
+              help="number of worker processes (default to the number of CPUs)")
+@click.option("--env",
+              default="current",
+              help="alternative environment directory")
+def latency(output, processes, env):
+    columns = analysis.latencies(env, processes=processes)
+    if output:
+        analysis.save(columns, output)
+    print("%-8s %10s %10s %10s %10s  %s" % ("side", "count", "p50(ms)",
+                                           "p99(ms)", "p99.9(ms)", "iteration"))
+    for i, iteration in enumerate(columns.get("iteration", [])):
+        print("%-8s %10d %10s %10s %10s  %s" % tuple(
+            [columns["side"][i], columns["latency_count"][i]] +
+            ["-" if columns[p][i] is None else "%.2f" % columns[p][i]
+             for p in ["p50", "p99", "p99.9"]] + [iteration]))
+
+
+@cli.command("catalog", help="Add former campaigns to the catalog.")
+@click.argument("envs", nargs=-1, required=True)
+@click.option("--test",
+              help="test case of the campaigns")
+@click.option("--catalog",
+              "catalog_file",
+              default=CATALOG,
+              help="alternative catalog")
+def add_to_catalog(envs, test, catalog_file):
+    for env in envs:
+        sweeper = None
+        persistence_dir = path.join(env, "sweeps")
+        if path.exists(path.join(persistence_dir, sweep.POINTS)):
+            sweeper = sweep.LazySweeper(persistence_dir)
+        elif path.isdir(persistence_dir):
+            sweeper = ParamSweeper(persistence_dir=persistence_dir)
+        count = catalog.index(catalog_file, env, test=test, sweeper=sweeper)
+        print("%s: %s iterations" % (env, count))
+
+
+@cli.command(help="Query the iterations of all the campaigns of the catalog.")
+@click.option("--driver",
+              help="driver (glob pattern, e.g 'router*')")
+@click.option("--call_type",
+              help="call type (rpc-call, rpc-cast)")
+@click.option("--nbr_clients",
+              type=int,
+              help="number of clients")
+@click.option("--nbr_topics",
+              type=int,
+              help="number of topics")
+@click.option("--status",
+              default="ok",
+              help="status of the iterations (ok, failed)")
+@click.option("--sort",
+              default="p99",
+              type=click.Choice(["p50", "p99", "p999", "throughput",
+                                 "duration", "time"]),
+              help="column to sort on")
+@click.option("--desc",
+              is_flag=True,
+              help="sort in descending order")
+@click.option("--limit",
+              default=20,
+              help="number of iterations to list")
+@click.option("--sql",
+              help="raw SQL query (on the results view) instead")
+@click.option("--catalog",
+              "catalog_file",
+              default=CATALOG,
+              help="alternative catalog")
+def query(driver, call_type, nbr_clients, nbr_topics, status, sort, desc,
+          limit, sql, catalog_file):
+    parameters = []
+    if not sql:
+        conditions = []
+        for column, operator, value in [("driver", "GLOB", driver),
+                                        ("call_type", "=", call_type),
+                                        ("nbr_clients", "=", nbr_clients),
+                                        ("nbr_topics", "=", nbr_topics),
+                                        ("status", "=", status)]:
+            if value is not None:
+                conditions.append("%s %s ?" % (column, operator))
+                parameters.append(value)
+        sql = "SELECT campaign, driver, call_type, nbr_clients, nbr_topics, " \
+              "throughput, p50, p99, p999, backup_dir FROM results"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        # iterations without metrics last
+        sql += " ORDER BY %s IS NULL, %s %s LIMIT %d" % (
+            sort, sort, "DESC" if desc else "ASC", limit)
+    rows = catalog.query(catalog_file, sql, parameters)
+    if rows:
+        columns = list(rows[0].keys())
+        print("\t".join(columns))
+        for row in rows:
+            print("\t".join("" if row[c] is None else str(row[c])
+                            for c in columns))
+
+
 @cli.command(help="List a curated version of the environment")
 @click.option("--env",
               default=None,
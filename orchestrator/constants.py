@@ -25,14 +25,33 @@ TIMEOUT = 60
 VERSION = "msimonin/ombt:singleton"
 # default backup directory name
 BACKUP_DIR = "backup"
+# default number of client (and server) logs backed up per host (-1 for all),
+# only the controllers by default
+BACKUP_SAMPLE = 0
 # default length of messages
 LENGTH = 1024
 # default type of ombt executor
 EXECUTOR = "threading"
 # default pause between iterations (seconds)
 ITERATION_PAUSE = 1.0
+# default SLO of the saturation campaigns: p99 of the latency (ms) and
+# failed calls (e.g timeouts)
+SLO = {"p99": 1000, "msgs_fail": 0}
+# default fraction of the pairs of machines checked by the network validation
+# when the constraints didn't change
+VALIDATION_FRACTION = 0.1
+# fact cache of an environment (relative to the env dir)
+FACTS_DIR = "facts"
+# partitions of a parallel campaign (relative to the env dir)
+PARTITIONS_DIR = "partitions"
+# default number of ombt agents per machine of a partition
+AGENTS_PER_HOST = 50
+# catalog of the campaigns (relative to the working directory)
+CATALOG = "catalog.db"
 # default mode for drivers
 MODE = "standalone"
+# default binding of the ombt agents to the bus agents
+BINDING = "round_robin"
 # default driver
 DRIVER = {"type": "rabbitmq",
           "mode": "standalone"}
@@ -0,0 +1,152 @@
+"""Journal of the iterations of a campaign.
+
+Each iteration appends a record to <env_dir>/journal.jsonl (one JSON object
+per line, flushed to disk before the next iteration starts)::
+
+    {"id": "call_type__rpc-call-...", "time": 1530000000.0, "status": "ok",
+     "backup_dir": "call_type__rpc-call-...", "parameters": {...},
+     "timings": {"iteration": 120.5, "prepare": 30.2, ...},
+     "metrics": {"msgs_ok": 1000, "throughput": 98.2, "p99": 12.0, ...}}
+
+The file is only appended to: an interrupted write can only truncate the last
+record (skipped when reading). <env_dir>/journal.index maps the id of the
+records (see campaign.generate_id) to their offset in the journal.
+
+The journal replaces params.json, :py:func:`load_parameters` gives the same
+list of parameters (and still reads params.json of the former campaigns).
+"""
+import json
+import logging
+import os
+import time
+from os import path
+
+logger = logging.getLogger(__name__)
+
+JOURNAL = "journal.jsonl"
+INDEX = "journal.index"
+# former list of the parameters of the iterations
+PARAMS = "params.json"
+
+
+def append_line(file_path, entry):
+    """Append a JSON line and wait for it to reach the disk.
+
+    :return: the offset of the line
+    """
+    with open(file_path, "ab+") as f:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        if offset:
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                # terminate the line truncated by an interrupted write
+                f.write(b"\n")
+                offset += 1
+        f.write((json.dumps(entry, sort_keys=True) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    return offset
+
+
+def read_lines(file_path):
+    """Iterate over the JSON lines of a file (none if it doesn't exist)."""
+    if not path.exists(file_path):
+        return
+    with open(file_path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # interrupted write
+                logger.warning("Skipping a corrupted line of %s", file_path)
+
+
+def append(env_dir, record_id, parameters, status="ok", timings=None,
+           metrics=None, reason=None, index=None):
+    """Record an iteration.
+
+    >>> import tempfile
+    >>> env_dir = tempfile.mkdtemp()
+    >>> append(env_dir, "a", {"nbr_clients": 1, "backup_dir": "a"},
+    ...        metrics={"p99": 12.0})["status"]
+    'ok'
+    >>> append(env_dir, "b", {"nbr_clients": 2}, status="failed")["id"]
+    'b'
+    >>> lookup(env_dir, "a")["metrics"]
+    {'p99': 12.0}
+    >>> load_parameters(env_dir)
+    [{'backup_dir': 'a', 'nbr_clients': 1}]
+    >>> index = load_index(env_dir)
+    >>> _ = append(env_dir, "c", {"nbr_clients": 3}, index=index)
+    >>> lookup(env_dir, "c", index=index)["parameters"]
+    {'nbr_clients': 3}
+
+    :param env_dir: the environment directory
+    :param record_id: id of the iteration
+    :param parameters: the parameters of the iteration
+    :param status: ok, failed or saturated (aborted by the watchdog)
+    :param timings: durations of the phases of the iteration (seconds)
+    :param metrics: headline metrics of the iteration
+    :param reason: why the iteration didn't succeed
+    :param index: the index kept in memory by the caller (see
+        :py:func:`load_index`), updated with the record
+    :return: the record
+    """
+    record = {
+        "id": record_id,
+        "time": time.time(),
+        "status": status,
+        "backup_dir": parameters.get("backup_dir"),
+        "parameters": parameters,
+        "timings": timings or {},
+        "metrics": metrics or {}
+    }
+    if reason:
+        record["reason"] = reason
+    offset = append_line(path.join(env_dir, JOURNAL), record)
+    append_line(path.join(env_dir, INDEX), {"id": record_id,
+                                            "offset": offset})
+    if index is not None:
+        index[record_id] = offset
+    return record
+
+
+def read(env_dir):
+    """Iterate over the records of the journal."""
+    return read_lines(path.join(env_dir, JOURNAL))
+
+
+def load_index(env_dir):
+    """The index of the journal: id -> offset (the last record wins)."""
+    return dict((entry["id"], entry["offset"])
+                for entry in read_lines(path.join(env_dir, INDEX)))
+
+
+def lookup(env_dir, record_id, index=None):
+    """The last record of an iteration (None if there's none).
+
+    :param env_dir: the environment directory
+    :param record_id: id of the iteration
+    :param index: the index (see :py:func:`load_index`), read from the disk
+        if not given: callers looking up several records load it once
+    """
+    index = load_index(env_dir) if index is None else index
+    if record_id not in index:
+        return None
+    with open(path.join(env_dir, JOURNAL), "rb") as f:
+        f.seek(index[record_id])
+        return json.loads(f.readline().decode("utf-8"))
+
+
+def load_parameters(env_dir):
+    """Parameters of the iterations done, as formerly dumped in params.json.
+
+    :param env_dir: the environment directory
+    """
+    if not path.exists(path.join(env_dir, JOURNAL)) and \
+            path.exists(path.join(env_dir, PARAMS)):
+        with open(path.join(env_dir, PARAMS)) as f:
+            return json.load(f)
+    return [record["parameters"] for record in read(env_dir)
+            if record["status"] == "ok"]
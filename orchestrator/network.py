@@ -0,0 +1,132 @@
+"""Incremental network emulation and sampled validation.
+
+enoslib applies the tc rules of all the machines at once
+(emulate_network) and checks the latency between all of them
+(validate_network). A campaign sweeping the load under the same traffic would
+pay both at each iteration, so the constraints applied are kept in the
+environment (one per (source group, destination group) pair) and only the
+machines whose rules changed are updated (see tasks.emulate).
+
+The validation checks a sample of the pairs of machines (fping from the
+source), all of them when the constraints changed since the last full check::
+
+    validation:
+      fraction: 0.1   # of the pairs checked when nothing changed
+"""
+import random
+from os import path
+
+from enoslib.api import _build_grp_constraints, _build_ip_constraints
+from enoslib.constants import ANSIBLE_DIR
+
+# role of enoslib applying the tc rules (see ansible/netem.yml)
+UTILS_ROLE = path.join(ANSIBLE_DIR, "roles", "utils")
+
+# key of the constraints between two groups
+PAIR = ("src", "dst")
+# tc settings of a pair
+SETTINGS = ("delay", "rate", "loss")
+
+
+def get_constraints(roles, network_constraints):
+    """The constraints between the groups of machines, as built by enoslib.
+
+    >>> roles = {"bus": [], "ombt-client": []}
+    >>> for c in get_constraints(roles, {"default_delay": "10ms",
+    ...                                  "default_rate": "1gbit",
+    ...                                  "groups": ["bus", "ombt-client"]}):
+    ...     print(c["src"], c["dst"], c["delay"], c["loss"])
+    bus ombt-client 10ms 0
+    ombt-client bus 10ms 0
+    >>> get_constraints(roles, {"enable": False, "default_delay": "10ms"})
+    []
+    >>> get_constraints(roles, None)
+    []
+
+    :param roles: the roles of the machines
+    :param network_constraints: a traffic configuration (None for no
+        constraint)
+    :return: the constraints sorted by pair
+    """
+    if not network_constraints or not network_constraints.get("enable", True):
+        return []
+    constraints = [dict((k, c.get(k)) for k in PAIR + SETTINGS)
+                   for c in _build_grp_constraints(roles, network_constraints)]
+    return sorted(constraints, key=lambda c: (c["src"], c["dst"]))
+
+
+def changed_groups(applied, constraints):
+    """Source groups whose constraints changed.
+
+    The tc rules are set on the source machines, a machine of such a group
+    gets all its rules again.
+
+    >>> applied = [{"src": "bus", "dst": "client", "delay": "10ms"},
+    ...            {"src": "client", "dst": "bus", "delay": "10ms"}]
+    >>> changed_groups(applied, applied)
+    []
+    >>> changed_groups(applied, [
+    ...     {"src": "bus", "dst": "client", "delay": "50ms"},
+    ...     {"src": "client", "dst": "bus", "delay": "10ms"}])
+    ['bus']
+    >>> changed_groups(applied, [])
+    ['bus', 'client']
+
+    :param applied: the constraints currently applied
+    :param constraints: the constraints to apply
+    """
+    def by_pair(cs):
+        return dict(((c["src"], c["dst"]), c) for c in cs)
+
+    before, after = by_pair(applied or []), by_pair(constraints)
+    return sorted(set(pair[0] for pair in set(before) | set(after)
+                      if before.get(pair) != after.get(pair)))
+
+
+def get_ip_constraints(roles, ips, constraints):
+    """The tc rules of each machine, as applied by the utils role of enoslib.
+
+    :param roles: the roles of the machines
+    :param ips: the addresses and devices of the machines (tc_ips action)
+    :param constraints: the constraints between the groups
+    """
+    return _build_ip_constraints(roles, ips, constraints)
+
+
+def get_hosts(roles, groups):
+    """Aliases of the machines of some groups (in the order of the roles)."""
+    hosts = []
+    for group in groups:
+        for host in roles.get(group, []):
+            if host.alias not in hosts:
+                hosts.append(host.alias)
+    return hosts
+
+
+def sample_pairs(hosts, fraction=1.0, seed=None):
+    """Targets of each machine to check the latency of a sample of the pairs.
+
+    >>> hosts = [("a", "10.0.0.1"), ("b", "10.0.0.2"), ("c", "10.0.0.3")]
+    >>> sample_pairs(hosts)
+    {'a': ['10.0.0.2', '10.0.0.3'], 'b': ['10.0.0.1', '10.0.0.3'], \
+'c': ['10.0.0.1', '10.0.0.2']}
+    >>> sum(len(t) for t in sample_pairs(hosts, 0.5, seed="A-0").values())
+    3
+    >>> sample_pairs(hosts, 0.5, seed="A-0") == sample_pairs(hosts, 0.5,
+    ...                                                      seed="A-0")
+    True
+
+    :param hosts: the (alias, address) of the machines
+    :param fraction: fraction of the pairs to check (at least one)
+    :param seed: seed of the sample
+    :return: source alias -> target addresses
+    """
+    pairs = [(src, address) for src, _ in hosts for dst, address in hosts
+             if src != dst]
+    if fraction < 1.0 and pairs:
+        number = max(int(round(fraction * len(pairs))), 1)
+        pairs = sorted(random.Random(seed).sample(pairs, number))
+    targets = {}
+    for src, address in pairs:
+        targets.setdefault(src, []).append(address)
+    return targets
@@ -19,6 +19,14 @@ class BusConf(object):
     def get_transport(self):
         pass
 
+    def is_edge(self):
+        """Whether the agent is at the edge of a hierarchical bus."""
+        return False
+
+    @abstractmethod
+    def get_id(self):
+        pass
+
     def to_dict(self):
         return self.conf
 
@@ -40,6 +48,9 @@ class RabbitMQConf(BusConf):
     def get_transport(self):
         return "rabbit"
 
+    def get_id(self):
+        return self.conf["agent_id"]
+
 
 class QdrConf(BusConf):
 
@@ -65,12 +76,32 @@ class QdrConf(BusConf):
     def get_transport(self):
         return "amqp"
 
+    def get_id(self):
+        return self.conf["router_id"]
+
+    def is_edge(self):
+        return self.conf.get("mode") == "edge"
+
 
 class OmbtAgent(object):
-    """Modelize an ombt agent."""
+    """Modelize an ombt agent.
+
+    Plans may count hundreds of thousands of agents, so an agent is a compact
+    record (slots, bus and control agents shared between agents). Everything
+    else (log paths, command...) is derived when needed, e.g when the agent is
+    serialized for the host it runs on.
+    """
 
     __metaclass__ = ABCMeta
 
+    __slots__ = ("agent_id", "machine", "control_agents", "bus_agents",
+                 "timeout", "topic")
+
+    # docker
+    detach = True
+    # where to log inside the container
+    docker_log = "/home/ombt/ombt-data/agent.log"
+
     def __init__(self, **kwargs):
         # NOTE(msimonin): maybe use __getattr__ at some point
         self.agent_id = kwargs["agent_id"]
@@ -78,28 +109,46 @@ class OmbtAgent(object):
         self.control_agents = kwargs["control_agents"]
         self.bus_agents = kwargs["bus_agents"]
         self.timeout = kwargs["timeout"]
-        # generated
-        self.agent_type = self.get_type()
-        # docker
-        self.detach = True
         self.topic = kwargs["topic"]
-        # calculated attr
-        self.name = self.agent_id
-        # where to log inside the container
-        self.docker_log = "/home/ombt/ombt-data/agent.log"
+
+    @property
+    def agent_type(self):
+        return self.get_type()
+
+    @property
+    def name(self):
+        return self.agent_id
+
+    @property
+    def log(self):
         # where to log outside the container (mount)
-        self.log = path.join("/tmp/ombt-data", "%s.log" % self.agent_id)
+        return path.join("/tmp/ombt-data", "%s.log" % self.agent_id)
+
+    @property
+    def command(self):
         # the command to run
-        self.command = self.get_command()
+        return self.get_command()
 
     def to_dict(self):
-        d = self.__dict__
+        d = {attr: getattr(self, attr) for attr in self._get_attributes()}
         d.update({
-            "control_agents": [a.to_dict() for a in self.control_agents],
-            "bus_agents": [a.to_dict() for a in self.bus_agents],
+            "agent_type": self.agent_type,
+            "detach": self.detach,
+            "name": self.name,
+            "docker_log": self.docker_log,
+            "log": self.log,
+            "command": self.command,
+            # bus agents are referenced by id (their conf is already known)
+            "control_agents": [a.get_id() for a in self.control_agents],
+            "bus_agents": [a.get_id() for a in self.bus_agents],
         })
         return d
 
+    def _get_attributes(self):
+        for klass in type(self).__mro__:
+            for attr in getattr(klass, "__slots__", ()):
+                yield attr
+
     @abstractmethod
     def get_type(self):
         pass
@@ -134,12 +183,16 @@ class OmbtAgent(object):
 
 class OmbtClient(OmbtAgent):
 
+    __slots__ = ()
+
     def get_type(self):
         return "rpc-client"
 
 
 class OmbtServer(OmbtAgent):
 
+    __slots__ = ("executor",)
+
     def __init__(self, **kwargs):
         self.executor = kwargs["executor"]
         super(OmbtServer, self).__init__(**kwargs)
@@ -157,6 +210,8 @@ class OmbtServer(OmbtAgent):
 
 class OmbtController(OmbtAgent):
 
+    __slots__ = ("call_type", "nbr_calls", "pause", "length")
+
     def __init__(self, **kwargs):
         self.timeout = kwargs["timeout"]
         self.call_type = kwargs["call_type"]
@@ -0,0 +1,137 @@
+"""Partitions of the machines for the parallel campaigns.
+
+A reservation often holds more machines than a sweep point needs. The
+machines are then split into disjoint partitions, each one running its own
+bus, control bus and ombt agents, so that several sweep points run at once
+(see campaign.parallel_campaign). The services used by all the machines
+(influxdb, grafana, registry, chrony server) aren't partitioned: they're
+deployed once and every partition keeps their roles.
+
+The partitions are sized from the agents of the sweep points and the
+partitions section of the configuration::
+
+    partitions:
+      number: 4            # max number of partitions (default: as many as fit)
+      agents_per_host: 50  # ombt agents (clients or servers) per machine
+      control-bus: 1       # machines of the control bus per partition
+
+The machines of the bus are given by the driver (machines, default to the
+number of rabbitmq instances or 1).
+"""
+from orchestrator.constants import AGENTS_PER_HOST, DRIVER
+
+# roles whose machines belong to a single partition, the others follow them
+PARTITIONED = ["bus", "control-bus", "ombt-control", "ombt-client",
+               "ombt-server"]
+# roles of the services shared by all the partitions
+SHARED = ["influxdb", "grafana", "registry", "chrony-server", "control"]
+
+
+def count_agents(parameters):
+    """Number of ombt clients and servers of a sweep point.
+
+    >>> count_agents({"nbr_clients": 10, "nbr_servers": 2})
+    (10, 2)
+    >>> count_agents({"nbr_topics": 5})
+    (5, 5)
+
+    :param parameters: the parameters of the sweep point
+    :return: (clients, servers)
+    """
+    topics = parameters.get("nbr_topics", 1)
+    return (parameters.get("nbr_clients", 1) * topics,
+            parameters.get("nbr_servers", 1) * topics)
+
+
+def get_size(parameters, drivers, config=None):
+    """Machines of each partitioned role needed by a sweep point.
+
+    >>> drivers = {"broker": {"type": "rabbitmq", "number": 3}}
+    >>> size = get_size({"driver": "broker", "nbr_clients": 120,
+    ...                  "nbr_servers": 10}, drivers)
+    >>> [size[role] for role in PARTITIONED]
+    [3, 1, 1, 3, 1]
+
+    :param parameters: the parameters of the sweep point
+    :param drivers: the drivers of the configuration
+    :param config: the partitions section of the configuration
+    """
+    config = config or {}
+    agents_per_host = config.get("agents_per_host", AGENTS_PER_HOST)
+    driver = drivers.get(parameters["driver"], DRIVER)
+    clients, servers = count_agents(parameters)
+    return {
+        "bus": driver.get("machines", driver.get("number", 1)),
+        "control-bus": config.get("control-bus", 1),
+        "ombt-control": 1,
+        "ombt-client": max(-(-clients // agents_per_host), 1),
+        "ombt-server": max(-(-servers // agents_per_host), 1),
+    }
+
+
+def max_size(sizes):
+    """The size of a partition holding any of the sizes.
+
+    >>> max_size([{"bus": 1, "ombt-client": 4}, {"bus": 3, "ombt-client": 2}])
+    {'bus': 3, 'ombt-client': 4}
+    """
+    size = {}
+    for s in sizes:
+        for role, number in s.items():
+            size[role] = max(size.get(role, 0), number)
+    return size
+
+
+def split_roles(roles, size, number=None):
+    """Split the machines into partitions of the same size.
+
+    A machine is given to a single partition with all its roles, e.g a
+    machine which is both ombt-client and ombt-server counts for both. The
+    shared roles are kept by every partition.
+
+    >>> from enoslib.host import Host
+    >>> hosts = [Host("10.0.0.%s" % i, alias="host-%s" % i) for i in range(7)]
+    >>> roles = {"influxdb": hosts[:1], "control-bus": hosts[:3],
+    ...          "ombt-control": hosts[:3], "bus": hosts[3:5],
+    ...          "ombt-client": hosts[5:], "ombt-server": hosts[5:]}
+    >>> size = {"bus": 1, "control-bus": 1, "ombt-control": 1,
+    ...         "ombt-client": 1, "ombt-server": 1}
+    >>> partitions = split_roles(roles, size)
+    >>> len(partitions)
+    2
+    >>> [h.alias for h in partitions[1]["bus"]]
+    ['host-4']
+    >>> [h.alias for h in partitions[1]["ombt-server"]]
+    ['host-6']
+    >>> [h.alias for h in partitions[1]["influxdb"]]
+    ['host-0']
+    >>> len(split_roles(roles, size, number=1))
+    1
+
+    :param roles: the roles of the machines (role -> hosts)
+    :param size: machines of each partitioned role (see :py:func:`get_size`)
+    :param number: max number of partitions
+    :return: the roles of each partition
+    """
+    taken = set()
+    partitions = []
+    while number is None or len(partitions) < number:
+        hosts = []
+        for role in PARTITIONED:
+            aliases = set(h.alias for h in hosts)
+            candidates = [h for h in roles.get(role, [])
+                          if h.alias not in taken and h.alias not in aliases]
+            needed = size.get(role, 0) - len(
+                [h for h in roles.get(role, []) if h.alias in aliases])
+            if len(candidates) < needed:
+                return partitions
+            hosts.extend(candidates[:max(needed, 0)])
+        if not hosts:
+            return partitions
+        aliases = set(h.alias for h in hosts)
+        taken.update(aliases)
+        partitions.append(dict(
+            (role, list(machines) if role in SHARED
+             else [h for h in machines if h.alias in aliases])
+            for role, machines in roles.items()))
+    return partitions
@@ -1,69 +1,163 @@
+import logging
+from collections import deque
+
 import networkx as nx
+from networkx.algorithms.community import kernighan_lin_bisection
+
+logger = logging.getLogger(__name__)
+
+# base ports of the router listeners, the actual port is base + the slot of
+# the router on its machine
+INTER_ROUTER_PORT = 6000
+NORMAL_PORT = 5000
+EDGE_PORT = 7000
+
+# router modes (qdr >= 1.3 for the edge mode)
+INTERIOR = "interior"
+EDGE = "edge"
 
 
 def get_conf(graph, machines, distribution):
+    """Generate the configuration of every router of the graph.
+
+    >>> import pprint
+    >>> graph = nx.path_graph(2)
+    >>> confs = get_conf(graph, ["machine01"], round_robin)
+    >>> pprint.pprint(confs[1]["connectors"])
+    []
+    >>> pprint.pprint(confs[0]["connectors"])
+    [{'host': 'machine01', 'port': 6001, 'role': 'inter-router'}]
+
+    :param graph: networkx graph of the routers
+    :param machines: machines on which the routers will be installed
+    :param distribution: function mapping the routers to the machines
+    :return: a dict router -> configuration
+    """
+    return dict(iter_conf(graph, machines, distribution))
+
+
+def iter_conf(graph, machines, distribution):
+    """Stream the configuration of every router of the graph.
+
+    This yields the same configurations as :py:func:`get_conf` (in the same
+    order) without building them all in memory.
+
+    >>> confs = iter_conf(nx.complete_graph(3), ["machine01"], round_robin)
+    >>> [(node, len(conf["connectors"])) for node, conf in confs]
+    [(0, 2), (1, 1), (2, 0)]
+
+    :param graph: networkx graph of the routers
+    :param machines: machines on which the routers will be installed
+    :param distribution: function mapping the routers to the machines
+    :return: an iterator of (router, configuration)
+    """
     ntm, mtn = distribution(graph, machines)
-    confs = {}
-    router_idx = 0
+    # slot of each router on its machine, used to compute its ports
+    slots = {}
+    for nodes in mtn.values():
+        slots.update((node, idx) for idx, node in enumerate(nodes))
+
     # a connector correspond to TCP connections
     # but will be used in both directions
     # Edge in the graph should correspond to a single
-    # connection. So we keep track of the already created
-    # connections.
-    connections = []
-    for node, nbrdict in graph.adjacency():
-        confs.setdefault(node, {})
+    # connection. So the edge is owned by the first of its ends we go through:
+    # an edge toward an already configured router is skipped.
+    # Links between an edge router and an interior router are always owned by
+    # the edge router.
+    configured = set()
+    for router_idx, (node, nbrdict) in enumerate(graph.adjacency()):
         machine = ntm[node]
-        idx = mtn[machine].index(node)
-
-        router_id = "router%s" % router_idx
+        idx = slots[node]
+        mode = graph.nodes[node].get("mode", INTERIOR)
 
-        confs[node].update({
+        conf = {
             "machine": machine,
-            "router_id": router_id})
-
-        confs[node].update({
-            "listeners": [
-                {
-                    "host": machine,
-                    "port": 6000 + idx,
-                    "role": "inter-router"
-                },
-                {
-                    "host": machine,
-                    "port": 5000 + idx,
-                    "role": "normal",
-
-                    # use an extra field for the remaining options
-                    "authenticatePeer": "no",
-                    "saslMechanisms": "ANONYMOUS"
-                }
-            ]
-        })
+            "router_id": "router%s" % router_idx,
+        }
+        listeners = [
+            {
+                "host": machine,
+                "port": NORMAL_PORT + idx,
+                "role": "normal",
 
+                # use an extra field for the remaining options
+                "authenticatePeer": "no",
+                "saslMechanisms": "ANONYMOUS"
+            }
+        ]
         # outgoing links
         connectors = []
-        for out in nbrdict.keys():
-            conn = sorted([node, out])
-            if conn in connections:
-                continue
-            connections.append(conn)
-            out_machine = ntm[out]
-            out_idx = mtn[out_machine].index(out)
-
-            connectors.append({
-                "host": out_machine,
-                "port": 6000 + out_idx,  # same rule as above
+        if mode == EDGE:
+            conf["mode"] = EDGE
+            for out in nbrdict:
+                connectors.append({
+                    "host": ntm[out],
+                    "port": EDGE_PORT + slots[out],
+                    "role": "edge"
+                })
+        else:
+            listeners.insert(0, {
+                "host": machine,
+                "port": INTER_ROUTER_PORT + idx,
                 "role": "inter-router"
             })
+            has_edges = False
+            for out in nbrdict:
+                if graph.nodes[out].get("mode", INTERIOR) == EDGE:
+                    has_edges = True
+                    continue
+                if out in configured:
+                    continue
+                connectors.append({
+                    "host": ntm[out],
+                    "port": INTER_ROUTER_PORT + slots[out],  # same rule as above
+                    "role": "inter-router"
+                })
+            if has_edges:
+                listeners.append({
+                    "host": machine,
+                    "port": EDGE_PORT + idx,
+                    "role": "edge"
+                })
+
+        conf["listeners"] = listeners
+        conf["connectors"] = connectors
+        configured.add(node)
+        yield node, conf
 
-        confs[node].update({"connectors": connectors})
-        router_idx = router_idx + 1
 
-    return confs
+def add_edge_routers(graph, number):
+    """Attach edge routers to a graph of interior routers.
 
+    The edge routers are evenly attached to the interior routers (each edge
+    router has a single uplink). They are identified by ("edge", index)
+    and carry a mode="edge" attribute.
 
-def round_robin(graph, machines):
+    >>> graph = add_edge_routers(nx.complete_graph(2), 3)
+    >>> sorted(graph.edges(("edge", 0)))
+    [(('edge', 0), 0)]
+    >>> sorted(graph.edges(("edge", 1)))
+    [(('edge', 1), 1)]
+    >>> confs = get_conf(graph, ["machine01"], round_robin)
+    >>> confs[0]["listeners"][-1]
+    {'host': 'machine01', 'port': 7000, 'role': 'edge'}
+    >>> confs[("edge", 2)]["connectors"]
+    [{'host': 'machine01', 'port': 7000, 'role': 'edge'}]
+
+    :param graph: networkx graph of the interior routers
+    :param number: number of edge routers to attach
+    :return: the graph (modified in place)
+    """
+    interiors = list(graph.nodes())
+    for index in range(number):
+        edge = (EDGE, index)
+        graph.add_node(edge, mode=EDGE)
+        graph.add_edge(edge, interiors[index % len(interiors)])
+    return graph
+
+
+def round_robin(graph, machines, **kwargs):
+    # the placement_args (e.g cores) only matter to the report
     nodes_to_machines = {}
     machines_to_nodes = {}
     i = 0
@@ -75,5 +169,170 @@ def round_robin(graph, machines):
     return nodes_to_machines, machines_to_nodes
 
 
+def mincut(graph, machines, cores=None, max_iter=10):
+    """Place the routers so that few inter-router links cross machines.
+
+    The graph is recursively bisected (Kernighan-Lin) along with the list of
+    machines. Each half of the graph is sized after the capacity (number of
+    cores) of the corresponding half of the machines, so the routers per
+    machine are balanced with respect to the machine capacities.
+
+    >>> graph = nx.disjoint_union(nx.complete_graph(3), nx.complete_graph(3))
+    >>> ntm, mtn = mincut(graph, ["machine01", "machine02"])
+    >>> sorted(sorted(nodes) for nodes in mtn.values())
+    [[0, 1, 2], [3, 4, 5]]
+    >>> ntm, mtn = mincut(nx.path_graph(4), ["m1", "m2"], cores={"m1": 3})
+    >>> mtn
+    {'m1': [0, 1, 2], 'm2': [3]}
+
+    :param graph: networkx graph of the routers
+    :param machines: machines on which the routers will be installed
+    :param cores: dict machine -> capacity, machines not present count for 1
+    :param max_iter: max number of Kernighan-Lin passes per bisection
+    :return: the same (nodes_to_machines, machines_to_nodes) as round_robin
+    """
+    cores = cores or {}
+    capacities = [cores.get(machine, 1) for machine in machines]
+    placement = {}
+    _bisect(graph, _bfs_order(graph), list(machines), capacities,
+            placement, max_iter)
+
+    # keep the graph order inside each machine (this gives the router slots)
+    nodes_to_machines = {}
+    machines_to_nodes = {}
+    for node in graph.nodes():
+        machine = placement[node]
+        nodes_to_machines[node] = machine
+        machines_to_nodes.setdefault(machine, []).append(node)
+    return nodes_to_machines, machines_to_nodes
+
+
+def _bfs_order(graph):
+    """Nodes of the graph in breadth first order (component by component).
+
+    Neighbours end up close to each other which gives a good starting point
+    to the bisection.
+    """
+    seen = set()
+    order = []
+    for source in graph:
+        if source in seen:
+            continue
+        seen.add(source)
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for nbr in graph[node]:
+                if nbr not in seen:
+                    seen.add(nbr)
+                    queue.append(nbr)
+    return order
+
+
+def _bisect(graph, nodes, machines, capacities, placement, max_iter):
+    if not nodes:
+        return
+    if len(machines) == 1:
+        placement.update((node, machines[0]) for node in nodes)
+        return
+
+    half = len(machines) // 2
+    total = sum(capacities)
+    size = int(round(len(nodes) * sum(capacities[:half]) / float(total)))
+    left, right = nodes[:size], nodes[size:]
+    if left and right:
+        # the swaps of Kernighan-Lin preserve the size of the initial halves
+        left, right = kernighan_lin_bisection(graph.subgraph(nodes),
+                                              partition=(left, right),
+                                              max_iter=max_iter)
+        if len(left) != size:
+            # the halves aren't necessarily returned in order
+            left, right = right, left
+        # keep the bfs order in the halves for the next bisections
+        left = [node for node in nodes if node in left]
+        right = [node for node in nodes if node in right]
+
+    _bisect(graph, left, machines[:half], capacities[:half],
+            placement, max_iter)
+    _bisect(graph, right, machines[half:], capacities[half:],
+            placement, max_iter)
+
+
+def placement_report(graph, nodes_to_machines, machines, cores=None):
+    """Evaluate a placement of the routers.
+
+    The cut size is the number of inter-router links between two distinct
+    machines. The imbalance is the load of the most loaded machine relative
+    to its fair share (given its capacity): 1.0 means a perfect balance.
+
+    >>> graph = nx.path_graph(4)
+    >>> report = placement_report(graph, *round_robin(graph, ["m1", "m2"]))
+    >>> report == {"cut_size": 3, "imbalance": 1.0}
+    True
+
+    :param graph: networkx graph of the routers
+    :param nodes_to_machines: the placement to evaluate
+    :param machines: machines on which the routers will be installed
+    :param cores: dict machine -> capacity, machines not present count for 1
+    """
+    cores = cores or {}
+    capacities = {machine: cores.get(machine, 1) for machine in machines}
+    cut_size = sum(1 for u, v in graph.edges()
+                   if nodes_to_machines[u] != nodes_to_machines[v])
+    loads = dict.fromkeys(machines, 0)
+    for machine in nodes_to_machines.values():
+        loads[machine] += 1
+    total = float(sum(capacities.values()))
+    nbr_nodes = graph.number_of_nodes()
+    imbalance = max(loads[m] / (nbr_nodes * capacities[m] / total)
+                    for m in machines) if nbr_nodes else 1.0
+    return {"cut_size": cut_size, "imbalance": imbalance}
+
+
+PLACEMENTS = {
+    "round_robin": round_robin,
+    "mincut": mincut
+}
+
+
+def get_distribution(config):
+    """Get the distribution function (placement) of a qdr driver config.
+
+    The placement is chosen with the ``placement`` key of the driver (default
+    to round_robin) and tuned with the ``placement_args`` key, e.g::
+
+        router:
+          type: qdr
+          topology: complete_graph
+          args: [4]
+          placement: mincut
+          placement_args:
+            cores: {paravance-1: 32, parasilo-1: 16}
+
+    The returned distribution logs the cut size and the imbalance of the
+    placement it computes.
+
+    >>> distribution = get_distribution({"placement_args": {"cores": {0: 2}}})
+    >>> distribution(nx.complete_graph(2), [0])[1]
+    {0: [0, 1]}
+    """
+    name = config.get("placement", "round_robin")
+    if name not in PLACEMENTS:
+        raise TypeError("Unknown placement chosen")
+    placement = PLACEMENTS[name]
+    kwargs = config.get("placement_args", {})
+
+    def distribution(graph, machines):
+        ntm, mtn = placement(graph, machines, **kwargs)
+        report = placement_report(graph, ntm, machines, kwargs.get("cores"))
+        logger.info("%s placement of %s routers on %s machines: "
+                    "cut_size=%s imbalance=%.2f", name, len(ntm),
+                    len(machines), report["cut_size"], report["imbalance"])
+        return ntm, mtn
+
+    return distribution
+
+
 def generate(func_name, *args):
     return getattr(nx, func_name)(*args)
@@ -0,0 +1,256 @@
+"""Simulated provider: fake machines and no Ansible run.
+
+This measures the orchestrator itself (planning, env persistence, size of the
+Ansible payloads) at any scale without a testbed, e.g with the following
+configuration::
+
+    simulated:
+      resources:
+        machines:
+          - roles: [bus, telegraf]
+            cluster: paravance
+            number: 100
+          - roles: [ombt-client, ombt-server, telegraf]
+            number: 10000
+          ...
+
+The playbooks aren't run: each call is recorded in
+<env_dir>/ansible_calls.jsonl with the size of its payload (extra vars and
+ombt plan files) and the number of targeted hosts (see
+:py:func:`get_targets`).
+"""
+import fnmatch
+import json
+import logging
+import os
+import time
+from os import path
+
+import jinja2
+import yaml
+from enoslib.host import Host
+from enoslib.infra.provider import Provider
+from enoslib.utils import get_roles_as_list
+
+from orchestrator.constants import ANSIBLE_DIR
+
+logger = logging.getLogger(__name__)
+
+SIMULATED = "simulated"
+CALLS = "ansible_calls.jsonl"
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "resources": {"$ref": "#/resources"},
+    },
+    "additionalProperties": True,
+    "required": ["resources"],
+
+    "resources": {
+        "title": "Resource",
+
+        "type": "object",
+        "properties": {
+            "machines": {"type": "array", "items": {"$ref": "#/machine"}},
+            "networks": {"type": "array", "items": {"type": "string"}}
+        },
+        "additionalProperties": False,
+        "required": ["machines"]
+    },
+
+    "machine": {
+        "title": "Compute",
+        "type": "object",
+        "properties": {
+            "anyOf": [
+                {"roles": {"type": "array", "items": {"type": "string"}}},
+                {"role": {"type": "string"}}
+            ],
+            "number": {"type": "number"},
+            "cluster": {"type": "string"}
+        }
+    }
+}
+
+
+class Simulated(Provider):
+    """Fabricate the machines of the configuration.
+
+    The machines are named after their cluster (as on Grid'5000) and all the
+    network roles are mapped to a fake interface.
+
+    >>> provider = Simulated({"resources": {"machines": [
+    ...     {"roles": ["bus"], "cluster": "paravance", "number": 2},
+    ...     {"roles": ["ombt-client", "ombt-server"], "number": 1}]}})
+    >>> roles, networks = provider.init()
+    >>> [h.alias for h in roles["bus"]]
+    ['paravance-1', 'paravance-2']
+    >>> roles["ombt-client"] == roles["ombt-server"]
+    True
+    >>> [n["roles"] for n in networks]
+    [['control_network', 'internal_network']]
+    """
+
+    def init(self, force_deploy=False):
+        resources = self.provider_conf["resources"]
+        network_roles = resources.get("networks",
+                                      ["control_network", "internal_network"])
+        extra = dict((role, "eth0") for role in network_roles)
+        roles = {}
+        index = 0
+        counts = {}
+        for machine in resources["machines"]:
+            cluster = machine.get("cluster", SIMULATED)
+            hosts = []
+            for _ in range(machine.get("number", 1)):
+                index += 1
+                counts[cluster] = counts.get(cluster, 0) + 1
+                hosts.append(Host("10.%s.%s.%s" % (index >> 16 & 255,
+                                                   index >> 8 & 255,
+                                                   index & 255),
+                                  alias="%s-%s" % (cluster, counts[cluster]),
+                                  user="root",
+                                  extra=extra))
+            for role in get_roles_as_list(machine):
+                roles.setdefault(role, []).extend(hosts)
+        networks = [{
+            "cidr": "10.0.0.0/8",
+            "roles": network_roles
+        }]
+        return roles, networks
+
+    def destroy(self):
+        pass
+
+    def default_config(self):
+        return {}
+
+    def schema(self):
+        return SCHEMA
+
+
+def _plan_size(plan_dir):
+    if not plan_dir or not path.isdir(plan_dir):
+        return 0
+    return sum(path.getsize(path.join(plan_dir, f))
+               for f in os.listdir(plan_dir))
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+_JINJA = jinja2.Environment()
+_JINJA.filters["bool"] = _to_bool
+
+
+def _render(value, extra_vars):
+    if isinstance(value, str) and "{{" in value:
+        return _JINJA.from_string(value).render(**extra_vars)
+    return value
+
+
+def _imported(condition, extra_vars):
+    """Evaluate the when of an imported playbook (True if it can't)."""
+    if condition is None:
+        return True
+    try:
+        return bool(_JINJA.compile_expression(condition)(**extra_vars))
+    except jinja2.TemplateError:
+        return True
+
+
+def match_hosts(roles, patterns):
+    """Aliases of the machines matched by Ansible host patterns.
+
+    >>> roles = {"bus": [Host("bus-0")], "ombt-client": [Host("agent-0")],
+    ...          "ombt-server": [Host("agent-0"), Host("agent-1")]}
+    >>> sorted(match_hosts(roles, "ombt-*"))
+    ['agent-0', 'agent-1']
+    >>> sorted(match_hosts(roles, ["all", "!ombt-client"]))
+    ['agent-1', 'bus-0']
+    >>> sorted(match_hosts(roles, "bus-0,agent-1"))
+    ['agent-1', 'bus-0']
+
+    :param roles: the roles of the machines
+    :param patterns: a pattern (groups or aliases separated by , or :) or a
+        list of them
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    tokens = [token.strip() for pattern in patterns
+              for token in str(pattern).replace(":", ",").split(",")]
+    everything = set(h.alias for machines in roles.values() for h in machines)
+    included, excluded = set(), set()
+    for token in tokens:
+        if not token:
+            continue
+        target = excluded if token.startswith("!") else included
+        token = token.lstrip("!&")
+        if token in ("all", "*"):
+            target.update(everything)
+            continue
+        for role, machines in roles.items():
+            if fnmatch.fnmatch(role, token):
+                target.update(h.alias for h in machines)
+        target.update(a for a in everything if fnmatch.fnmatch(a, token))
+    return included - excluded
+
+
+def get_targets(roles, call, extra_vars=None):
+    """Aliases of the machines targeted by a call.
+
+    The hosts of the plays of a playbook of the orchestrator (and of the
+    playbooks it imports) are rendered with the variables of the call. The
+    enoslib functions target their tc_hosts (all the machines otherwise).
+
+    :param roles: the roles of the machines
+    :param call: the playbook (or enoslib function) called
+    :param extra_vars: the variables passed to the call
+    """
+    extra_vars = extra_vars or {}
+    playbook = path.join(ANSIBLE_DIR, call)
+    if not call.endswith(".yml") or not path.exists(playbook):
+        return match_hosts(roles, extra_vars.get("tc_hosts", "all"))
+    with open(playbook) as f:
+        plays = yaml.safe_load(f) or []
+    hosts = set()
+    for play in plays:
+        if "import_playbook" in play:
+            if _imported(play.get("when"), extra_vars):
+                hosts.update(get_targets(roles, play["import_playbook"],
+                                         extra_vars))
+        elif "hosts" in play:
+            patterns = play["hosts"]
+            if isinstance(patterns, list):
+                patterns = [_render(p, extra_vars) for p in patterns]
+            else:
+                patterns = _render(patterns, extra_vars)
+            hosts.update(match_hosts(roles, patterns))
+    return hosts
+
+
+def record_call(env, call, extra_vars=None):
+    """Record an Ansible call instead of running it.
+
+    :param env: the environment
+    :param call: the playbook (or enoslib function) called
+    :param extra_vars: the variables passed to the call
+    """
+    extra_vars = extra_vars or {}
+    hosts = get_targets(env["roles"], call, extra_vars)
+    entry = {
+        "call": call,
+        "enos_action": extra_vars.get("enos_action"),
+        "time": time.time(),
+        "hosts": len(hosts),
+        "extra_vars_size": len(json.dumps(extra_vars, default=str)),
+        "plan_size": _plan_size(extra_vars.get("ombt_plan_dir"))
+    }
+    logger.info("Simulated call to %s (%s hosts, %s bytes of extra vars)",
+                call, entry["hosts"], entry["extra_vars_size"])
+    with open(path.join(env["resultdir"], CALLS), "a") as f:
+        f.write(json.dumps(entry) + "\n")
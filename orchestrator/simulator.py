@@ -0,0 +1,469 @@
+"""Offline discrete-event simulation of a qdr mesh.
+
+This gives a rough estimation of the behaviour of a topology (hop counts,
+load of the routers, latency and saturation point) without deploying it, so
+that only the promising configurations are run on the testbed.
+
+The model is simple on purpose (it needs to be fast to sweep hundreds of
+topologies):
+
+- each router is a FIFO queue forwarding a message in `service_time`
+- a message crossing two distinct machines is delayed by the link between
+  them: the delay and the transmission time at the rate set by the traffic
+  configuration for their groups (see :py:func:`link_costs`), `delay`
+  otherwise
+- messages follow the shortest paths of the router graph, the destination is
+  chosen according to the distribution of the address used by the call type
+  (see qdrouterd.conf.jinja2): balanced for rpc calls and casts, multicast
+  for fanouts and closest for the replies
+- each client performs its calls one after the other (waiting for the reply
+  for calls, for the delivery for casts and fanouts) with `pause` in between.
+"""
+import heapq
+import itertools
+import re
+
+import networkx as nx
+
+from orchestrator.constants import CALL_TYPE, NBR_CALLS, PAUSE, DRIVER, \
+    LENGTH
+from orchestrator.network import get_constraints
+from orchestrator.ombt import QdrConf
+
+# default time spent by a router to forward one message (seconds)
+SERVICE_TIME = 50e-6
+# default time spent by an ombt server to handle one call (seconds)
+SERVER_TIME = 0.0
+
+# distribution of the address targeted by each call type
+DISTRIBUTIONS = {
+    "rpc-call": "balanced",
+    "rpc-cast": "balanced",
+    "rpc-fanout": "multicast"
+}
+
+UNITS = {"us": 1e-6, "ms": 1e-3, "s": 1.0}
+RATE_UNITS = {"bit": 1.0, "kbit": 1e3, "mbit": 1e6, "gbit": 1e9, "tbit": 1e12}
+
+
+def parse_delay(delay):
+    """Parse a (tc) delay into seconds.
+
+    >>> parse_delay("10ms")
+    0.01
+    >>> parse_delay(None)
+    0.0
+    >>> parse_delay(0.5)
+    0.5
+
+    :param delay: delay as found in the traffic configuration
+    """
+    if delay is None:
+        return 0.0
+    if isinstance(delay, (int, float)):
+        return float(delay)
+    match = re.match(r"^\s*([0-9.]+)\s*(us|ms|s)?\s*$", delay)
+    if not match:
+        raise ValueError("Unknown delay %s" % delay)
+    value, unit = match.groups()
+    return float(value) * UNITS[unit or "s"]
+
+
+def parse_rate(rate):
+    """Parse a (tc) rate into bits per second (None if it's unlimited).
+
+    >>> parse_rate("10gbit")
+    10000000000.0
+    >>> parse_rate(None)
+
+    :param rate: rate as found in the traffic configuration
+    """
+    if rate is None:
+        return None
+    if isinstance(rate, (int, float)):
+        return float(rate)
+    match = re.match(r"^\s*([0-9.]+)\s*([a-z]*bit)?\s*$", rate.lower())
+    if not match or (match.group(2) or "bit") not in RATE_UNITS:
+        raise ValueError("Unknown rate %s" % rate)
+    value, unit = match.groups()
+    return float(value) * RATE_UNITS[unit or "bit"]
+
+
+def link_costs(roles, network_constraints, length=LENGTH):
+    """Time for a message to cross the link between two machines.
+
+    The constraints between the groups of the traffic configuration (as
+    applied by tasks.emulate) are mapped onto their machines, the last
+    constraint of a pair of machines wins as with tc.
+
+    >>> from enoslib.host import Host
+    >>> roles = {"bus": [Host("bus-0")], "ombt-client": [Host("agent-0")]}
+    >>> costs = link_costs(roles, {"default_delay": "10ms",
+    ...                            "default_rate": "1mbit",
+    ...                            "groups": ["bus", "ombt-client"]})
+    >>> round(costs[("agent-0", "bus-0")], 6)
+    0.018192
+
+    :param roles: the roles of the machines
+    :param network_constraints: a traffic configuration (None for no
+        constraint)
+    :param length: size of the messages (bytes)
+    :return: (source alias, destination alias) -> seconds
+    """
+    costs = {}
+    for constraint in get_constraints(roles, network_constraints):
+        cost = parse_delay(constraint["delay"])
+        rate = parse_rate(constraint["rate"])
+        if rate:
+            cost += length * 8 / rate
+        for src in roles.get(constraint["src"], []):
+            for dst in roles.get(constraint["dst"], []):
+                if src.alias != dst.alias:
+                    costs[(src.alias, dst.alias)] = cost
+    return costs
+
+
+def build_graph(bus_conf):
+    """Rebuild the graph of routers from the bus configuration.
+
+    Routers are identified by their router_id, connectors are matched
+    against the listeners of the other routers.
+
+    :param bus_conf: list of QdrConf (as generated by generate_bus_conf)
+    :return: networkx graph with the machine of each router as attribute
+    """
+    graph = nx.Graph()
+    listeners = {}
+    for bus_agent in bus_conf:
+        if not isinstance(bus_agent, QdrConf):
+            raise TypeError("Only qdr buses can be simulated")
+        conf = bus_agent.to_dict()
+        graph.add_node(conf["router_id"], machine=conf["machine"])
+        for listener in conf["listeners"]:
+            listeners[(listener["host"], listener["port"])] = conf["router_id"]
+
+    for bus_agent in bus_conf:
+        conf = bus_agent.to_dict()
+        for connector in conf["connectors"]:
+            peer = listeners[(connector["host"], connector["port"])]
+            graph.add_edge(conf["router_id"], peer)
+    return graph
+
+
+class _Message(object):
+    """A message in flight.
+
+    The tree gives the next routers of each router on the way, the targets
+    the agents delivered by each router.
+    """
+
+    __slots__ = ("source", "tree", "targets", "sent", "pending", "reply")
+
+    def __init__(self, source, tree, targets, sent, reply=False):
+        self.source = source
+        self.tree = tree
+        self.targets = targets
+        self.sent = sent
+        self.pending = sum(len(t) for t in targets.values())
+        self.reply = reply
+
+
+class Simulation(object):
+    """Simulates the ombt agents exchanging messages over a router graph."""
+
+    def __init__(self, graph, delay=0.0, service_time=SERVICE_TIME,
+                 server_time=SERVER_TIME, links=None):
+        self.graph = graph
+        self.delay = delay
+        self.links = links or {}
+        self.service_time = service_time
+        self.server_time = server_time
+        self.machines = nx.get_node_attributes(graph, "machine")
+        self._paths = {}
+        self._trees = {}
+
+    def link(self, machine, other):
+        if machine == other:
+            return 0.0
+        return self.links.get((machine, other), self.delay)
+
+    def path(self, source, destination):
+        if source not in self._paths:
+            self._paths[source] = nx.single_source_shortest_path(self.graph,
+                                                                 source)
+        return self._paths[source][destination]
+
+    def tree(self, source, destinations):
+        """Union of the shortest paths from source to the destinations."""
+        key = (source, destinations)
+        if key not in self._trees:
+            tree = {}
+            for destination in destinations:
+                path = self.path(source, destination)
+                tree.setdefault(path[-1], [])
+                for router, nxt in zip(path, path[1:]):
+                    children = tree.setdefault(router, [])
+                    if nxt not in children:
+                        children.append(nxt)
+            self._trees[key] = tree
+        return self._trees[key]
+
+    def run(self, clients, servers, call_type=CALL_TYPE, nbr_calls=NBR_CALLS,
+            pause=PAUSE):
+        """Run the simulation.
+
+        :param clients: list of (agent_id, machine, router, topic)
+        :param servers: list of (agent_id, machine, router, topic)
+        :return: the report of the simulation (see :py:func:`simulate`)
+        """
+        distribution = DISTRIBUTIONS[call_type]
+        servers_by_topic = {}
+        for server in servers:
+            servers_by_topic.setdefault(server[3], []).append(server)
+        # messages in flight per server (balanced distribution)
+        inflight = dict.fromkeys((s[0] for s in servers), 0)
+        busy_until = dict.fromkeys(self.graph, 0.0)
+        load = dict.fromkeys(self.graph, 0)
+        hops = []
+        latencies = []
+        unroutable = 0
+        events = []
+        seq = itertools.count()
+
+        def send(now, client, calls_left):
+            agent_id, machine, router, topic = client
+            candidates = servers_by_topic.get(topic)
+            if not candidates:
+                return 0
+            if distribution == "multicast":
+                destinations = candidates
+            else:
+                destinations = [min(
+                    candidates,
+                    key=lambda s: (inflight[s[0]],
+                                   len(self.path(router, s[2]))))]
+            targets = {}
+            for server in destinations:
+                targets.setdefault(server[2], []).append(server)
+                inflight[server[0]] += 1
+                hops.append(len(self.path(router, server[2])) - 1)
+            tree = self.tree(router, tuple(sorted(targets)))
+            message = _Message((client, calls_left), tree, targets, now)
+            arrival = now + self.link(machine, self.machines[router])
+            heapq.heappush(events, (arrival, next(seq), router, message))
+            return 1
+
+        for client in clients:
+            if nbr_calls > 0:
+                unroutable += 1 - send(0.0, client, nbr_calls - 1)
+
+        now = 0.0
+        while events:
+            now, _, router, message = heapq.heappop(events)
+            start = max(now, busy_until[router])
+            done = start + self.service_time
+            busy_until[router] = done
+            load[router] += 1
+            machine = self.machines[router]
+            for nxt in message.tree[router]:
+                arrival = done + self.link(machine, self.machines[nxt])
+                heapq.heappush(events, (arrival, next(seq), nxt, message))
+
+            for agent in message.targets.get(router, []):
+                delivered = done + self.link(machine, agent[1])
+                message.pending -= 1
+                if not message.reply:
+                    inflight[agent[0]] -= 1
+                if call_type == "rpc-call" and not message.reply:
+                    # the server answers to the client
+                    client = message.source[0]
+                    tree = self.tree(agent[2], (client[2],))
+                    reply = _Message(message.source, tree,
+                                     {client[2]: [client]}, message.sent,
+                                     reply=True)
+                    arrival = delivered + self.server_time + \
+                        self.link(agent[1], machine)
+                    heapq.heappush(events,
+                                   (arrival, next(seq), agent[2], reply))
+                    continue
+
+                if message.pending == 0:
+                    latencies.append(delivered - message.sent)
+                    client, calls_left = message.source
+                    if calls_left > 0:
+                        unroutable += 1 - send(delivered + pause, client,
+                                               calls_left - 1)
+
+        return report(load, hops, latencies, unroutable, now,
+                      self.service_time, len(clients))
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def report(load, hops, latencies, unroutable, duration, service_time,
+           nbr_clients):
+    latencies = sorted(latencies)
+    utilization = {r: (l * service_time / duration if duration else 0.0)
+                   for r, l in load.items()}
+    bottleneck = max(utilization, key=utilization.get) if utilization \
+        else None
+    max_utilization = utilization.get(bottleneck, 0.0)
+    return {
+        "duration": duration,
+        "calls": len(latencies),
+        "unroutable": unroutable,
+        "throughput": len(latencies) / duration if duration else 0.0,
+        "hops": {
+            "mean": sum(hops) / float(len(hops)) if hops else None,
+            "max": max(hops) if hops else None,
+        },
+        "latency": {
+            "mean": (sum(latencies) / len(latencies)) if latencies else None,
+            "p50": _percentile(latencies, 50),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "load": load,
+        "saturation": {
+            "router": bottleneck,
+            "utilization": max_utilization,
+            # the offered load grows (at most) linearly with the clients
+            "nbr_clients": (nbr_clients / max_utilization
+                            if max_utilization else None),
+        },
+    }
+
+
+def _agents(ombt_confs, agent_type):
+    agents = []
+    for confs in ombt_confs.get(agent_type, {}).values():
+        for agent in confs:
+            router = agent.bus_agents[0].to_dict()["router_id"]
+            agents.append((agent.agent_id, agent.machine, router, agent.topic))
+    return agents
+
+
+def simulate(bus_conf, ombt_confs, call_type=CALL_TYPE, nbr_calls=NBR_CALLS,
+             pause=PAUSE, delay=0.0, service_time=SERVICE_TIME,
+             server_time=SERVER_TIME, links=None):
+    """Simulate a test case on a qdr bus.
+
+    :param bus_conf: list of QdrConf (as generated by generate_bus_conf)
+    :param ombt_confs: the agents (as generated by generate_shard_conf)
+    :param call_type: rpc-call, rpc-cast or rpc-fanout
+    :param nbr_calls: number of calls per client
+    :param pause: pause between two calls of a client (seconds)
+    :param delay: delay between two machines (seconds or tc string)
+        without link cost
+    :param service_time: time to forward a message in a router (seconds)
+    :param server_time: time for a server to handle a call (seconds)
+    :param links: cost of the links between the machines (see
+        :py:func:`link_costs`)
+    :return: a dict with the predicted duration, throughput (calls/s), hop
+        counts (between routers), latencies (seconds), load (messages per
+        router) and saturation (the most utilized router, its utilization
+        and the estimated number of clients saturating it).
+    """
+    graph = build_graph(bus_conf)
+    simulation = Simulation(graph, delay=parse_delay(delay),
+                            service_time=service_time,
+                            server_time=server_time, links=links)
+    return simulation.run(_agents(ombt_confs, "rpc-client"),
+                          _agents(ombt_confs, "rpc-server"),
+                          call_type=call_type, nbr_calls=nbr_calls,
+                          pause=pause)
+
+
+def plan_roles(nbr_bus_machines=1, nbr_agent_machines=1):
+    """The fake machines of a planned deployment.
+
+    :param nbr_bus_machines: number of machines hosting the routers
+    :param nbr_agent_machines: number of machines hosting the ombt agents
+    """
+    from enoslib.host import Host
+
+    def hosts(role, number):
+        return [Host("%s-%s" % (role, i)) for i in range(number)]
+
+    return {
+        "bus": hosts("bus", nbr_bus_machines),
+        "control-bus": hosts("control", 1),
+        "ombt-control": hosts("control", 1),
+        "ombt-client": hosts("agent", nbr_agent_machines),
+        "ombt-server": hosts("agent", nbr_agent_machines),
+    }
+
+
+def plan(driver, nbr_bus_machines=1, nbr_agent_machines=1, nbr_clients=1,
+         nbr_servers=1, topics=None, call_type=CALL_TYPE, **kwargs):
+    """Plan a deployment on fake machines (nothing is deployed).
+
+    :param driver: the driver configuration (e.g. conf["drivers"]["router"])
+    :param nbr_bus_machines: number of machines hosting the routers
+    :param nbr_agent_machines: number of machines hosting the ombt agents
+    :return: bus_conf, ombt_confs as generated for a real deployment
+    """
+    # late import: tasks pulls the whole deployment machinery
+    import orchestrator.tasks as t
+
+    roles = plan_roles(nbr_bus_machines, nbr_agent_machines)
+    env = {"roles": roles}
+    env["bus_conf"] = t.generate_bus_conf(driver, roles["bus"],
+                                          context="bus")
+    env["control_bus_conf"] = t.generate_bus_conf(DRIVER,
+                                                  roles["control-bus"],
+                                                  context="control-bus")
+    kwargs.setdefault("nbr_calls", NBR_CALLS)
+    kwargs.setdefault("pause", PAUSE)
+    for key in ["timeout", "length", "executor"]:
+        kwargs.setdefault(key, None)
+    ombt_confs = t.generate_shard_conf(0, 0, 0,
+                                       nbr_clients=nbr_clients,
+                                       nbr_servers=nbr_servers,
+                                       call_type=call_type,
+                                       env=env,
+                                       topics=topics or t.get_topics(1),
+                                       iteration_id="simulation",
+                                       **kwargs)
+    return env["bus_conf"], ombt_confs
+
+
+def sweep(topologies, traffic=None, nbr_bus_machines=1, nbr_agent_machines=1,
+          nbr_clients=1, nbr_servers=1, topics=None, call_type=CALL_TYPE,
+          nbr_calls=NBR_CALLS, pause=PAUSE, delay=0.0, length=LENGTH,
+          **kwargs):
+    """Simulate the same test case on several topologies.
+
+    :param topologies: (name, driver configuration) of each topology
+    :param traffic: the traffic configuration setting the links between the
+        machines (see :py:func:`link_costs`)
+    :param length: size of the messages (bytes)
+    :return: (name, report) of each topology (see :py:func:`simulate`)
+    """
+    roles = plan_roles(nbr_bus_machines, nbr_agent_machines)
+    links = link_costs(roles, traffic, length=length)
+    reports = []
+    for name, driver in topologies:
+        bus_conf, ombt_confs = plan(driver,
+                                    nbr_bus_machines=nbr_bus_machines,
+                                    nbr_agent_machines=nbr_agent_machines,
+                                    nbr_clients=nbr_clients,
+                                    nbr_servers=nbr_servers,
+                                    topics=topics,
+                                    call_type=call_type,
+                                    nbr_calls=nbr_calls,
+                                    pause=pause,
+                                    length=length)
+        reports.append((name, simulate(bus_conf, ombt_confs,
+                                       call_type=call_type,
+                                       nbr_calls=nbr_calls,
+                                       pause=pause,
+                                       delay=delay,
+                                       links=links,
+                                       **kwargs)))
+    return reports
@@ -0,0 +1,260 @@
+"""Lazy sweep of the parameters of a campaign.
+
+execo_engine.sweep builds the whole cartesian product of the parameters and
+the ParamSweeper saves it, then the filter of the test case sorts all the
+remaining points at each get_next. The sweep space here is never expanded:
+
+- the points are generated one at a time in the (driver, call_type, key)
+  order of the test case (see campaign.sort_parameters), the other
+  parameters following the order of the configuration,
+- the condition of the test case (e.g nbr_servers <= nbr_clients) is checked
+  on the partial points while they're expanded: a branch is dropped as soon
+  as the parameters it reads are set,
+- only the points done are saved, one JSON line each in
+  <persistence_dir>/points.jsonl.
+
+As with the ParamSweeper, the points skipped (failed) and those left in
+progress by an interrupted campaign are run again by the next campaign (the
+failures are kept in the journal).
+"""
+import json
+import logging
+import os
+import pickle
+from os import path
+
+from execo_engine import HashableDict
+
+import orchestrator.journal as journal
+
+logger = logging.getLogger(__name__)
+
+POINTS = "points.jsonl"
+# parameters streamed first, the key of the test case follows
+ORDER = ["driver", "call_type"]
+
+
+def get_dimensions(parameters, key=None):
+    """The parameters to expand and their values, in the order of the sweep.
+
+    >>> get_dimensions({"nbr_clients": [10, 1, 10], "delay": [None, "10ms"],
+    ...                 "driver": ["router", "broker"], "pause": []},
+    ...                key="nbr_clients")
+    [('driver', ['broker', 'router']), ('nbr_clients', [1, 10]), \
+('delay', [None, '10ms'])]
+
+    :param parameters: the values of each parameter (as given to
+        execo_engine.sweep, without sub-sweeps)
+    :param key: the key of the test case
+    :return: (name, values) without duplicates, the values of the ordering
+        parameters sorted
+    """
+    ordered = [k for k in ORDER + [key] if k in parameters]
+    names = ordered + [k for k in parameters if k not in ordered]
+    dimensions = []
+    for name in names:
+        values = []
+        for value in parameters[name]:
+            if value not in values:
+                values.append(value)
+        if not values:
+            continue
+        dimensions.append((name, sorted(values) if name in ordered
+                           else values))
+    return dimensions
+
+
+def admissible(condition, point):
+    """Tell if a (partial) point may meet the condition.
+
+    >>> condition = lambda p: p["nbr_servers"] <= p["nbr_clients"]
+    >>> admissible(condition, {"nbr_clients": 1})
+    True
+    >>> admissible(condition, {"nbr_clients": 1, "nbr_servers": 2})
+    False
+    """
+    if condition is None:
+        return True
+    try:
+        return bool(condition(point))
+    except KeyError:
+        # the parameters read by the condition aren't all set yet
+        return True
+
+
+def expand(dimensions, condition=None):
+    """Generate the points of the sweep space, pruned by the condition.
+
+    >>> dimensions = get_dimensions({"nbr_clients": [2, 1],
+    ...                              "nbr_servers": [1, 2],
+    ...                              "driver": ["router", "broker"]},
+    ...                             key="nbr_clients")
+    >>> for p in expand(dimensions,
+    ...                 lambda p: p["nbr_servers"] <= p["nbr_clients"]):
+    ...     print(p["driver"], p["nbr_clients"], p["nbr_servers"])
+    broker 1 1
+    broker 2 1
+    broker 2 2
+    router 1 1
+    router 2 1
+    router 2 2
+
+    :param dimensions: the parameters and their values (see
+        :py:func:`get_dimensions`)
+    :param condition: predicate of the points (None for all of them)
+    """
+    if not dimensions:
+        return
+    stack = [(0, HashableDict())]
+    while stack:
+        depth, point = stack.pop()
+        name, values = dimensions[depth]
+        children = []
+        for value in values:
+            child = HashableDict(point)
+            child[name] = value
+            if admissible(condition, child):
+                children.append(child)
+        if depth + 1 == len(dimensions):
+            for child in children:
+                yield child
+        else:
+            stack.extend((depth + 1, child) for child in reversed(children))
+
+
+def _load_param_sweeper_done(persistence_dir):
+    """The points done saved by a ParamSweeper.
+
+    ParamSweeper.get_done only gives the points of its sweeps, i.e not those
+    saved with other keys (e.g the backup_dir of the former campaigns).
+
+    :param persistence_dir: the persistence directory of the ParamSweeper
+    """
+    points = []
+    with open(path.join(persistence_dir, "done"), "rb") as f:
+        while True:
+            try:
+                points.append(pickle.load(f))
+            except EOFError:
+                return points
+
+
+def _point_id(point):
+    return json.dumps(dict(point), sort_keys=True)
+
+
+class LazySweeper(object):
+    """A ParamSweeper over a sweep space that's never expanded.
+
+    >>> import tempfile
+    >>> persistence_dir = tempfile.mkdtemp()
+    >>> parameters = {"nbr_clients": [1, 2], "nbr_servers": [1, 2],
+    ...               "driver": ["broker"]}
+    >>> condition = lambda p: p["nbr_servers"] <= p["nbr_clients"]
+    >>> sweeper = LazySweeper(persistence_dir, parameters, key="nbr_clients",
+    ...                       condition=condition)
+    >>> first = sweeper.get_next()
+    >>> sorted(first.items())
+    [('driver', 'broker'), ('nbr_clients', 1), ('nbr_servers', 1)]
+    >>> sweeper.done(first)
+    >>> skipped = sweeper.get_next()
+    >>> sweeper.skip(skipped)
+    >>> len(list(sweeper.get_remaining()))
+    1
+    >>> # the state is saved with the points done only
+    >>> sweeper = LazySweeper(persistence_dir, parameters, key="nbr_clients",
+    ...                       condition=condition)
+    >>> len(sweeper.get_done()), len(sweeper.get_skipped())
+    (1, 0)
+    >>> sweeper.get_next() == skipped
+    True
+
+    :param persistence_dir: where the state of the sweep is saved
+    :param parameters: the values of each parameter (None to read the state
+        only, e.g for the catalog)
+    :param key: the key of the test case
+    :param condition: predicate of the points (None for all of them)
+    :param name: name of the sweep (for the logs)
+    """
+
+    # the catalog doesn't list the remaining points, they can't be counted
+    # without expanding the sweep space
+    statuses = ["done", "skipped", "inprogress"]
+
+    def __init__(self, persistence_dir, parameters=None, key=None,
+                 condition=None, name=None):
+        self.persistence_dir = persistence_dir
+        self.name = name
+        self.dimensions = get_dimensions(parameters or {}, key=key)
+        self.condition = condition
+        self._done = {}
+        self._skipped = {}
+        self._inprogress = {}
+        self._points = None
+        if not path.isdir(persistence_dir):
+            os.makedirs(persistence_dir)
+        self._load()
+
+    def _load(self):
+        points_path = path.join(self.persistence_dir, POINTS)
+        if self.dimensions and not path.exists(points_path) and \
+                path.exists(path.join(self.persistence_dir, "done")):
+            # state of a campaign started with a ParamSweeper, whose points
+            # done may hold other keys (e.g backup_dir)
+            names = set(name for name, _ in self.dimensions)
+            for point in _load_param_sweeper_done(self.persistence_dir):
+                self._save(dict((k, v) for k, v in point.items()
+                                if k in names), "done")
+        for entry in journal.read_lines(points_path):
+            # the points skipped by a former version are run again
+            if entry["status"] == "done":
+                point = HashableDict(entry["point"])
+                self._done[_point_id(point)] = point
+        logger.info("%s: %s points done", self.name, len(self._done))
+
+    def _save(self, point, status):
+        journal.append_line(path.join(self.persistence_dir, POINTS),
+                            {"point": dict(point), "status": status})
+
+    def _is_new(self, point_id):
+        return point_id not in self._done and \
+            point_id not in self._skipped and \
+            point_id not in self._inprogress
+
+    def get_next(self):
+        """The next point to run (None once all of them are done or skipped)."""
+        if self._points is None:
+            self._points = expand(self.dimensions, self.condition)
+        for point in self._points:
+            point_id = _point_id(point)
+            if self._is_new(point_id):
+                self._inprogress[point_id] = point
+                return point
+        return None
+
+    def done(self, point):
+        point_id = _point_id(point)
+        self._inprogress.pop(point_id, None)
+        self._skipped.pop(point_id, None)
+        self._done[point_id] = point
+        self._save(point, "done")
+
+    def skip(self, point):
+        """Give up a point until the next campaign (it isn't saved)."""
+        point_id = _point_id(point)
+        self._inprogress.pop(point_id, None)
+        self._skipped[point_id] = point
+
+    def get_done(self):
+        return set(self._done.values())
+
+    def get_skipped(self):
+        return set(self._skipped.values())
+
+    def get_inprogress(self):
+        return set(self._inprogress.values())
+
+    def get_remaining(self):
+        """Generate the points neither done, skipped nor in progress."""
+        return (p for p in expand(self.dimensions, self.condition)
+                if self._is_new(_point_id(p)))
@@ -1,12 +1,21 @@
+import hashlib
 import itertools
 import json
+import logging
 import os
+import shutil
+import subprocess
 import sys
+import time
 import uuid
+from datetime import datetime
 from os import path
 
-from enoslib.api import run_ansible, generate_inventory, emulate_network, \
-    validate_network, reset_network
+import yaml
+
+from ansible import constants as ansible_constants
+from enoslib.api import run_ansible, generate_inventory, reset_network
+from enoslib.errors import EnosError, EnosFailedHostsError
 # NOTE()msimonin) dropping the chameleon support temporary
 #from enoslib.infra.enos_chameleonkvm.provider import Chameleonkvm
 from enoslib.infra.enos_g5k.provider import G5k
@@ -14,16 +23,26 @@ from enoslib.infra.enos_vagrant.provider import Enos_vagrant
 from enoslib.infra.enos_static.provider import Static
 from enoslib.task import enostask
 
-from orchestrator.constants import BACKUP_DIR, ANSIBLE_DIR, DRIVER, VERSION, MODE
+import orchestrator.network as network
+from orchestrator.binding import get_binding
+from orchestrator.constants import BACKUP_DIR, ANSIBLE_DIR, DRIVER, VERSION, MODE, \
+    BINDING, FACTS_DIR, BACKUP_SAMPLE, PARTITIONS_DIR, VALIDATION_FRACTION
 from orchestrator.ombt import OmbtClient, OmbtController, OmbtServer, \
     RabbitMQConf, QdrConf
-from orchestrator.qpid_dispatchgen import get_conf, generate, round_robin
+from orchestrator.partition import PARTITIONED, SHARED, split_roles
+from orchestrator.qpid_dispatchgen import iter_conf, generate, \
+    get_distribution, add_edge_routers
+from orchestrator.simulated import SIMULATED, Simulated, record_call
+from orchestrator.timings import timed
+from orchestrator.watchdog import Saturated, Watchdog, get_config
 
 if sys.version_info[0] < 3:
     import pathlib2 as pathlib
 else:
     import pathlib
 
+logger = logging.getLogger(__name__)
+
 
 def shard_value(value, shards, include_zero=False):
     """Shard a value in multiple values.
@@ -134,9 +153,7 @@ def get_topics(number):
     :return: A list of topic names.
     """
     length = len(str(number)) if number % 10 else len(str(number)) - 1
-    sequence = ("{number:0{width}}".format(number=n, width=length)
-                for n in range(number))
-    return ["topic-{}".format(e) for e in sequence]
+    return ["topic-%0*d" % (length, n) for n in range(number)]
 
 
 def generate_ansible_conf(key, bus_conf, configuration=None):
@@ -148,10 +165,13 @@ def generate_ansible_conf(key, bus_conf, configuration=None):
     return ansible_conf
 
 
-def get_backup_directory(backup_dir):
+def get_backup_directory(backup_dir, env=None):
     cwd = os.getcwd()
     # current directory name is constant because of enoslib implementation
     current_directory = path.join(cwd, "current")
+    # the partitions backup in the environment of their campaign
+    if env is not None and env.get("backup_root"):
+        current_directory = env["backup_root"]
     backup_dir = path.join(current_directory, backup_dir)
     pathlib.Path(backup_dir).mkdir(parents=True, exist_ok=True)
     return backup_dir
@@ -160,22 +180,32 @@ def get_backup_directory(backup_dir):
 # g5k and vagrant are mutually exclusive, in the future we might want
 # to factorize it and have a switch on the command line to choose.
 @enostask(new=True)
+@timed
 def g5k(**kwargs):
     # Here **kwargs strictly means (force, config, env), no more no less
     init_provider(G5k, "g5k", **kwargs)
 
 
 @enostask(new=True)
+@timed
 def vagrant(**kwargs):
     # Here **kwargs strictly means (force, config, env), no more no less
     init_provider(Enos_vagrant, "vagrant", **kwargs)
 
 
 @enostask(new=True)
+@timed
 def static(**kwargs):
     # Here **kwargs strictly means (force, config, env), no more no less
     init_provider(Static, "static", **kwargs)
 
+
+@enostask(new=True)
+@timed
+def simulated(**kwargs):
+    # Here **kwargs strictly means (force, config, env), no more no less
+    init_provider(Simulated, SIMULATED, **kwargs)
+
 # @enostask(new=True)
 #def chameleon(**kwargs):
 #    # Here **kwargs strictly means (force, config, env), no more no less
@@ -185,7 +215,13 @@ def static(**kwargs):
 def init_provider(provider, name, force, config, env):
     instance = provider(config[name])
     roles, networks = instance.init(force_deploy=force)
+    # the facts are gathered again with the next inventory
+    flush_fact_cache(env)
+    if force:
+        # fresh machines, nothing is deployed anymore
+        env["deployed"] = None
     env["config"] = config
+    env["provider"] = name
     env["roles"] = roles
     env["networks"] = networks
 
@@ -193,18 +229,166 @@ def init_provider(provider, name, force, config, env):
 PROVIDERS = {
     "g5k": g5k,
     "vagrant": vagrant,
-    "static": static
+    "static": static,
+    SIMULATED: simulated
 #    "chameleon": chameleon
 }
 
 
 @enostask()
+@timed
 def inventory(**kwargs):
     env = kwargs["env"]
     roles = env["roles"]
     networks = env["networks"]
     env["inventory"] = path.join(env["resultdir"], "hosts")
-    generate_inventory(roles, networks, env["inventory"], check_networks=True)
+    # the simulated machines can't be asked their network interfaces
+    generate_inventory(roles, networks, env["inventory"],
+                       check_networks=not is_simulated(env))
+    # fill the fact cache once for all the subsequent playbooks
+    flush_fact_cache(env)
+    run_playbook("facts.yml", env)
+
+
+def use_fact_cache(env):
+    """Make Ansible use the fact cache of the environment.
+
+    The facts are gathered once by :py:func:`inventory` in <env_dir>/facts
+    and reused by all the playbooks (with the smart gathering, a play only
+    gathers the facts of the hosts missing from the cache). The cache never
+    expires, it's flushed when the provider is initialized again.
+    """
+    facts_dir = path.join(env["resultdir"], FACTS_DIR)
+    ansible_constants.CACHE_PLUGIN = "jsonfile"
+    ansible_constants.CACHE_PLUGIN_CONNECTION = facts_dir
+    ansible_constants.CACHE_PLUGIN_TIMEOUT = 0
+    ansible_constants.DEFAULT_GATHERING = "smart"
+    # the cache plugin reads its options from the environment
+    os.environ["ANSIBLE_CACHE_PLUGIN_CONNECTION"] = facts_dir
+    os.environ["ANSIBLE_CACHE_PLUGIN_TIMEOUT"] = "0"
+
+
+def flush_fact_cache(env):
+    shutil.rmtree(path.join(env["resultdir"], FACTS_DIR), ignore_errors=True)
+
+
+def is_simulated(env):
+    return env.get("provider") == SIMULATED
+
+
+def is_partition(env):
+    return env.get("partition") is not None
+
+
+def get_network_roles(env):
+    """Roles of the network emulation, a partition leaves the machines of
+    the shared services alone (they're shared with the other partitions)."""
+    if not is_partition(env):
+        return env["roles"]
+    return dict((role, machines) for role, machines in env["roles"].items()
+                if role not in SHARED)
+
+
+def get_partition_hosts(env):
+    """Aliases of the machines of a partition (without the shared ones)."""
+    return sorted(set(h.alias for role in PARTITIONED
+                      for h in env["roles"].get(role, [])))
+
+
+@enostask()
+@timed
+def services(**kwargs):
+    """Deploy (or destroy) the services shared by the partitions."""
+    env = kwargs["env"]
+    extra_vars = {
+        "enos_action": kwargs.get("action", "deploy"),
+        "registry": env["config"]["registry"]
+    }
+    run_playbook("services.yml", env, extra_vars=extra_vars)
+
+
+@enostask()
+@timed
+def partition(**kwargs):
+    """Split the machines into partitions (see orchestrator.partition).
+
+    Each partition gets its own environment (<env_dir>/partitions/<index>)
+    with its inventory and a copy of the fact cache. Its backups are written
+    in the environment of the campaign.
+
+    :return: the environment directories of the partitions
+    """
+    env = kwargs["env"]
+    partitions = split_roles(env["roles"], kwargs["size"],
+                             number=kwargs.get("number"))
+    partition_dirs = []
+    for index, roles in enumerate(partitions):
+        partition_dir = path.join(env["resultdir"], PARTITIONS_DIR, str(index))
+        pathlib.Path(partition_dir).mkdir(parents=True, exist_ok=True)
+        partition_env = make_partition_env(env, index, roles, partition_dir)
+        facts_dir = path.join(partition_dir, FACTS_DIR)
+        shutil.rmtree(facts_dir, ignore_errors=True)
+        if path.isdir(path.join(env["resultdir"], FACTS_DIR)):
+            shutil.copytree(path.join(env["resultdir"], FACTS_DIR), facts_dir)
+        # the network interfaces are known from the inventory of the campaign
+        generate_inventory(roles, env["networks"], partition_env["inventory"],
+                           check_networks=False)
+        # same format as the environments saved by enoslib
+        with open(path.join(partition_dir, "env"), "w") as f:
+            yaml.dump(partition_env, f)
+        partition_dirs.append(partition_dir)
+    return partition_dirs
+
+
+def get_aliases(roles):
+    return dict((role, [h.alias for h in machines])
+                for role, machines in roles.items())
+
+
+def make_partition_env(env, index, roles, partition_dir):
+    """Environment of a partition.
+
+    The deployment of a previous campaign is kept if the partition has the
+    same machines.
+    """
+    partition_env = {}
+    env_path = path.join(partition_dir, "env")
+    if path.isfile(env_path):
+        with open(env_path) as f:
+            partition_env = yaml.load(f, Loader=yaml.Loader)
+    if get_aliases(partition_env.get("roles", {})) != get_aliases(roles):
+        partition_env["deployed"] = None
+    partition_env.update({
+        "config": env["config"],
+        "config_file": env.get("config_file"),
+        "user": env.get("user"),
+        "cwd": env.get("cwd"),
+        "phase": env.get("phase"),
+        "nodes": {},
+        "provider": env["provider"],
+        "networks": env["networks"],
+        "roles": roles,
+        "resultdir": partition_dir,
+        "inventory": path.join(partition_dir, "hosts"),
+        "partition": index,
+        "backup_root": env["resultdir"]
+    })
+    return partition_env
+
+
+def run_playbook(playbook, env, extra_vars=None):
+    """Run a playbook of the orchestrator on the hosts of the environment."""
+    if is_partition(env):
+        # the shared services are deployed once by the campaign, the
+        # partition only configures the metrics of its own machines
+        extra_vars = dict(extra_vars or {}, shared_services=False,
+                          partition_hosts=",".join(get_partition_hosts(env)))
+    if is_simulated(env):
+        record_call(env, playbook, extra_vars)
+        return
+    use_fact_cache(env)
+    run_ansible([path.join(ANSIBLE_DIR, playbook)], env["inventory"],
+                extra_vars=extra_vars)
 
 
 def generate_bus_conf(config, role_machines, context=""):
@@ -245,8 +429,13 @@ def generate_bus_conf(config, role_machines, context=""):
     elif config["type"] == "qdr":
         # Building the graph of routers
         graph = generate(config["topology"], *config["args"])
-        bus_conf = get_conf(graph, machines, round_robin)
-        bus_conf = [QdrConf(c) for c in bus_conf.values()]
+        # hierarchical topology: the graph above is the core of interior
+        # routers to which the edge routers are attached
+        if config.get("edge_routers"):
+            graph = add_edge_routers(graph, config["edge_routers"])
+        distribution = get_distribution(config)
+        bus_conf = [QdrConf(c)
+                    for _, c in iter_conf(graph, machines, distribution)]
 
     else:
         raise TypeError("Unknown broker chosen")
@@ -254,8 +443,35 @@ def generate_bus_conf(config, role_machines, context=""):
     return bus_conf
 
 
+def get_fingerprint(extra_vars):
+    """Fingerprint of a deployment of the bus.
+
+    >>> fingerprint = get_fingerprint({"broker": "qdr",
+    ...                                "bus_conf": [{"port": 5000}]})
+    >>> fingerprint == get_fingerprint({"bus_conf": [{"port": 5000}],
+    ...                                 "broker": "qdr"})
+    True
+    >>> fingerprint == get_fingerprint({"broker": "qdr",
+    ...                                 "bus_conf": [{"port": 5001}]})
+    False
+
+    :param extra_vars: the variables of the deployment (bus configurations
+                       and driver settings)
+    """
+    dump = json.dumps(extra_vars, sort_keys=True, default=str)
+    return hashlib.sha1(dump.encode("utf-8")).hexdigest()
+
+
 @enostask()
+@timed
 def prepare(**kwargs):
+    """Deploy the bus of a driver.
+
+    If the same bus (same fingerprint, see :py:func:`get_fingerprint`) is
+    already deployed, its containers are reused: only the ombt agents are
+    removed and the bus state is reset. Otherwise the previous bus (if any)
+    is destroyed before deploying the new one.
+    """
     env = kwargs["env"]
     driver = kwargs["driver"]
     # Generate inventory
@@ -270,7 +486,6 @@ def prepare(**kwargs):
     # minimal set of parameters of each agents of the bus. This configuration
     # dict is used in subsequent test* tasks to configure the ombt agents.
     bus_conf = generate_bus_conf(config, env["roles"]["bus"], context="bus")
-    env["bus_conf"] = bus_conf
     ansible_bus_conf = generate_ansible_conf("bus_conf", bus_conf, config)
 
     # NOTE(msimonin): still hardcoding the control_bus configuration for now
@@ -278,7 +493,6 @@ def prepare(**kwargs):
     control_bus_conf = generate_bus_conf(control_config,
                                          env["roles"]["control-bus"],
                                          context="control-bus")
-    env["control_bus_conf"] = control_bus_conf
     ansible_control_bus_conf = generate_ansible_conf("control_bus_conf",
                                                      control_bus_conf, config)
 
@@ -286,13 +500,45 @@ def prepare(**kwargs):
     extra_vars.update(ansible_bus_conf)
     extra_vars.update(ansible_control_bus_conf)
 
-    run_ansible([path.join(ANSIBLE_DIR, "site.yml")],
-                env["inventory"], extra_vars=extra_vars)
-    # broker is a ansible-required variable
-    env["broker"] = config["type"]
+    fingerprint = get_fingerprint(extra_vars)
+    deployed = env.get("deployed")
+    if deployed == fingerprint and reset_bus(env, extra_vars):
+        logger.info("Reusing the deployed bus %s", fingerprint)
+    else:
+        if deployed:
+            # another bus is running
+            destroy_deployment(env)
+        env["bus_conf"] = bus_conf
+        env["control_bus_conf"] = control_bus_conf
+        # broker is a ansible-required variable
+        env["broker"] = config["type"]
+        run_playbook("site.yml", env, extra_vars=extra_vars)
+        env["deployed"] = fingerprint
+
+    # how the ombt agents are bound to the bus agents
+    env["binding"] = config.get("binding", BINDING)
+
+
+def reset_bus(env, extra_vars):
+    """Remove the ombt agents and reset the state of the deployed bus.
+
+    :param env: the environment (with the deployed bus)
+    :param extra_vars: the variables of the deployment of the bus
+    :return: False if the bus isn't running anymore
+    """
+    extra_vars = dict(extra_vars, enos_action="destroy")
+    run_playbook("ombt.yml", env, extra_vars=extra_vars)
+    extra_vars.update({"enos_action": "reset"})
+    try:
+        run_playbook("reset_bus.yml", env, extra_vars=extra_vars)
+    except EnosFailedHostsError:
+        logger.warning("The deployed bus can't be reused")
+        return False
+    return True
 
 
 @enostask()
+@timed
 def test_case_1(**kwargs):
     if "iteration_id" not in kwargs:
         kwargs["iteration_id"] = uuid.uuid4()
@@ -305,6 +551,7 @@ def test_case_1(**kwargs):
     # accross the different available shards
     env = kwargs["env"]
     shards = len(env["control_bus_conf"])
+    bindings = get_bindings(env)
     ombt_confs = {}
     s_clients = shard_value(kwargs["nbr_clients"], shards, include_zero=True)
     s_servers = shard_value(kwargs["nbr_servers"], shards, include_zero=True)
@@ -322,6 +569,7 @@ def test_case_1(**kwargs):
             shard_index,
             sum(s_servers[0:shard_index]),
             sum(s_clients[0:shard_index]),
+            bindings=bindings,
             **kwargs)
         merge_ombt_confs(ombt_confs, ombt_conf)
 
@@ -329,6 +577,7 @@ def test_case_1(**kwargs):
 
 
 @enostask()
+@timed
 def test_case_2(**kwargs):
     if "iteration_id" not in kwargs:
         kwargs["iteration_id"] = uuid.uuid4()
@@ -343,6 +592,7 @@ def test_case_2(**kwargs):
     # accross the different available shards
     env = kwargs["env"]
     shards = len(env["control_bus_conf"])
+    bindings = get_bindings(env)
     # NOTE(msimonin): No topic means no client and no servers
     # Thus no test
     s_topics = shard_list(topics, shards, include_empty=False)
@@ -355,6 +605,7 @@ def test_case_2(**kwargs):
             shard_index,
             len(s_topic[0:shard_index]),
             len(s_topic[0:shard_index]),
+            bindings=bindings,
             **kwargs)
         merge_ombt_confs(ombt_confs, ombt_conf)
 
@@ -362,6 +613,7 @@ def test_case_2(**kwargs):
 
 
 @enostask()
+@timed
 def test_case_3(**kwargs):
     if "iteration_id" not in kwargs:
         kwargs["iteration_id"] = uuid.uuid4()
@@ -374,6 +626,7 @@ def test_case_3(**kwargs):
     # We need to replicate the client on every controller
     env = kwargs["env"]
     shards = len(env["control_bus_conf"])
+    bindings = get_bindings(env)
     s_servers = shard_value(kwargs["nbr_servers"], shards, include_zero=False)
     ombt_confs = {}
     for shard_index, s_server in zip(range(shards), s_servers):
@@ -383,6 +636,7 @@ def test_case_3(**kwargs):
             shard_index,
             sum(s_server[0:shard_index]),
             shard_index,
+            bindings=bindings,
             **kwargs)
         merge_ombt_confs(ombt_confs, ombt_conf)
 
@@ -390,6 +644,7 @@ def test_case_3(**kwargs):
 
 
 @enostask()
+@timed
 def test_case_4(**kwargs):
     if "iteration_id" not in kwargs:
         kwargs["iteration_id"] = uuid.uuid4()
@@ -405,6 +660,7 @@ def test_case_4(**kwargs):
     # So that a broadcast domains will belong to a single controller
     env = kwargs["env"]
     shards = len(env["control_bus_conf"])
+    bindings = get_bindings(env)
     nbr_clients = kwargs["nbr_clients"]
     nbr_servers = kwargs["nbr_servers"]
     s_topics = shard_list(topics, shards, include_empty=False)
@@ -417,16 +673,49 @@ def test_case_4(**kwargs):
             shard_index,
             len(s_topic[0:shard_index]) * nbr_servers,
             len(s_topic[0:shard_index]) * nbr_clients,
+            bindings=bindings,
             **kwargs)
         merge_ombt_confs(ombt_confs, ombt_conf)
 
     test_case(ombt_confs, **kwargs)
 
 
+def get_bindings(env):
+    """Build the bindings of each agent type to the bus agents.
+
+    The candidates bus agents are indexed once (by machine) so that binding
+    the agents of all the shards stays linear in the number of agents.
+    """
+    bus_conf = env["bus_conf"]
+    machine_client = env["roles"]["bus"]
+    if "bus-client" in env["roles"]:
+        machine_client = env["roles"]["bus-client"]
+
+    machine_client = set(m.alias for m in machine_client)
+    machine_server = env["roles"]["bus"]
+    if "bus-server" in env["roles"]:
+        machine_server = env["roles"]["bus-server"]
+
+    machine_server = set(m.alias for m in machine_server)
+    # with a hierarchical topology, clients and servers are bound to the edge
+    # routers only
+    agents_bus_conf = [b for b in bus_conf if b.is_edge()] or bus_conf
+    binding = env.get("binding", BINDING)
+    return {
+        "rpc-client": get_binding(binding, [
+            b for b in agents_bus_conf
+            if b.get_listener()["machine"] in machine_client]),
+        "rpc-server": get_binding(binding, [
+            b for b in agents_bus_conf
+            if b.get_listener()["machine"] in machine_server]),
+        "controller": get_binding(binding, bus_conf)
+    }
+
+
 def generate_shard_conf(shard_index_ctl, shard_index_server, shard_index_client,
                         nbr_clients, nbr_servers, call_type,
                         nbr_calls, pause, timeout, length, executor, env,
-                        topics, iteration_id, **kwargs):
+                        topics, iteration_id, bindings=None, **kwargs):
     """Generates the configuration of the agents of 1 shard (for 1 controller)."""
     # build the specific variables for each client/server:
     # ombt_conf = {
@@ -447,26 +736,18 @@ def generate_shard_conf(shard_index_ctl, shard_index_server, shard_index_client,
     if not topics:
         return ombt_confs
 
-    bus_conf = env["bus_conf"]
     control_bus_conf = [env["control_bus_conf"][shard_index_ctl]]
-    machine_client = env["roles"]["bus"]
-    if "bus-client" in env["roles"]:
-        machine_client = env["roles"]["bus-client"]
-
-    machine_client = [m.alias for m in machine_client]
-    machine_server = env["roles"]["bus"]
-    if "bus-server" in env["roles"]:
-        machine_server = env["roles"]["bus-server"]
-
-    machine_server = [m.alias for m in machine_server]
+    # bindings are shared by all the shards of a test case, so that the bus
+    # agents are balanced globally
+    if bindings is None:
+        bindings = get_bindings(env)
     # description template of agents
     descs = [
         {
             "agent_type": "rpc-client",
             "number": nbr_clients,
             "machines": env["roles"]["ombt-client"],
-            "bus_agents": [b for b in bus_conf
-                           if b.get_listener()["machine"] in machine_client],
+            "binding": bindings["rpc-client"],
             "klass": OmbtClient,
             "kwargs": {
                 "timeout": timeout,
@@ -477,8 +758,7 @@ def generate_shard_conf(shard_index_ctl, shard_index_server, shard_index_client,
             "agent_type": "rpc-server",
             "number": nbr_servers,
             "machines": env["roles"]["ombt-server"],
-            "bus_agents": [b for b in bus_conf
-                           if b.get_listener()["machine"] in machine_server],
+            "binding": bindings["rpc-server"],
             "klass": OmbtServer,
             "kwargs": {
                 "timeout": timeout,
@@ -490,7 +770,7 @@ def generate_shard_conf(shard_index_ctl, shard_index_server, shard_index_client,
             "agent_type": "controller",
             "number": 1,
             "machines": env["roles"]["ombt-control"],
-            "bus_agents": bus_conf,
+            "binding": bindings["controller"],
             "klass": OmbtController,
             "kwargs": {
                 "call_type": call_type,
@@ -502,6 +782,8 @@ def generate_shard_conf(shard_index_ctl, shard_index_server, shard_index_client,
             "shard_index": shard_index_ctl
         }]
 
+    # agents bound to the same bus/control agent share the same tuple
+    interned = {}
     for agent_desc in descs:
         agent_type = agent_desc["agent_type"]
         machines = agent_desc["machines"]
@@ -529,90 +811,267 @@ def generate_shard_conf(shard_index_ctl, shard_index_server, shard_index_client,
             # choose a machine
             machine = machines[idx % len(machines)].alias
             # choose a bus agent
-            bus_agent = agent_desc["bus_agents"][idx % len(agent_desc["bus_agents"])]
+            bus_agent = agent_desc["binding"](idx, machine)
             agent_id = "%s-%s-%s-%s-%s" % (agent_type, agent_index,
                                            topic, iteration_id, shard_index)
             control_agent = control_bus_conf[agent_index % len(control_bus_conf)]
             kwargs = agent_desc["kwargs"]
             kwargs.update({"agent_id": agent_id,
                            "machine": machine,
-                           "bus_agents": [bus_agent],
+                           "bus_agents": interned.setdefault(
+                               id(bus_agent), (bus_agent,)),
                            "topic": topic,
-                           "control_agents": [control_agent]})
+                           "control_agents": interned.setdefault(
+                               id(control_agent), (control_agent,))})
             agent_conf = agent_desc["klass"](**kwargs)
             ombt_confs[agent_type].setdefault(machine, []).append(agent_conf)
 
     return ombt_confs
 
 
-def test_case(ombt_confs, version=VERSION, env=None, backup_dir=BACKUP_DIR, **kwargs):
-
-    def serialize_ombt_confs(_ombt_confs):
-        ansible_ombt_confs = {}
-        for agent_type, machines in _ombt_confs.items():
-            ansible_ombt_confs.setdefault(agent_type, {})
-
-            for machine, confs in machines.items():
-                ansible_ombt_confs[agent_type].update(
-                    {machine: [c.to_dict() for c in confs]})
-
-        return ansible_ombt_confs
-
-    backup_dir = get_backup_directory(backup_dir)
+def write_plan(ombt_confs, hosts, plan_dir):
+    """Write the plan of each host in its own file.
+
+    The file <plan_dir>/<host>.json gives for each agent type the agents of
+    the host. Every host gets a file (possibly empty) so that a host only
+    loads its own slice of the plan.
+
+    >>> import tempfile
+    >>> from orchestrator.ombt import OmbtClient, RabbitMQConf
+    >>> bus = RabbitMQConf({"agent_id": "rabbitmq-0", "machine": "bus-0",
+    ...                     "port": 5672})
+    >>> client = OmbtClient(agent_id="client-0", machine="agent-0",
+    ...                     control_agents=(bus,), bus_agents=(bus,),
+    ...                     timeout=60, topic="topic-0")
+    >>> plan_dir = tempfile.mkdtemp()
+    >>> write_plan({"rpc-client": {"agent-0": [client]}},
+    ...            ["agent-0", "agent-1"], plan_dir)
+    >>> with open(path.join(plan_dir, "agent-0.json")) as f:
+    ...     [a["name"] for a in json.load(f)["rpc-client"]]
+    ['client-0']
+    >>> with open(path.join(plan_dir, "agent-1.json")) as f:
+    ...     json.load(f)
+    {}
+
+    :param ombt_confs: the agents (as merged by merge_ombt_confs)
+    :param hosts: all the hosts that may run agents
+    :param plan_dir: directory of the plan files
+    """
+    plans = dict((host, {}) for host in hosts)
+    for agent_type, machines in ombt_confs.items():
+        for machine, confs in machines.items():
+            plans.setdefault(machine, {})[agent_type] = confs
+
+    pathlib.Path(plan_dir).mkdir(parents=True, exist_ok=True)
+    for host, plan in plans.items():
+        with open(path.join(plan_dir, "%s.json" % host), "w") as f:
+            json.dump({agent_type: [c.to_dict() for c in confs]
+                       for agent_type, confs in plan.items()},
+                      f, separators=(",", ":"))
+
+
+def test_case(ombt_confs, version=VERSION, env=None, backup_dir=BACKUP_DIR,
+              backup_sample=BACKUP_SAMPLE, **kwargs):
+    backup_dir = get_backup_directory(backup_dir, env)
+    # each host reads its own part of the plan
+    plan_dir = path.join(env["resultdir"], "plan")
+    hosts = set(h.alias for role in ["ombt-client", "ombt-server", "ombt-control"]
+                for h in env["roles"].get(role, []))
+    write_plan(ombt_confs, hosts, plan_dir)
     extra_vars = {
         "backup_dir": backup_dir,
         # NOTE(msimonin): This could be moved in each conf
         "ombt_version": version,
         "broker": env["broker"],
-        "ombt_confs": serialize_ombt_confs(ombt_confs)
+        "ombt_plan_dir": plan_dir,
+        "ombt_backup_sample": backup_sample
     }
 
-    run_ansible([path.join(ANSIBLE_DIR, "test_case.yml")],
-                env["inventory"], extra_vars=extra_vars)
+    # start of the metrics to backup (see backup)
+    env["test_case_start"] = time.time()
+    watchdog = start_watchdog(env)
+    try:
+        run_playbook("test_case.yml", env, extra_vars=extra_vars)
+    except Exception:
+        if watchdog is None or watchdog.reason is None:
+            raise
+        # the partial results are the samples of the watchdog and the logs
+        # of the ombt agents (the backup of test_case.yml didn't run)
+        with open(path.join(backup_dir, "watchdog.json"), "w") as f:
+            json.dump({"reason": watchdog.reason,
+                       "samples": watchdog.samples}, f)
+        try:
+            run_playbook("ombt.yml", env,
+                         extra_vars=dict(extra_vars, enos_action="backup"))
+        except EnosError as error:
+            # e.g the logs of the removed controllers are missing
+            logger.warning("Partial backup of the ombt agents: %s", error)
+        raise Saturated(watchdog.reason, watchdog.samples)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+
+
+def start_watchdog(env):
+    """Follow the bus during a test case (see orchestrator.watchdog).
+
+    :return: the watchdog (None if not configured)
+    :raise ValueError: the configuration of the watchdog can't apply to the
+        bus
+    """
+    config = env["config"].get("watchdog")
+    influxdb = env["roles"].get("influxdb")
+    if config is None or not influxdb or is_simulated(env):
+        return None
+    if is_partition(env):
+        # the metrics of the bus of the other partitions can't be told apart
+        logger.info("The watchdog is disabled in the partitions")
+        return None
+    config = get_config(config, env["broker"])
+    if env["broker"] == "qdr":
+        # collectd runs in the container of each router (see the qdr role)
+        bus_hosts = [c.get_id() for c in env["bus_conf"]]
+    else:
+        bus_hosts = [h.alias for h in env["roles"]["bus"]]
+    watchdog = Watchdog(influxdb[0].address, config,
+                        lambda reason: stop_controllers(env), bus_hosts)
+    watchdog.start()
+    return watchdog
+
+
+def stop_controllers(env):
+    """Remove the ombt controllers, the test case then fails right away.
+
+    This runs in the watchdog thread, out of the Ansible API (which isn't
+    thread-safe).
+    """
+    subprocess.call(["ansible", "ombt-control", "-i", env["inventory"],
+                     "-m", "shell", "-a",
+                     "docker ps -aq --filter name=controller- "
+                     "| xargs -r docker rm -f"])
 
 
 @enostask()
+@timed
 def emulate(**kwargs):
+    """Apply the network constraints of a traffic configuration.
+
+    Only the machines whose constraints changed since the previous call get
+    their tc rules again (see orchestrator.network), no configuration
+    (configuration_name None) removes the constraints applied.
+    """
     env = kwargs.pop("env")
     configuration_name = kwargs.pop("configuration_name")
-    network_constraints = env["config"]["traffic"].get(configuration_name)
-    for name, value in kwargs.items():
-        network_constraints[name] = value
-
-    roles = env["roles"]
-    _inventory = env["inventory"]
-    emulate_network(roles, _inventory, network_constraints)
+    network_constraints = None
+    if configuration_name is not None:
+        network_constraints = dict(
+            env["config"]["traffic"].get(configuration_name))
+        for name, value in kwargs.items():
+            network_constraints[name] = value
+
+    roles = get_network_roles(env)
+    constraints = network.get_constraints(roles, network_constraints)
+    groups = network.changed_groups(env.get("network_constraints"),
+                                    constraints)
+    if not groups:
+        logger.info("The network constraints are already applied")
+        return
+    hosts = network.get_hosts(roles, groups)
+    if is_simulated(env):
+        record_call(env, "emulate_network", {"constraints": constraints,
+                                             "tc_hosts": hosts})
+    else:
+        use_fact_cache(env)
+        extra_vars = {
+            "enoslib_utils_role": network.UTILS_ROLE,
+            "ips_with_constraints": network.get_ip_constraints(
+                roles, get_ips(env), constraints),
+            # no constraint left: the rules are only removed
+            "tc_enable": bool(constraints),
+            "tc_hosts": ",".join(hosts),
+            "enos_action": "tc_apply"
+        }
+        run_playbook("netem.yml", env, extra_vars=extra_vars)
+    env["network_constraints"] = constraints
+
+
+def get_ips(env):
+    """Addresses and network devices of the machines (dumped once)."""
+    ips_file = path.join(env["resultdir"], "ips.yml")
+    if not path.exists(ips_file):
+        extra_vars = {
+            "enoslib_utils_role": network.UTILS_ROLE,
+            "ips_file": ips_file,
+            "enos_action": "tc_ips"
+        }
+        run_playbook("netem.yml", env, extra_vars=extra_vars)
+    with open(ips_file) as f:
+        return yaml.safe_load(f)
 
 
 @enostask()
+@timed
 def validate(**kwargs):
+    """Check the latency between the machines.
+
+    All the pairs of machines are checked once the constraints changed (or
+    with full), a sample of them otherwise (validation.fraction of the
+    configuration).
+    """
     env = kwargs["env"]
-    _inventory = env["inventory"]
-    roles = env["roles"]
     directory = kwargs.get("directory", BACKUP_DIR)
-    backup_dir = get_backup_directory(directory)
-    validate_network(roles, _inventory, output_dir=backup_dir)
+    backup_dir = get_backup_directory(directory, env)
+    constraints = env.get("network_constraints") or []
+    full = kwargs.get("full") or env.get("network_validated") != constraints
+    fraction = 1.0 if full else env["config"].get("validation", {}).get(
+        "fraction", VALIDATION_FRACTION)
+    machines = dict((h.alias, h.address) for hosts in
+                    get_network_roles(env).values() for h in hosts)
+    targets = network.sample_pairs(sorted(machines.items()), fraction,
+                                   seed=directory)
+    extra_vars = {
+        "tc_hosts": ",".join(sorted(targets)),
+        "tc_targets": targets,
+        "tc_output_dir": backup_dir
+    }
+    if is_simulated(env):
+        record_call(env, "validate_network", extra_vars)
+    elif targets:
+        use_fact_cache(env)
+        run_playbook("validate_network.yml", env, extra_vars=extra_vars)
+    if full:
+        env["network_validated"] = constraints
 
 
 @enostask()
+@timed
 def reset(**kwargs):
     env = kwargs["env"]
     _inventory = env["inventory"]
-    roles = env["roles"]
+    roles = get_network_roles(env)
+    env["network_constraints"] = None
+    if is_simulated(env):
+        record_call(env, "reset_network")
+        return
+    use_fact_cache(env)
     reset_network(roles, _inventory)
 
 
 @enostask()
+@timed
 def backup(**kwargs):
     env = kwargs["env"]
     backup_dir = kwargs["backup_dir"]
-    backup_dir = get_backup_directory(backup_dir)
+    backup_dir = get_backup_directory(backup_dir, env)
     extra_vars = {
         "enos_action": "backup",
         "backup_dir": backup_dir,
         # NOTE(msimonin): this broker variable should be renamed
         # This corresponds to driver.type, or maybe embed this in the bus conf
         "broker": env["broker"],
+        # only the metrics of the last test case are exported
+        "influxdb_backup_start": to_rfc3339(env.get("test_case_start")),
+        "influxdb_backup_end": to_rfc3339(time.time())
     }
 
     ansible_bus_conf = generate_ansible_conf("bus_conf", env.get("bus_conf"))
@@ -620,13 +1079,32 @@ def backup(**kwargs):
                                                      env.get("control_bus_conf"))
     extra_vars.update(ansible_bus_conf)
     extra_vars.update(ansible_control_bus_conf)
-    run_ansible([path.join(ANSIBLE_DIR, "site.yml")],
-                env["inventory"], extra_vars=extra_vars)
+    run_playbook("site.yml", env, extra_vars=extra_vars)
+
+
+def to_rfc3339(timestamp):
+    """Format a timestamp as expected by influxd backup.
+
+    >>> to_rfc3339(1530000000.5)
+    '2018-06-26T08:00:00Z'
+    >>> to_rfc3339(None)
+    ''
+
+    :param timestamp: seconds since the epoch (None for no bound)
+    """
+    if timestamp is None:
+        return ""
+    return datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
 @enostask()
+@timed
 def destroy(**kwargs):
     env = kwargs["env"]
+    destroy_deployment(env)
+
+
+def destroy_deployment(env):
     # Call destroy on each component
     extra_vars = {
         "enos_action": "destroy",
@@ -640,13 +1118,14 @@ def destroy(**kwargs):
                                                      env.get("control_bus_conf"))
     extra_vars.update(ansible_bus_conf)
     extra_vars.update(ansible_control_bus_conf)
-    run_ansible([path.join(ANSIBLE_DIR, "site.yml")],
-                env["inventory"], extra_vars=extra_vars)
-    run_ansible([path.join(ANSIBLE_DIR, "ombt.yml")],
-                env["inventory"], extra_vars=extra_vars)
+    # a partially destroyed bus can't be reused
+    env["deployed"] = None
+    run_playbook("site.yml", env, extra_vars=extra_vars)
+    run_playbook("ombt.yml", env, extra_vars=extra_vars)
 
 
 @enostask()
+@timed
 def info(**kwargs):
     env = kwargs["env"]
     ansible_bus_conf = generate_ansible_conf("bus_conf", env.get("bus_conf"))
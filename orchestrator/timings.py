@@ -0,0 +1,215 @@
+"""Wall-clock timings of the phases of the orchestrator.
+
+Every task (see :py:func:`timed`) and every campaign iteration (see
+:py:func:`iteration`) appends a record to the timings file of the current
+iteration: <env_dir>/timings/<iteration>.jsonl. The Ansible plays and tasks
+run during a task are recorded in the same file by the oo_timings callback
+plugin (orchestrator/ansible/callback_plugins).
+
+A record is a JSON object (one per line)::
+
+    {"kind": "task", "phase": "prepare", "start": 1530000000.0,
+     "end": 1530000042.0, "duration": 42.0, "status": "ok"}
+
+kind is one of iteration, task (an orchestrator task), play or ansible_task.
+The Ansible records also give the orchestrator task (parent) they belong to.
+"""
+import contextlib
+import glob
+import json
+import os
+import time
+from functools import wraps
+from os import path
+
+from ansible.plugins.loader import callback_loader
+
+from orchestrator.constants import ANSIBLE_DIR
+
+TIMINGS_DIR = "timings"
+# timings file of the tasks run outside of a campaign iteration
+MAIN = "main"
+# read by the callback plugin
+FILE_VARIABLE = "OO_TIMINGS_FILE"
+PARENT_VARIABLE = "OO_TIMINGS_PARENT"
+
+# also record the playbooks shipped with enoslib (emulate, validate, reset)
+callback_loader.add_directory(path.join(ANSIBLE_DIR, "callback_plugins"))
+
+# stack of the iterations in progress
+_iterations = []
+
+
+def get_timings_file(env_dir, name=None):
+    """Timings file of an iteration (default to the current one).
+
+    >>> get_timings_file("/tmp/test_case_1", "A-0")
+    '/tmp/test_case_1/timings/A-0.jsonl'
+    >>> get_timings_file("/tmp/test_case_1")
+    '/tmp/test_case_1/timings/main.jsonl'
+    """
+    if name is None:
+        name = _iterations[-1] if _iterations else MAIN
+    return path.join(env_dir, TIMINGS_DIR, "%s.jsonl" % name)
+
+
+def record(timings_file, kind, phase, start, end, status="ok", **extra):
+    """Append a record to a timings file."""
+    entry = {
+        "kind": kind,
+        "phase": phase,
+        "start": start,
+        "end": end,
+        "duration": end - start,
+        "status": status
+    }
+    entry.update(extra)
+    directory = path.dirname(timings_file)
+    if not path.isdir(directory):
+        os.makedirs(directory)
+    with open(timings_file, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def timed(fn):
+    """Record the timings of a task.
+
+    This goes below the enostask decorator (the env must be injected)::
+
+        @enostask()
+        @timed
+        def prepare(**kwargs):
+            ...
+    """
+    @wraps(fn)
+    def decorated(*args, **kwargs):
+        timings_file = get_timings_file(kwargs["env"]["resultdir"])
+        previous = (os.environ.get(FILE_VARIABLE),
+                    os.environ.get(PARENT_VARIABLE))
+        os.environ[FILE_VARIABLE] = timings_file
+        os.environ[PARENT_VARIABLE] = fn.__name__
+        start = time.time()
+        status = "failed"
+        try:
+            r = fn(*args, **kwargs)
+            status = "ok"
+            return r
+        finally:
+            record(timings_file, "task", fn.__name__, start, time.time(),
+                   status=status)
+            # tasks may be nested (e.g a provider task calling another task)
+            for variable, value in zip([FILE_VARIABLE, PARENT_VARIABLE],
+                                       previous):
+                if value is None:
+                    os.environ.pop(variable, None)
+                else:
+                    os.environ[variable] = value
+    return decorated
+
+
+@contextlib.contextmanager
+def iteration(env_dir, name):
+    """Record the timings of a campaign iteration.
+
+    The tasks run inside the block are recorded in the timings file of the
+    iteration.
+
+    >>> import tempfile
+    >>> env_dir = tempfile.mkdtemp()
+    >>> with iteration(env_dir, "A-0"):
+    ...     get_timings_file(env_dir) == get_timings_file(env_dir, "A-0")
+    True
+    >>> [r["phase"] for r in load(env_dir)]
+    ['A-0']
+    """
+    _iterations.append(name)
+    start = time.time()
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        _iterations.pop()
+        record(get_timings_file(env_dir, name), "iteration", name, start,
+               time.time(), status=status)
+
+
+def load(env_dir):
+    """Load all the timings records of an environment."""
+    records = []
+    for timings_file in sorted(glob.glob(get_timings_file(env_dir, "*"))):
+        iteration_name = path.splitext(path.basename(timings_file))[0]
+        with open(timings_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["iteration"] = iteration_name
+                records.append(entry)
+    return records
+
+
+def durations(env_dir, name, kinds=("task",)):
+    """Total duration of each phase of an iteration (so far).
+
+    >>> import tempfile
+    >>> env_dir = tempfile.mkdtemp()
+    >>> timings_file = get_timings_file(env_dir, "A-0")
+    >>> record(timings_file, "task", "prepare", 0.0, 30.0)
+    >>> record(timings_file, "task", "reset", 30.0, 32.5)
+    >>> record(timings_file, "task", "reset", 40.0, 42.5)
+    >>> sorted(durations(env_dir, "A-0").items())
+    [('prepare', 30.0), ('reset', 5.0)]
+
+    :param env_dir: the environment directory
+    :param name: the name of the iteration
+    :param kinds: kinds of records to keep
+    """
+    phases = {}
+    timings_file = get_timings_file(env_dir, name)
+    if not path.exists(timings_file):
+        return phases
+    with open(timings_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["kind"] in kinds:
+                phases[entry["phase"]] = phases.get(entry["phase"], 0) + \
+                    entry["duration"]
+    return phases
+
+
+def summarize(records, kinds=None):
+    """Aggregate the records per phase, the slowest phases first.
+
+    >>> records = [
+    ...     {"kind": "task", "phase": "prepare", "duration": 30.0},
+    ...     {"kind": "task", "phase": "prepare", "duration": 10.0},
+    ...     {"kind": "task", "phase": "backup", "duration": 5.0},
+    ...     {"kind": "ansible_task", "phase": "ombt : pull", "duration": 8.0,
+    ...      "parent": "prepare"}]
+    >>> for row in summarize(records, kinds=["task"]):
+    ...     print(row)
+    ('task', 'prepare', 2, 40.0, 20.0, 30.0)
+    ('task', 'backup', 1, 5.0, 5.0, 5.0)
+    >>> summarize(records, kinds=["ansible_task"])
+    [('ansible_task', 'prepare/ombt : pull', 1, 8.0, 8.0, 8.0)]
+
+    :param records: the records to aggregate (see :py:func:`load`)
+    :param kinds: kinds of records to keep (default to all)
+    :return: a list of (kind, phase, count, total, mean, max)
+    """
+    phases = {}
+    for entry in records:
+        if kinds and entry["kind"] not in kinds:
+            continue
+        phase = entry["phase"]
+        if entry.get("parent"):
+            phase = "%s/%s" % (entry["parent"], phase)
+        phases.setdefault((entry["kind"], phase), []).append(entry["duration"])
+
+    rows = [(kind, phase, len(durations), sum(durations),
+             sum(durations) / len(durations), max(durations))
+            for (kind, phase), durations in phases.items()]
+    return sorted(rows, key=lambda row: row[3], reverse=True)
@@ -0,0 +1,299 @@
+"""Early termination of the test cases once the bus is clearly saturated.
+
+A test case runs until its controllers exit, i.e up to their timeout when the
+bus is overloaded. The watchdog follows the bus while the test case runs (the
+metrics collected by telegraf in InfluxDB) and aborts the test case as soon as
+one of its criteria trips:
+
+- max_queue_depth: the backlog of the bus exceeds a threshold,
+- queue_growth: the backlog grows at each of the last window samples,
+- plateau: the delivery rate is flat (within plateau_tolerance) while the
+  backlog grows during the last window samples,
+- max_errors: the deliveries which failed since the first sample (rejected,
+  released or modified by the routers, e.g the rpc-calls timed out) exceed a
+  threshold.
+
+It's enabled by the watchdog section of the configuration::
+
+    watchdog:
+      period: 10         # seconds between two samples
+      grace: 60          # seconds before the first sample
+      window: 6          # samples
+      max_queue_depth: 100000
+      min_queue_depth: 1000   # backlog below which nothing trips
+      plateau_tolerance: 0.05
+      max_errors: 100
+
+The metrics are read with InfluxQL queries on the agents of the bus only
+({hosts} is replaced by a regex of their names), by default (see QUERIES):
+
+- rabbitmq: the rabbitmq input of telegraf on the bus machines (the control
+  bus reports the same measurement), it has no errors query,
+- qdr: the collectd-qdrouterd plugin of the routers, tagged with the id of
+  the router (hostname of its container) and sent to the collectd input of
+  InfluxDB (measurement <plugin>_value, the collectd type as tag).
+
+They can be overridden with the queue_depth, delivered and errors keys. A
+configuration which can't apply to a bus (unknown key, no query for a
+criterion) is rejected (see :py:func:`get_config`). The watchdog gives up when
+the queue depth can't be read during window samples. The ombt agents don't
+report anything before the end of the test, so the progress of the
+controllers can't be followed live.
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+try:
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+except ImportError:
+    from urllib import urlencode
+    from urllib2 import urlopen
+
+logger = logging.getLogger(__name__)
+
+# backlog and delivered messages (counter) of the bus, the overview of a
+# rabbitmq cluster is reported by each of its nodes
+QUEUE_DEPTH = ('SELECT max("messages") FROM (SELECT last("messages") AS '
+               '"messages" FROM "rabbitmq_overview" WHERE time > now() - 1m '
+               'AND "host" =~ /{hosts}/ GROUP BY "host")')
+DELIVERED = ('SELECT max("delivered") FROM (SELECT last("messages_delivered") '
+             'AS "delivered" FROM "rabbitmq_overview" WHERE time > now() - 1m '
+             'AND "host" =~ /{hosts}/ GROUP BY "host")')
+# undelivered messages, deliveries leaving the routers (counter) and failed
+# deliveries (counters) of all the links of the routers
+QDR_QUEUE_DEPTH = ('SELECT sum("depth") FROM (SELECT last("value") AS "depth" '
+                   'FROM "qdrouterd_value" WHERE "type" = \'undelivered-count\' '
+                   'AND time > now() - 1m AND "host" =~ /{hosts}/ GROUP BY *)')
+QDR_DELIVERED = ('SELECT sum("delivered") FROM (SELECT last("value") AS '
+                 '"delivered" FROM "qdrouterd_value" WHERE '
+                 '"type" = \'deliveries-egress\' AND time > now() - 1m '
+                 'AND "host" =~ /{hosts}/ GROUP BY *)')
+QDR_ERRORS = ('SELECT sum("errors") FROM (SELECT last("value") AS "errors" '
+              'FROM "qdrouterd_value" WHERE '
+              '"type" =~ /^(rejected|released|modified)-count$/ '
+              'AND time > now() - 1m AND "host" =~ /{hosts}/ GROUP BY *)')
+# default queries of each bus
+QUERIES = {
+    "rabbitmq": {
+        "queue_depth": QUEUE_DEPTH,
+        "delivered": DELIVERED,
+        "errors": None
+    },
+    "qdr": {
+        "queue_depth": QDR_QUEUE_DEPTH,
+        "delivered": QDR_DELIVERED,
+        "errors": QDR_ERRORS
+    }
+}
+
+DEFAULTS = {
+    "period": 10,
+    "grace": 60,
+    "window": 6,
+    "max_queue_depth": None,
+    "min_queue_depth": 1000,
+    "plateau_tolerance": 0.05,
+    "max_errors": None,
+    "queue_depth": None,
+    "delivered": None,
+    "errors": None,
+    # database of telegraf and collectd (see telegraf.conf.j2, influxdb.conf)
+    "database": "ombt-orchestrator",
+}
+
+
+def get_config(config, broker):
+    """The configuration of the watchdog of a bus.
+
+    >>> get_config({"max_errors": 10}, "qdr")["errors"] == QDR_ERRORS
+    True
+    >>> get_config({"max_errors": 10}, "rabbitmq")
+    Traceback (most recent call last):
+    ...
+    ValueError: watchdog: max_errors needs an errors query for a rabbitmq bus
+    >>> get_config({"max_queue_depht": 10}, "qdr")
+    Traceback (most recent call last):
+    ...
+    ValueError: watchdog: unknown key max_queue_depht
+
+    :param config: the watchdog section of the configuration
+    :param broker: the type of the bus (driver)
+    :raise ValueError: the configuration can't apply to the bus
+    """
+    unknown = sorted(set(config) - set(DEFAULTS))
+    if unknown:
+        raise ValueError("watchdog: unknown key %s" % ", ".join(unknown))
+    merged = dict(DEFAULTS, **QUERIES.get(broker, {}))
+    merged.update(config)
+    if merged["queue_depth"] is None:
+        raise ValueError("watchdog: no queue_depth query for a %s bus"
+                         % broker)
+    if merged["max_errors"] is not None and merged["errors"] is None:
+        raise ValueError("watchdog: max_errors needs an errors query for a "
+                         "%s bus" % broker)
+    return merged
+
+
+class Saturated(RuntimeError):
+    """The test case has been aborted by the watchdog."""
+
+    def __init__(self, reason, samples=None):
+        super(Saturated, self).__init__(reason)
+        self.reason = reason
+        self.samples = samples or []
+
+
+def check(samples, config):
+    """Tell why the bus is saturated (None if it isn't).
+
+    >>> config = dict(DEFAULTS, window=3, max_queue_depth=10000,
+    ...               max_errors=100)
+    >>> # (time, queue depth, delivered messages, failed deliveries)
+    >>> check([(0, 0, 0, 0), (10, 2000, 1000, 0), (20, 4000, 2000, 50)],
+    ...       config)
+    >>> check([(0, 0, 0, 0), (10, 2000, 1000, 0), (20, 20000, 2000, 0)],
+    ...       config)
+    'max_queue_depth: 20000 > 10000'
+    >>> check([(0, 0, 0, 10), (10, 200, 1000, 60), (20, 400, 2000, 120)],
+    ...       config)
+    'max_errors: 110 > 100'
+    >>> check([(0, 2000, 0, None), (10, 3000, 1000, None),
+    ...        (20, 4000, 2000, None), (30, 5000, 4000, None)], config)
+    'queue_growth: 2000 -> 5000 in 3 samples'
+    >>> check([(0, 2000, 0, None), (10, 3000, 1000, None),
+    ...        (20, 4000, 2000, None), (30, 3500, 3000, None)],
+    ...       dict(config, window=2))
+    'plateau: 100.0 msg/s while the queue grows 3000 -> 3500'
+
+    :param samples: the (time, queue depth, delivered messages, failed
+        deliveries) sampled
+    :param config: the configuration of the watchdog
+    """
+    errors = [s[3] for s in samples if s[3] is not None]
+    if config["max_errors"] is not None and errors and \
+            errors[-1] - errors[0] > config["max_errors"]:
+        return "max_errors: %s > %s" % (errors[-1] - errors[0],
+                                       config["max_errors"])
+    samples = [s for s in samples if s[1] is not None]
+    if not samples:
+        return None
+    depth = samples[-1][1]
+    if config["max_queue_depth"] is not None and \
+            depth > config["max_queue_depth"]:
+        return "max_queue_depth: %s > %s" % (depth, config["max_queue_depth"])
+
+    window = config["window"]
+    if len(samples) <= window:
+        return None
+    last = samples[-window - 1:]
+    depths = [s[1] for s in last]
+    if depths[0] < config["min_queue_depth"]:
+        return None
+    if all(d1 < d2 for d1, d2 in zip(depths, depths[1:])):
+        return "queue_growth: %s -> %s in %s samples" % (
+            depths[0], depths[-1], window)
+
+    if any(s[2] is None for s in last):
+        return None
+    rates = [(s2[2] - s1[2]) / float(s2[0] - s1[0])
+             for s1, s2 in zip(last, last[1:])]
+    flat = max(rates) - min(rates) <= config["plateau_tolerance"] * max(rates)
+    if flat and depths[-1] > depths[0]:
+        return "plateau: %s msg/s while the queue grows %s -> %s" % (
+            rates[-1], depths[0], depths[-1])
+    return None
+
+
+def hosts_regex(hosts):
+    """Regex of the host tag of the metrics of some machines.
+
+    Telegraf tags the metrics with the hostname of the machine, which may be
+    the short name of its alias.
+
+    >>> print(hosts_regex(["paravance-1.rennes.grid5000.fr", "paravance-2"]))
+    ^(paravance\\-1|paravance\\-2)(\\..*)?$
+
+    :param hosts: the aliases of the machines
+    """
+    names = sorted(set(re.escape(h.split(".")[0]) for h in hosts))
+    return "^(%s)(\\..*)?$" % "|".join(names)
+
+
+def query_influxdb(host, query, database="ombt-orchestrator", port=8086,
+                   timeout=5):
+    """The first value returned by an InfluxQL query (None if there's none)."""
+    url = "http://%s:%s/query?%s" % (host, port,
+                                      urlencode({"db": database, "q": query}))
+    response = urlopen(url, timeout=timeout)
+    try:
+        results = json.loads(response.read().decode("utf-8"))["results"]
+    finally:
+        response.close()
+    series = results[0].get("series") if results else None
+    if not series:
+        return None
+    return series[0]["values"][0][1]
+
+
+class Watchdog(threading.Thread):
+    """Sample the bus in the background and call abort once saturated.
+
+    :param host: the InfluxDB host
+    :param config: the configuration of the watchdog (see get_config)
+    :param abort: called (once) with the reason when a criterion trips
+    :param bus_hosts: the aliases of the machines of the bus
+    """
+
+    def __init__(self, host, config, abort, bus_hosts):
+        super(Watchdog, self).__init__()
+        self.daemon = True
+        self.host = host
+        self.config = dict(DEFAULTS, **config)
+        self.hosts = hosts_regex(bus_hosts)
+        self.abort = abort
+        self.samples = []
+        self.reason = None
+        self._stopped = threading.Event()
+
+    def sample(self):
+        values = []
+        for name in ["queue_depth", "delivered", "errors"]:
+            query = self.config[name]
+            if query is None:
+                values.append(None)
+                continue
+            try:
+                values.append(query_influxdb(
+                    self.host, query.replace("{hosts}", self.hosts),
+                    database=self.config["database"]))
+            except Exception as error:
+                # the test case must go on anyway
+                logger.debug("Watchdog query failed: %s", error)
+                values.append(None)
+        return (time.time(), values[0], values[1], values[2])
+
+    def run(self):
+        self._stopped.wait(self.config["grace"])
+        window = self.config["window"]
+        while not self._stopped.is_set():
+            self.samples.append(self.sample())
+            if len(self.samples) >= window and \
+                    all(s[1] is None for s in self.samples[-window:]):
+                logger.warning("Watchdog: no queue depth of the bus in %s "
+                               "samples, disabled", window)
+                return
+            self.reason = check(self.samples, self.config)
+            if self.reason:
+                logger.warning("Watchdog: aborting the test case (%s)",
+                               self.reason)
+                self.abort(self.reason)
+                return
+            self._stopped.wait(self.config["period"])
+
+    def stop(self):
+        self._stopped.set()
+        self.join()